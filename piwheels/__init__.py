@@ -53,7 +53,7 @@ defined:
 # pylint: disable=bad-whitespace
 
 __project__      = 'piwheels'
-__version__      = '0.12'
+__version__      = '0.13'
 __keywords__     = ['raspberrypi', 'pip', 'wheels']
 __author__       = 'Ben Nuttall'
 __author_email__ = 'ben@raspberrypi.org'
@@ -89,6 +89,7 @@ __entry_points__ = {
         'piw-initdb = piwheels.initdb:main',
         'piw-import = piwheels.importer:main',
         'piw-remove = piwheels.remove:main',
+        'piw-rebuild = piwheels.rebuild:main',
         'piw-logger = piwheels.logger:main',
     ],
 }
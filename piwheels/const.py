@@ -49,8 +49,14 @@ SLAVE_QUEUE = 'tcp://*:5555'
 FILE_QUEUE = 'tcp://*:5556'
 IMPORT_QUEUE = 'ipc:///tmp/piw-import'
 LOG_QUEUE = 'ipc:///tmp/piw-logger'
+INDEX_DELAY = 2.0
 
 # NOTE: The following queues are *not* configurable and should always be an
 # inproc queue
 INT_STATUS_QUEUE = 'inproc://status'
 ORACLE_QUEUE = 'inproc://oracle'
+
+# The version of the protocol spoken between the build slaves and the master
+# (see the slaves chapter of the documentation); this must be bumped whenever a
+# message changes incompatibly
+SLAVE_PROTOCOL = 2
@@ -15,7 +15,7 @@ CREATE TABLE configuration (
     CONSTRAINT config_pk PRIMARY KEY (id)
 );
 
-INSERT INTO configuration(id, version) VALUES (1, '0.12');
+INSERT INTO configuration(id, version) VALUES (1, '0.13');
 GRANT SELECT,UPDATE ON configuration TO {username};
 
 -- packages
@@ -40,13 +40,16 @@ GRANT SELECT,INSERT,UPDATE ON packages TO {username};
 -- The "versions" table defines all versions of packages *with files* on PyPI;
 -- note that versions without released files (a common occurrence) are
 -- excluded. Like the "packages" table, the "skip" column can be set to "true"
--- to prevent particular versions from being built.
+-- to prevent particular versions from being built. The "added_at" column
+-- records when the version was first seen, and is used to prioritize builds
+-- of new versions.
 -------------------------------------------------------------------------------
 
 CREATE TABLE versions (
-    package VARCHAR(200) NOT NULL,
-    version VARCHAR(200) NOT NULL,
-    skip    BOOLEAN DEFAULT false NOT NULL,
+    package  VARCHAR(200) NOT NULL,
+    version  VARCHAR(200) NOT NULL,
+    skip     BOOLEAN DEFAULT false NOT NULL,
+    added_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
 
     CONSTRAINT versions_pk PRIMARY KEY (package, version),
     CONSTRAINT versions_package_fk FOREIGN KEY (package)
@@ -169,6 +172,7 @@ CREATE TABLE files (
 CREATE INDEX files_builds ON files(build_id);
 CREATE INDEX files_size ON files(platform_tag, filesize) WHERE platform_tag <> 'linux_armv6l';
 CREATE INDEX files_abi ON files(build_id, abi_tag);
+CREATE INDEX files_hash ON files(filehash);
 GRANT SELECT,INSERT,UPDATE ON files TO {username};
 
 -- downloads
@@ -293,6 +297,357 @@ GROUP BY
 
 GRANT SELECT ON builds_pending TO {username};
 
+-- build_queue_prior
+-------------------------------------------------------------------------------
+-- The "build_queue_prior" view returns the mean duration (in seconds) of the
+-- last thousand builds. This is the estimate used for packages with no build
+-- history when scoring the "build_queue" table below; it is limited to recent
+-- builds so that it can be read cheaply from the "builds_timestamp" index.
+-------------------------------------------------------------------------------
+
+CREATE VIEW build_queue_prior AS
+SELECT COALESCE(AVG(EXTRACT(EPOCH FROM duration)), 0) AS duration
+FROM (
+    SELECT duration
+    FROM builds
+    ORDER BY built_at DESC NULLS LAST
+    LIMIT 1000
+) AS t;
+
+GRANT SELECT ON build_queue_prior TO {username};
+
+-- build_queue
+-------------------------------------------------------------------------------
+-- The "build_queue" table is a materialized copy of the "builds_pending" view
+-- above. Scanning the view requires evaluating the whole of the EXCEPT ALL
+-- query, which gets slower and slower as the "builds" and "files" tables grow.
+-- Instead, the triggers below keep this table up to date by re-evaluating the
+-- view for just the affected (package, version) whenever a change is made to
+-- any of the tables it depends upon. The master's build queue is then a simple
+-- read of this table in "priority" order (via the "build_queue_priority"
+-- index).
+--
+-- Each row also carries a score ("priority") indicating how valuable the build
+-- is, and an estimate of how long it will take ("duration"). The master builds
+-- the highest scoring rows first so that popular packages don't wait behind
+-- long tails of obscure ones after every PyPI catch-up. The score is the sum
+-- of:
+--
+-- * the natural log of (one plus) the number of downloads of the package in
+--   the last month, so that popularity dominates without swamping everything
+--   else
+--
+-- * a recency bonus of up to 3 for versions recently added to the database;
+--   this halves for every 30 days since the version was added
+--
+-- * a bonus of 2 if the version already has files built for another ABI; such
+--   versions are installable on some Python versions but not others which is
+--   more confusing for users than a version that's simply missing
+--
+-- The duration estimate is the mean duration of all prior builds of the
+-- package, shrunk towards the mean duration of the last thousand builds (as if
+-- there were three extra builds of the package at that mean). This ensures
+-- packages with little history get a sensible estimate, while those with
+-- plenty are dominated by their own.
+--
+-- Both are calculated by "build_queue_reprioritize", which re-scores the whole
+-- table in one pass; the master calls it periodically as the score decays
+-- over time, and download counts change without firing any triggers. The
+-- triggers only maintain the table's membership, as they fire for every
+-- build and file logged and the download counts are far too costly to
+-- re-evaluate each time. A row that is re-inserted keeps its score, while a
+-- new row is given just the recency and ABI bonuses (which can be looked up
+-- directly) until the next re-scoring.
+--
+-- The trigger functions are defined with SECURITY DEFINER as the ordinary
+-- piwheels user only has SELECT rights on "build_queue".
+-------------------------------------------------------------------------------
+
+CREATE TABLE build_queue (
+    package VARCHAR(200) NOT NULL,
+    version VARCHAR(200) NOT NULL,
+    abi_tag VARCHAR(100) NOT NULL,
+    priority DOUBLE PRECISION NOT NULL DEFAULT 0,
+    duration INTERVAL NOT NULL DEFAULT INTERVAL '0',
+
+    CONSTRAINT build_queue_pk PRIMARY KEY (package, version),
+    CONSTRAINT build_queue_versions_fk FOREIGN KEY (package, version)
+        REFERENCES versions ON DELETE CASCADE
+);
+
+CREATE INDEX build_queue_priority ON build_queue(priority DESC);
+
+GRANT SELECT ON build_queue TO {username};
+
+CREATE FUNCTION build_queue_refresh(pkg VARCHAR, ver VARCHAR)
+    RETURNS VOID
+    LANGUAGE SQL
+    SECURITY DEFINER
+    SET search_path = public, pg_temp
+AS $sql$
+    -- This is the builds_pending view restricted to a single version;
+    -- PostgreSQL won't push the restriction down through EXCEPT ALL so it
+    -- has to be spelled out here. A row that was already queued keeps its
+    -- score and duration estimate; a new row gets just the parts of the score
+    -- that can be looked up directly, and the duration estimate of another
+    -- queued version of the package (if any). The rest is left to
+    -- build_queue_reprioritize as the aggregates involved are too costly to
+    -- evaluate every time a trigger fires
+    WITH old AS (
+        DELETE FROM build_queue
+        WHERE package = pkg AND version = ver
+        RETURNING priority, duration
+    ),
+    pending AS (
+        SELECT MIN(abi_tag) AS abi_tag
+        FROM (
+            SELECT b.abi_tag
+            FROM
+                packages AS p
+                JOIN versions AS v ON v.package = p.package
+                CROSS JOIN build_abis AS b
+            WHERE
+                v.package = pkg
+                AND v.version = ver
+                AND NOT v.skip
+                AND NOT p.skip
+
+            EXCEPT ALL
+
+            (
+                SELECT v.abi_tag
+                FROM
+                    builds AS b
+                    JOIN files AS f ON b.build_id = f.build_id
+                    CROSS JOIN build_abis AS v
+                WHERE
+                    b.package = pkg
+                    AND b.version = ver
+                    AND f.abi_tag = 'none'
+
+                UNION ALL
+
+                SELECT COALESCE(f.abi_tag, b.abi_tag) AS abi_tag
+                FROM
+                    builds AS b
+                    LEFT JOIN files AS f ON b.build_id = f.build_id
+                WHERE
+                    b.package = pkg
+                    AND b.version = ver
+                    AND (f.build_id IS NULL OR f.abi_tag <> 'none')
+            )
+        ) AS t
+        HAVING COUNT(*) > 0
+    )
+    INSERT INTO build_queue (package, version, abi_tag, priority, duration)
+    SELECT
+        pkg,
+        ver,
+        p.abi_tag,
+        COALESCE(
+            (SELECT priority FROM old),
+            CAST(
+                3 * POWER(0.5, EXTRACT(EPOCH FROM
+                    (CURRENT_TIMESTAMP AT TIME ZONE 'UTC') - v.added_at)
+                    / (86400 * 30))
+                + CASE WHEN EXISTS (
+                    SELECT 1
+                    FROM builds AS b JOIN files AS f ON f.build_id = b.build_id
+                    WHERE b.package = pkg AND b.version = ver
+                ) THEN 2 ELSE 0 END
+                AS DOUBLE PRECISION
+            )
+        ),
+        COALESCE(
+            (SELECT duration FROM old),
+            (SELECT MAX(duration) FROM build_queue WHERE package = pkg),
+            INTERVAL '0'
+        )
+    FROM
+        pending AS p
+        JOIN versions AS v ON v.package = pkg AND v.version = ver;
+$sql$;
+
+CREATE FUNCTION build_queue_reprioritize()
+    RETURNS VOID
+    LANGUAGE SQL
+    SECURITY DEFINER
+    SET search_path = public, pg_temp
+AS $sql$
+    WITH queued AS (
+        SELECT DISTINCT package FROM build_queue
+    ),
+    popularity AS (
+        SELECT
+            b.package,
+            COUNT(*) AS downloads
+        FROM
+            queued AS q
+            JOIN builds AS b ON b.package = q.package
+            JOIN files AS f ON f.build_id = b.build_id
+            JOIN downloads AS d ON d.filename = f.filename
+        WHERE d.accessed_at > CURRENT_TIMESTAMP - INTERVAL '1 month'
+        GROUP BY b.package
+    ),
+    history AS (
+        SELECT
+            b.package,
+            COUNT(*) AS builds_count,
+            SUM(EXTRACT(EPOCH FROM b.duration)) AS builds_time
+        FROM
+            queued AS q
+            JOIN builds AS b ON b.package = q.package
+        GROUP BY b.package
+    ),
+    scores AS (
+        SELECT
+            q.package,
+            q.version,
+            CAST(
+                LN(1 + COALESCE(p.downloads, 0))
+                + 3 * POWER(0.5, EXTRACT(EPOCH FROM
+                    (CURRENT_TIMESTAMP AT TIME ZONE 'UTC') - v.added_at)
+                    / (86400 * 30))
+                + CASE WHEN EXISTS (
+                    SELECT 1
+                    FROM builds AS b JOIN files AS f ON f.build_id = b.build_id
+                    WHERE b.package = q.package AND b.version = q.version
+                ) THEN 2 ELSE 0 END
+                AS DOUBLE PRECISION
+            ) AS priority,
+            (COALESCE(h.builds_time, 0) + 3 * pr.duration)
+                / (COALESCE(h.builds_count, 0) + 3)
+                * INTERVAL '1 second' AS duration
+        FROM
+            build_queue AS q
+            JOIN versions AS v
+                ON v.package = q.package AND v.version = q.version
+            CROSS JOIN build_queue_prior AS pr
+            LEFT JOIN popularity AS p ON p.package = q.package
+            LEFT JOIN history AS h ON h.package = q.package
+    )
+    UPDATE build_queue AS q SET
+        priority = s.priority,
+        duration = s.duration
+    FROM scores AS s
+    WHERE s.package = q.package AND s.version = q.version;
+$sql$;
+
+CREATE FUNCTION build_queue_rebuild()
+    RETURNS VOID
+    LANGUAGE SQL
+    SECURITY DEFINER
+    SET search_path = public, pg_temp
+AS $sql$
+    DELETE FROM build_queue;
+
+    INSERT INTO build_queue (package, version, abi_tag)
+    SELECT package, version, abi_tag
+    FROM builds_pending;
+
+    SELECT build_queue_reprioritize();
+$sql$;
+
+CREATE FUNCTION build_queue_versions_trigger()
+    RETURNS TRIGGER
+    LANGUAGE plpgsql
+    SECURITY DEFINER
+    SET search_path = public, pg_temp
+AS $sql$
+BEGIN
+    PERFORM build_queue_refresh(NEW.package, NEW.version);
+    RETURN NULL;
+END;
+$sql$;
+
+CREATE TRIGGER build_queue_versions
+    AFTER INSERT OR UPDATE OF skip ON versions
+    FOR EACH ROW
+    EXECUTE PROCEDURE build_queue_versions_trigger();
+
+CREATE FUNCTION build_queue_packages_trigger()
+    RETURNS TRIGGER
+    LANGUAGE plpgsql
+    SECURITY DEFINER
+    SET search_path = public, pg_temp
+AS $sql$
+BEGIN
+    PERFORM build_queue_refresh(v.package, v.version)
+    FROM versions AS v
+    WHERE v.package = NEW.package;
+    RETURN NULL;
+END;
+$sql$;
+
+CREATE TRIGGER build_queue_packages
+    AFTER UPDATE OF skip ON packages
+    FOR EACH ROW
+    EXECUTE PROCEDURE build_queue_packages_trigger();
+
+CREATE FUNCTION build_queue_builds_trigger()
+    RETURNS TRIGGER
+    LANGUAGE plpgsql
+    SECURITY DEFINER
+    SET search_path = public, pg_temp
+AS $sql$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM build_queue_refresh(OLD.package, OLD.version);
+    ELSE
+        PERFORM build_queue_refresh(NEW.package, NEW.version);
+    END IF;
+    RETURN NULL;
+END;
+$sql$;
+
+CREATE TRIGGER build_queue_builds
+    AFTER INSERT OR DELETE ON builds
+    FOR EACH ROW
+    EXECUTE PROCEDURE build_queue_builds_trigger();
+
+CREATE FUNCTION build_queue_files_trigger()
+    RETURNS TRIGGER
+    LANGUAGE plpgsql
+    SECURITY DEFINER
+    SET search_path = public, pg_temp
+AS $sql$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM build_queue_refresh(b.package, b.version)
+        FROM builds AS b
+        WHERE b.build_id = OLD.build_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM build_queue_refresh(b.package, b.version)
+        FROM builds AS b
+        WHERE b.build_id = NEW.build_id;
+    END IF;
+    RETURN NULL;
+END;
+$sql$;
+
+CREATE TRIGGER build_queue_files
+    AFTER INSERT OR UPDATE OF build_id, abi_tag OR DELETE ON files
+    FOR EACH ROW
+    EXECUTE PROCEDURE build_queue_files_trigger();
+
+CREATE FUNCTION build_queue_build_abis_trigger()
+    RETURNS TRIGGER
+    LANGUAGE plpgsql
+    SECURITY DEFINER
+    SET search_path = public, pg_temp
+AS $sql$
+BEGIN
+    PERFORM build_queue_rebuild();
+    RETURN NULL;
+END;
+$sql$;
+
+CREATE TRIGGER build_queue_build_abis
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON build_abis
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE build_queue_build_abis_trigger();
+
 -- statistics
 -------------------------------------------------------------------------------
 -- The "statistics" view generates various statistics from the tables in the
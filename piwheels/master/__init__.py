@@ -102,9 +102,19 @@ write access to the output directory.
             '-o', '--output-path', metavar='PATH', default=const.OUTPUT_PATH,
             help="The path under which the website should be written; must be "
             "writable by the current user")
+        parser.add_argument(
+            '--gzip-output', action='store_true',
+            help="Write a gzip-compressed copy of each generated web-page "
+            "alongside it (with a .gz suffix) for web-servers which can "
+            "serve precompressed files")
         parser.add_argument(
             '--index-queue', metavar='ADDR', default=const.INDEX_QUEUE,
             help="The address of the IndexScribe queue (default: %(default)s)")
+        parser.add_argument(
+            '--index-delay', metavar='SECS', default=const.INDEX_DELAY,
+            type=float,
+            help="The number of seconds to gather requests to re-write a "
+            "package's index before writing it (default: %(default)s)")
         parser.add_argument(
             '--status-queue', metavar='ADDR', default=const.STATUS_QUEUE,
             help="The address of the queue used to report status to monitors "
@@ -66,6 +66,20 @@ class BigBrother(PauseableTask):
             'builds_time':           timedelta(0),
             'builds_size':           0,
             'builds_pending':        0,
+            'builds_feed_rate':      0.0,
+            'builds_makespan':       timedelta(0),
+            'builds_estimate_error': timedelta(0),
+            'transfer_rate':         0.0,
+            'transfer_rtt':          0.0,
+            'transfer_saved':        0,
+            'transfer_compressed':   0,
+            'verify_queue':          0,
+            'verify_latency':        0.0,
+            'index_requests':        0,
+            'index_writes':          0,
+            'index_skipped':         0,
+            'index_cache_hits':      0,
+            'index_cache_misses':    0,
             'files_count':           0,
             'disk_free':             0,
             'disk_size':             1,
@@ -97,6 +111,27 @@ class BigBrother(PauseableTask):
             self.stats['disk_size'] = args[0].f_frsize * args[0].f_blocks
         elif msg == 'STATBQ':
             self.stats['builds_pending'] = sum(args[0].values())
+        elif msg == 'STATFEED':
+            self.stats['builds_feed_rate'] = args[0]
+        elif msg == 'STATSCHED':
+            self.stats['builds_makespan'] = args[0]
+            self.stats['builds_estimate_error'] = args[1]
+        elif msg == 'STATXFER':
+            self.stats['transfer_rate'] = args[0]
+            if args[1] is not None:
+                self.stats['transfer_rtt'] = args[1]
+            self.stats['transfer_compressed'] += args[2]
+        elif msg == 'STATDEDUP':
+            self.stats['transfer_saved'] += args[0]
+        elif msg == 'STATVERIFY':
+            self.stats['verify_queue'] = args[0]
+            self.stats['verify_latency'] = args[1]
+        elif msg == 'STATINDEX':
+            self.stats['index_requests'] += args[0]
+            self.stats['index_writes'] += args[1]
+            self.stats['index_skipped'] += args[2]
+            self.stats['index_cache_hits'] += args[3]
+            self.stats['index_cache_misses'] += args[4]
         else:
             self.logger.error('invalid big_brother message: %s', msg)
 
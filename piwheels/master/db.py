@@ -40,7 +40,9 @@ import warnings
 from datetime import timedelta
 from itertools import chain
 
-from sqlalchemy import MetaData, Table, select, create_engine
+from sqlalchemy import (
+    MetaData, Table, select, create_engine, any_, bindparam, func)
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import IntegrityError, SAWarning
 
 from .. import __version__
@@ -106,9 +108,9 @@ class Database:
                 self._downloads = Table('downloads', self._meta, autoload=True)
                 self._build_abis = Table(
                     'build_abis', self._meta, autoload=True)
+                self._build_queue = Table(
+                    'build_queue', self._meta, autoload=True)
                 # The following are views on the tables above
-                self._builds_pending = Table(
-                    'builds_pending', self._meta, autoload=True)
                 self._statistics = Table(
                     'statistics', self._meta, autoload=True)
                 self._downloads_recent = Table(
@@ -323,16 +325,32 @@ class Database:
 
     def get_build_queue(self):
         """
-        Returns a generator covering the entire builds_pending view; streaming
-        results are activated for this query as it's more important to get the
-        first result quickly than it is to retrieve the entire set.
+        Returns a generator covering the entire build_queue table (which
+        triggers keep in sync with the builds_pending view), highest priority
+        first; streaming results are activated for this query as it's more
+        important to get the first result quickly than it is to retrieve the
+        entire set (the ordering is served by the build_queue_priority index
+        so the first rows don't wait on a sort).
         """
         with self._conn.begin():
             for row in self._conn.\
                     execution_options(stream_results=True).\
-                    execute(self._builds_pending.select()):
+                    execute(
+                        self._build_queue.select().
+                        order_by(self._build_queue.c.priority.desc())
+                    ):
                 yield row
 
+    def reprioritize_build_queue(self):
+        """
+        Re-calculate the priority and duration estimate of every row in the
+        build_queue table. The triggers score rows as they're inserted, but
+        the scores decay with age and depend on download counts, so this
+        should be called periodically.
+        """
+        with self._conn.begin():
+            self._conn.execute(select([func.build_queue_reprioritize()]))
+
     def get_statistics(self):
         """
         Return various build related statistics from the database (see the
@@ -385,17 +403,70 @@ class Database:
 
     def get_package_files(self, package):
         """
-        Returns all details required to build the index.html for the specified
-        package.
+        Returns all details required to build the indexes (HTML and JSON) for
+        the specified package.
         """
         with self._conn.begin():
             return self._conn.execute(
-                select([self._files.c.filename, self._files.c.filehash]).
+                select([
+                    self._files.c.filename,
+                    self._files.c.filehash,
+                    self._files.c.filesize,
+                ]).
                 select_from(self._builds.join(self._files)).
                 where(self._builds.c.status).
                 where(self._builds.c.package == package)
             )
 
+    def get_packages_files(self, packages):
+        """
+        Returns all details required to build the indexes (HTML and JSON) for
+        each of the specified *packages* in a single query, as a dict mapping
+        each package to its list of files (packages without files map to an
+        empty list).
+        """
+        packages = list(packages)
+        result = {package: [] for package in packages}
+        with self._conn.begin():
+            for rec in self._conn.execute(
+                    select([
+                        self._builds.c.package,
+                        self._files.c.filename,
+                        self._files.c.filehash,
+                        self._files.c.filesize,
+                    ]).
+                    select_from(self._builds.join(self._files)).
+                    where(self._builds.c.status).
+                    where(self._builds.c.package == any_(bindparam(
+                        'packages', packages,
+                        type_=ARRAY(self._builds.c.package.type))))
+            ):
+                result[rec.package].append(rec)
+        return result
+
+    def get_all_package_files(self):
+        """
+        Yields the details required to build the indexes of every package
+        with files, as (package, filename, filehash, filesize) rows ordered by
+        package. Rows are fetched from the server incrementally rather than
+        all at once.
+        """
+        query = (
+            select([
+                self._builds.c.package,
+                self._files.c.filename,
+                self._files.c.filehash,
+                self._files.c.filesize,
+            ]).
+            select_from(self._builds.join(self._files)).
+            where(self._builds.c.status).
+            order_by(self._builds.c.package, self._files.c.filename)
+        )
+        with self._conn.begin():
+            conn = self._conn.execution_options(stream_results=True)
+            for rec in conn.execute(query):
+                yield rec
+
     def get_version_files(self, package, version):
         """
         Returns the names of all files for *version* of *package*
@@ -412,6 +483,25 @@ class Database:
                 )
             }
 
+    def get_files_with_hash(self, filehash):
+        """
+        Returns a list of ``(package, filename)`` tuples for all files with
+        the content hash *filehash*.
+        """
+        with self._conn.begin():
+            return [
+                (rec.package, rec.filename)
+                for rec in self._conn.execute(
+                    select([
+                        self._builds.c.package,
+                        self._files.c.filename,
+                    ]).
+                    select_from(self._builds.join(self._files)).
+                    where(self._builds.c.status).
+                    where(self._files.c.filehash == filehash)
+                )
+            ]
+
     def delete_build(self, package, version):
         """
         Remove all builds for the specified package and version, along with
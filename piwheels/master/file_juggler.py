@@ -44,13 +44,17 @@ for interacting with it.
 """
 
 import os
+import pickle
+from time import monotonic
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import zmq
 import zmq.error
 
 from .tasks import Task
 from .states import TransferState
+from .the_oracle import DbClient
 
 
 class TransferError(Exception):
@@ -91,6 +95,7 @@ class FileJuggler(Task):
     the slave can wipe the source file.
     """
     name = 'master.file_juggler'
+    verify_workers = 2
 
     def __init__(self, config):
         super().__init__(config)
@@ -100,19 +105,30 @@ class FileJuggler(Task):
         file_queue.ipv6 = True
         file_queue.hwm = TransferState.pipeline_size * 50
         file_queue.bind(config.file_queue)
-        fs_queue = self.ctx.socket(zmq.REP)
-        fs_queue.hwm = 1
-        fs_queue.bind(config.fs_queue)
+        self.fs_queue = self.ctx.socket(zmq.ROUTER)
+        self.fs_queue.hwm = 10
+        self.fs_queue.bind(config.fs_queue)
+        verified_queue = self.ctx.socket(zmq.PULL)
+        verified_queue.hwm = 10
+        verified_queue.bind('inproc://verified-%s' % self.name)
         self.stats_queue = self.ctx.socket(zmq.PUSH)
         self.stats_queue.hwm = 10
         self.stats_queue.connect(config.stats_queue)
+        self.db = DbClient(config)
         self.register(file_queue, self.handle_file)
-        self.register(fs_queue, self.handle_fs_request)
-        self.pending = {}   # keyed by slave_id
+        self.register(self.fs_queue, self.handle_fs_request)
+        self.register(verified_queue, self.handle_verified)
+        self.verifier = ThreadPoolExecutor(max_workers=self.verify_workers)
+        self.verifying = {}  # keyed by client address
+        self.pending = {}   # keyed by (slave_id, filename)
         self.active = {}    # keyed by slave address
-        self.complete = {}  # keyed by slave_id
+        self.complete = {}  # keyed by (slave_id, filename)
+        self.hashes = {}    # keyed by filehash
+        self.interrupted = TransferState.checkpoints()  # keyed by (name, hash)
 
     def close(self):
+        self.verifier.shutdown()
+        self.db.close()
         self.stats_queue.close()
         super().close()
 
@@ -122,28 +138,42 @@ class FileJuggler(Task):
 
     def handle_fs_request(self, queue):
         """
-        Handle incoming messages from :class:`FsClient` instances.
+        Handle incoming messages from :class:`FsClient` instances. Replies to
+        "VERIFY" are deferred until :meth:`handle_verified` receives the
+        outcome from the worker pool.
         """
-        msg, *args = queue.recv_pyobj()
+        address, _, msg = queue.recv_multipart()
         try:
+            msg, *args = pickle.loads(msg)
+            if msg == 'VERIFY':
+                self.do_verify(address, *args)
+                return
             handler = {
                 'EXPECT': self.do_expect,
-                'VERIFY': self.do_verify,
                 'REMOVE': self.do_remove,
             }[msg]
             result = handler(*args)
         except Exception as exc:
             self.logger.error('error handling fs request: %s', msg)
-            queue.send_pyobj(['ERR', exc])
+            self.send_fs_reply(address, ['ERR', exc])
         else:
-            queue.send_pyobj(['OK', result])
+            self.send_fs_reply(address, ['OK', result])
+
+    def send_fs_reply(self, address, reply):
+        """
+        Send *reply* to the :class:`FsClient` at *address*.
+        """
+        self.fs_queue.send_multipart([address, b'', pickle.dumps(reply)])
 
     def do_expect(self, slave_id, file_state):
         """
         Message sent by :class:`FsClient` to inform file juggler that a build
         slave is about to start a file transfer. The message includes the full
         :class:`~.states.FileState`. The state is stored in the ``pending``
-        map.
+        map; a slave may be expected to transfer several files at once. If a
+        stored file has the same content, the transfer is deduplicated (see
+        :meth:`find_existing`); otherwise, if an interrupted transfer of the
+        same file was checkpointed, it is resumed.
 
         :param int slave_id:
             The identity of the build slave about to begin the transfer.
@@ -152,14 +182,96 @@ class FileJuggler(Task):
             The details of the file to be transferred including the expected
             hash.
         """
-        self.pending[slave_id] = TransferState(slave_id, file_state)
-        self.logger.info('expecting transfer: %s', file_state.filename)
+        source = self.find_existing(file_state)
+        resume = self.interrupted.pop(
+            (file_state.filename, file_state.filehash), None)
+        transfer = None
+        if source is not None:
+            try:
+                transfer = TransferState(slave_id, file_state, source)
+            except FileNotFoundError:
+                # The stored file was removed after find_existing checked it;
+                # fall back to transferring the file
+                self.hashes.pop(file_state.filehash, None)
+                source = None
+            else:
+                if resume is not None:
+                    # The interrupted transfer (and its checkpoint) isn't
+                    # needed
+                    tmp_path = resume[0]
+                    for path in (tmp_path, tmp_path.with_name(
+                            tmp_path.name + '.state')):
+                        try:
+                            path.unlink()
+                        except FileNotFoundError:
+                            pass
+                    resume = None
+        if transfer is None:
+            transfer = TransferState(slave_id, file_state, resume=resume)
+        if source is not None:
+            self.logger.info('expecting transfer: %s (duplicate of %s)',
+                             file_state.filename, source)
+        elif resume is not None:
+            self.logger.info('expecting transfer: %s (resuming)',
+                             file_state.filename)
+        else:
+            self.logger.info('expecting transfer: %s', file_state.filename)
+        self.pending[slave_id, file_state.filename] = transfer
+
+    def find_existing(self, file_state):
+        """
+        Look up the expected hash of *file_state* among the stored files.
+        Recently committed files are found in the ``hashes`` cache; otherwise
+        the database is asked for files with the same hash (so that files
+        stored before the master started are found too). Returns the path of
+        a stored file with identical content, or :data:`None` if no such file
+        exists.
+
+        :param FileState file_state:
+            The details of the file to be transferred including the expected
+            hash.
+        """
+        try:
+            path = self.hashes[file_state.filehash]
+        except KeyError:
+            pass
+        else:
+            if self.is_stored(path, file_state):
+                return path
+            del self.hashes[file_state.filehash]
+        for package, filename in self.db.get_files_with_hash(
+                file_state.filehash):
+            path = self.output_path / 'simple' / package / filename
+            if self.is_stored(path, file_state):
+                self.hashes[file_state.filehash] = path
+                return path
+        return None
+
+    @staticmethod
+    def is_stored(path, file_state):
+        """
+        Returns :data:`True` if *path* is a stored file (not a symlink) of
+        the size given by *file_state*. Stored files are never modified once
+        committed, but this guards against files that have since been removed
+        (and against someone messing with the output directory).
+        """
+        try:
+            stat = path.lstat()
+        except FileNotFoundError:
+            return False
+        return path.is_file() and stat.st_size == file_state.filesize
 
-    def do_verify(self, slave_id, package):
+    def do_verify(self, address, slave_id, package):
         """
-        Message sent by :class:`FsClient` to request that juggler verify a file
-        transfer against the expected hash and, if it matches, rename the file
-        into its final location.
+        Message sent by :class:`FsClient` to request that juggler verify all
+        completed file transfers from a slave against their expected hashes
+        and, for those that match, rename the files into their final location.
+        The work is handed to the pool (see :meth:`verify_transfer`) and the
+        client at *address* is replied to by :meth:`handle_verified`, with the
+        list of filenames that were successfully verified.
+
+        :param bytes address:
+            The address of the :class:`FsClient` making the request.
 
         :param int slave_id:
             The identity of the build slave that sent the file.
@@ -168,19 +280,70 @@ class FileJuggler(Task):
             The name of the package that the file is to be committed to, if
             valid.
         """
-        transfer = self.complete.pop(slave_id)
+        transfers = {
+            filename: self.complete.pop((complete_id, filename))
+            for complete_id, filename in list(self.complete)
+            if complete_id == slave_id
+        }
+        if not transfers:
+            self.send_fs_reply(address, ['OK', []])
+            return
+        self.verifying[address] = (transfers, [], monotonic())
+        for transfer in transfers.values():
+            self.verifier.submit(
+                self.verify_transfer, address, transfer, package)
+
+    def verify_transfer(self, address, transfer, package):
+        """
+        Executed by the worker pool to verify and commit *transfer* (or roll
+        it back if verification fails). The outcome is sent back to the task
+        for :meth:`handle_verified`.
+        """
         try:
-            transfer.verify()
-        except IOError:
-            transfer.rollback()
-            self.logger.warning('verification failed: %s',
-                                transfer.file_state.filename)
-            raise
-        else:
-            transfer.commit(package)
-            self.logger.info('verified: %s', transfer.file_state.filename)
+            try:
+                transfer.verify()
+            except IOError:
+                transfer.rollback()
+                raise
+            else:
+                result = ['OK', transfer.commit(package)]
+        except Exception as exc:
+            result = ['ERR', exc]
+        queue = self.ctx.socket(zmq.PUSH)
+        try:
+            queue.connect('inproc://verified-%s' % self.name)
+            queue.send_pyobj(
+                [address, transfer.file_state.filename] + result)
+        finally:
+            queue.close()
+
+    def handle_verified(self, queue):
+        """
+        Handle the outcome of :meth:`verify_transfer`, replying to the client
+        that requested the verification once all its transfers are dealt
+        with. Verification queue depth and latency are sent to the stats
+        queue.
+        """
+        address, filename, status, result = queue.recv_pyobj()
+        transfers, verified, queued = self.verifying[address]
+        transfer = transfers.pop(filename)
+        if status == 'OK':
+            self.hashes[transfer.file_state.filehash] = result
+            verified.append(filename)
+            self.logger.info('verified: %s', filename)
             self.stats_queue.send_pyobj(
                 ['STATFS', os.statvfs(str(self.output_path))])
+        else:
+            self.logger.warning('verification failed: %s: %s',
+                                filename, result)
+        if not transfers:
+            del self.verifying[address]
+            self.send_fs_reply(address, ['OK', verified])
+        self.stats_queue.send_pyobj([
+            'STATVERIFY',
+            sum(len(t) for t, _, _ in self.verifying.values()),
+            monotonic() - queued
+        ])
 
     def do_remove(self, package, filename):
         """
@@ -193,6 +356,11 @@ class FileJuggler(Task):
         except FileNotFoundError:
             self.logger.warning('remove failed (not found): %s', path)
         else:
+            self.hashes = {
+                filehash: stored
+                for filehash, stored in self.hashes.items()
+                if stored != path
+            }
             self.logger.info('removed: %s', path)
             self.stats_queue.send_pyobj(
                 ['STATFS', os.statvfs(str(self.output_path))])
@@ -209,23 +377,49 @@ class FileJuggler(Task):
 
         The "normal" state for a file transfer is to be requesting and
         receiving chunks. Anything else, including redundant re-sends, and
-        transfer completion is handled as an exceptional case.
+        transfer completion is handled as an exceptional case. The size and
+        number of chunks requested at once adapt to the throughput of the
+        transfer (see :class:`~.states.TransferState`); upon completion the
+        transfer's throughput, round-trip time and the bytes saved by
+        compression (if negotiated) are sent to the stats queue (or, for
+        deduplicated transfers, the number of bytes that didn't need sending).
         """
-        address, msg, *args = queue.recv_multipart()
+        # Chunk data is received without copying it out of the 0MQ frame; it is
+        # written (and hashed) straight from the frame's buffer
+        address, msg, *args = queue.recv_multipart(copy=False)
+        address = address.bytes
+        msg = msg.bytes
+        if msg == b'CHUNK' and len(args) in (2, 3):
+            args = [args[0].bytes, args[1].buffer] + [
+                frame.bytes for frame in args[2:]]
+        else:
+            args = [frame.bytes for frame in args]
         try:
             transfer = None
             try:
                 transfer = self.active[address]
             except KeyError:
                 transfer = self.new_transfer(msg, *args)
+                if transfer.done:
+                    raise TransferDone('transfer deduplicated: %s' %
+                                       transfer.file_state.filename)
                 self.active[address] = transfer
             else:
                 self.current_transfer(transfer, msg, *args)
         except TransferDone as exc:
             self.logger.info(str(exc))
-            del self.active[address]
-            self.complete[transfer.slave_id] = transfer
+            self.active.pop(address, None)
+            self.complete[
+                transfer.slave_id, transfer.file_state.filename] = transfer
             queue.send_multipart([address, b'DONE'])
+            if transfer.deduplicated:
+                self.stats_queue.send_pyobj(
+                    ['STATDEDUP', transfer.file_state.filesize])
+            else:
+                self.stats_queue.send_pyobj([
+                    'STATXFER', transfer.throughput, transfer.rtt,
+                    transfer.compression_saved
+                ])
             return
         except TransferIgnoreChunk as exc:
             self.logger.debug(str(exc))
@@ -237,13 +431,17 @@ class FileJuggler(Task):
                 return
             # XXX Remove transfer from slave?
 
+        # If a codec was negotiated, each FETCH permits the slave to compress
+        # the chunk with it
+        codec = [] if transfer.codec is None else [
+            transfer.codec.encode('ascii')]
         fetch_range = transfer.fetch()
         while fetch_range:
             queue.send_multipart([
                 address, b'FETCH',
                 str(fetch_range.start).encode('ascii'),
                 str(len(fetch_range)).encode('ascii')
-            ])
+            ] + codec)
             fetch_range = transfer.fetch()
 
     def new_transfer(self, msg, *args):
@@ -251,14 +449,20 @@ class FileJuggler(Task):
         Called for messages initiating a new file transfer.
 
         The first message must be HELLO along with the id of the slave starting
-        the transfer. The metadata for the transfer will be looked up in the
-        ``pending`` list (which is written to by :meth:`do_expect`).
+        the transfer and the name of the file it is sending (a slave may send
+        several files at once, each from a separate socket), optionally
+        followed by a comma-separated list of the compression codecs the slave
+        is willing to use. The metadata for the transfer will be looked up in
+        the ``pending`` list (which is written to by :meth:`do_expect`). If the
+        transfer was deduplicated by :meth:`do_expect` it is already done, and
+        :meth:`handle_file` completes it immediately.
 
         :param str msg:
             The message sent to start the transfer (must be "HELLO")
 
         :param \*args:
-            All additional arguments (expected to be an integer slave id).
+            All additional arguments (expected to be an integer slave id, a
+            filename, and optionally a list of codecs).
         """
         if msg == b'CHUNK':
             raise TransferIgnoreChunk('ignoring redundant CHUNK from prior '
@@ -267,11 +471,15 @@ class FileJuggler(Task):
             raise TransferError('invalid start transfer from slave: %s' % msg)
         try:
             slave_id = int(args[0])
-            transfer = self.pending.pop(slave_id)
-        except ValueError:
-            raise TransferError('invalid slave id: %s' % args[0])
+            filename = args[1].decode('utf-8')
+            transfer = self.pending.pop((slave_id, filename))
+        except (IndexError, ValueError):
+            raise TransferError('invalid transfer id: %r' % (args,))
         except KeyError:
-            raise TransferError('unexpected transfer from slave: %d' % slave_id)
+            raise TransferError('unexpected transfer from slave %d: %s' %
+                                (slave_id, filename))
+        if len(args) > 2:
+            transfer.negotiate(args[2].decode('ascii', 'replace').split(','))
         return transfer
 
     def current_transfer(self, transfer, msg, *args):
@@ -290,14 +498,20 @@ class FileJuggler(Task):
 
         :param \*args:
             All additional arguments; for "CHUNK" the first must be the file
-            offset and the second the data to write to that offset.
+            offset and the second the data to write to that offset, optionally
+            followed by the codec the data is compressed with.
         """
         # pylint: disable=no-self-use
         if msg == b'CHUNK':
-            transfer.chunk(int(args[0].decode('ascii')), args[1])
+            try:
+                codec = args[2].decode('ascii') if len(args) > 2 else None
+                transfer.chunk(int(args[0].decode('ascii')), args[1], codec)
+            except ValueError as exc:
+                raise TransferError('invalid chunk from slave: %s' % exc)
             if transfer.done:
-                raise TransferDone('transfer complete: %s' %
-                                   transfer.file_state.filename)
+                raise TransferDone(
+                    'transfer complete: %s (%d bytes saved by compression)' %
+                    (transfer.file_state.filename, transfer.compression_saved))
         else:
             # This only happens if there's either a corrupted package, or we've
             # dropped a *lot* of packets, and the slave's timed out waiting for
@@ -339,14 +553,10 @@ class FsClient:
 
     def verify(self, slave_id, package):
         """
-        See :meth:`FileJuggler.do_verify`.
+        See :meth:`FileJuggler.do_verify`. Returns the list of filenames that
+        were successfully verified.
         """
-        try:
-            self._execute(['VERIFY', slave_id, package])
-        except IOError:
-            return False
-        else:
-            return True
+        return self._execute(['VERIFY', slave_id, package])
 
     def remove(self, package, filename):
         """
@@ -40,14 +40,19 @@ class literal(str):
         return self
 
 
+def escape(s):
+    "Return the str s escaped for inclusion in HTML content or attributes"
+    return (s.
+            replace('&', '&amp;').
+            replace('"', '&quot;').
+            replace('<', '&lt;').
+            replace('>', '&gt;'))
+
+
 class content(str):
     "A str sub-class which escapes content for inclusion in HTML"
     def __html__(self):
-        return literal(self.
-                       replace('&', '&amp;').
-                       replace('"', '&quot;').
-                       replace('<', '&lt;').
-                       replace('>', '&gt;'))
+        return literal(escape(self))
 
 
 def html(s):
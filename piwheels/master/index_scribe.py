@@ -31,23 +31,52 @@ Defines the :class:`IndexScribe` task; see class for more details.
 
 .. autoclass:: IndexScribe
     :members:
+
+.. autofunction:: render_root_index
+
+.. autofunction:: render_package_index
+
+.. autofunction:: render_root_json
+
+.. autofunction:: render_package_json
+
+.. autofunction:: render_search_index
+
+.. autofunction:: write_file
+
+.. autofunction:: write_gzip
+
+.. autofunction:: write_package
+
+.. autofunction:: package_written
 """
 
 import re
 import os
+import gzip
 import json
+import shutil
+import hashlib
 import tempfile
+from time import monotonic
+from bisect import insort
+from itertools import islice
+from operator import attrgetter
 from pathlib import Path
+from collections import OrderedDict, namedtuple
 
 import zmq
 from pkg_resources import resource_string, resource_stream, resource_listdir
 
-from .html import tag
+from .html import escape
 from .tasks import PauseableTask
 from .the_oracle import DbClient
 from .states import mkdir_override_symlink
 
 
+IndexFile = namedtuple('IndexFile', ('filename', 'filehash', 'filesize'))
+
+
 class IndexScribe(PauseableTask):
     """
     This task is responsible for writing web-page ``index.html`` files. It
@@ -61,9 +90,55 @@ class IndexScribe(PauseableTask):
         internal "indexes" queue until all file-transfers associated with the
         build are complete. Furthermore, while the entire index for a package
         is re-built, hashes are *never* re-calculated from the disk files (they
-        are always read from the database).
+        are always read from the database, or from the build that produced
+        the files).
+
+    Requests to re-write a package's index are not acted upon immediately.
+    Instead they are gathered in :attr:`pending` and each package is written
+    (at most once) when its oldest request is ``index_delay`` seconds old. This
+    ensures that a build producing several files (each of which results in a
+    request when its transfer is verified), or a burst of imports, only
+    re-writes a package's index once. The number of requests received versus
+    the number of indexes actually written is reported to
+    :class:`BigBrother`.
+
+    The files of recently written packages are kept in :attr:`files_cache`
+    (which holds at most ``files_cache_size`` packages, evicting the least
+    recently used first). Requests sent after a successful build carry the
+    files of that build, which are merged into the cached list, so the index
+    can be re-written without querying the database. The database is only
+    consulted for packages that aren't cached, or for requests that carry no
+    files (e.g. after a version is removed, which invalidates the cached
+    list). Cache hits and misses are reported to :class:`BigBrother`.
+
+    The root index is written from a sorted list of all packages which is
+    read from the database at startup, and into which new packages are
+    inserted as they appear. As the root index is not used by pip to locate
+    packages, it is only re-written once per ``root_index_delay`` seconds no
+    matter how many new packages appear in that time.
+
+    Alongside each HTML index (as defined by :pep:`503`), a JSON equivalent
+    (as defined by :pep:`691`) is written to "index.json" in the same
+    directory. These are smaller and considerably quicker for clients to
+    parse, and can be served to clients that request them via content
+    negotiation.
+
+    A digest of each package's index (covering both the HTML and the JSON) is
+    kept in :attr:`page_digests`; if a re-written index would be identical to
+    the one already on disk, the write is skipped (avoiding needless
+    invalidation of web caches and mirrors).
+    Digests are calculated from the existing pages on disk the first time
+    each package is written after startup, so the pages themselves serve as
+    the persistent record of the digests.
+
+    If ``gzip_output`` is set in the configuration, every file written (bar
+    images) is accompanied by a gzip-compressed copy with an additional
+    ".gz" suffix, for web-servers which can serve such precompressed
+    files directly (e.g. nginx's ``gzip_static``).
     """
     name = 'master.index_scribe'
+    root_index_delay = 60.0
+    files_cache_size = 10000
 
     def __init__(self, config):
         super().__init__(config)
@@ -74,24 +149,114 @@ class IndexScribe(PauseableTask):
         index_queue.hwm = 100
         index_queue.bind(config.index_queue)
         self.register(index_queue, self.handle_index)
+        self.stats_queue = self.ctx.socket(zmq.PUSH)
+        self.stats_queue.hwm = 10
+        self.stats_queue.connect(config.stats_queue)
         self.db = DbClient(config)
+        self.index_delay = config.index_delay
+        self.gzip_output = config.gzip_output
         self.package_cache = None
+        self.package_list = None
+        self.page_digests = {}
+        self.files_cache = OrderedDict()
+        self.root_index_due = None
+        self.pending = {}
         self.statistics = {}
 
     def close(self):
+        if self.pending and self.package_cache is not None:
+            # Don't lose any requests still waiting for their delay to expire
+            # (the database is still available at this point as TheOracle is
+            # always closed after us)
+            try:
+                self.write_pending(set(self.pending))
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception('failed to write pending indexes')
+        if self.root_index_due is not None:
+            try:
+                self.write_root_index()
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception('failed to write root index')
         self.db.close()
+        self.stats_queue.close()
         super().close()
 
     def once(self):
         self.setup_output_path()
         self.logger.info('building package cache')
         self.package_cache = self.db.get_all_packages()
+        self.package_list = sorted(self.package_cache)
         # Perform a one-time write of the root index if it doesn't exist; this
         # is primarily for limited setups which don't expect to see "new"
         # packages show up (the usual trigger for re-writing the root index)
         if not (self.output_path / 'simple' / 'index.html').exists():
             self.write_root_index()
 
+    def loop(self):
+        """
+        Write the indexes of all packages in :attr:`pending` for which the
+        oldest request is at least ``index_delay`` seconds old, and the root
+        index if new packages appeared at least ``root_index_delay`` seconds
+        ago.
+        """
+        now = monotonic()
+        ready = {
+            package
+            for package, (requested, _) in self.pending.items()
+            if now - requested >= self.index_delay
+        }
+        if ready:
+            self.write_pending(ready)
+        if (self.root_index_due is not None and
+                monotonic() - self.root_index_due >= self.root_index_delay):
+            self.write_root_index()
+
+    def write_pending(self, packages):
+        """
+        Write the indexes of the specified *packages* (which are removed from
+        :attr:`pending`), scheduling a re-write of the root index if any of
+        them are new. The files of any *packages* not in :attr:`files_cache`
+        are fetched from the database in a single request. Afterward, the
+        number of requests coalesced into these writes, the number of indexes
+        actually written and skipped (as they were unchanged), and the number
+        of packages found and not found in the cache are sent to
+        :class:`BigBrother`.
+
+        :param set packages:
+            The names of the packages to write the indexes for.
+        """
+        requests = sum(self.pending.pop(package)[1] for package in packages)
+        for package in packages - self.package_cache:
+            self.package_cache.add(package)
+            insort(self.package_list, package)
+            if self.root_index_due is None:
+                self.root_index_due = monotonic()
+        misses = sorted(packages - self.files_cache.keys())
+        if misses:
+            for package, files in self.db.get_packages_files(misses).items():
+                self.files_cache[package] = {
+                    file.filename: file for file in files}
+        written = 0
+        for package in sorted(packages):
+            self.files_cache.move_to_end(package)
+            written += self.write_package_index(package, sorted(
+                self.files_cache[package].values(),
+                key=attrgetter('filename')))
+        while len(self.files_cache) > self.files_cache_size:
+            self.files_cache.popitem(last=False)
+        if len(packages) < requests:
+            self.logger.info('coalesced %d index requests into %d writes',
+                             requests, len(packages))
+        try:
+            # If sending blocks, BigBrother has gone away because we're
+            # shutting down (see close); the stats no longer matter
+            self.stats_queue.send_pyobj(
+                ['STATINDEX', requests, written, len(packages) - written,
+                 len(packages) - len(misses), len(misses)],
+                flags=zmq.NOBLOCK)
+        except zmq.Again:
+            pass
+
     def setup_output_path(self):
         """
         Called on task startup to copy all static resources into the output
@@ -114,13 +279,30 @@ class IndexScribe(PauseableTask):
                 source = resource_stream(__name__, 'static/' + filename)
                 f.write(source.read())
                 source.close()
+            if not filename.endswith('.png'):
+                self.write_gzip(self.output_path / filename)
+
+    def write_gzip(self, path):
+        """
+        (Re)writes or removes the gzip-compressed copy of *path*, depending on
+        whether ``gzip_output`` is enabled (see :func:`write_gzip`).
+
+        :param pathlib.Path path:
+            The file to compress.
+        """
+        write_gzip(path, self.gzip_output)
 
     def handle_index(self, queue):
         """
         Handle incoming requests to (re)build index files. These will be in the
         form of "HOME", a request to write the homepage with some associated
         statistics, or "PKG", a request to write the index for the specified
-        package.
+        package (which is added to :attr:`pending` to be written later by
+        :meth:`loop`). A "PKG" request may be accompanied by a list of
+        (filename, filehash, filesize) tuples for files that have been added
+        to the package; these are merged into the package's entry in
+        :attr:`files_cache`, if it has one. A "PKG" request without files
+        invalidates the package's entry.
 
         .. note::
 
@@ -131,11 +313,19 @@ class IndexScribe(PauseableTask):
         msg, *args = queue.recv_pyobj()
         if msg == 'PKG':
             package = args[0]
-            if package not in self.package_cache:
-                self.package_cache.add(package)
-                self.write_root_index()
-            self.write_package_index(package,
-                                     self.db.get_package_files(package))
+            if len(args) > 1:
+                try:
+                    files = self.files_cache[package]
+                except KeyError:
+                    pass
+                else:
+                    for file in args[1]:
+                        file = IndexFile(*file)
+                        files[file.filename] = file
+            else:
+                self.files_cache.pop(package, None)
+            requested, count = self.pending.get(package, (monotonic(), 0))
+            self.pending[package] = (requested, count + 1)
         elif msg == 'HOME':
             status_info = args[0]
             self.write_homepage(status_info)
@@ -154,139 +344,354 @@ class IndexScribe(PauseableTask):
             A dict containing statistics obtained by :class:`BigBrother`.
         """
         self.logger.info('writing homepage')
-        with tempfile.NamedTemporaryFile(mode='w', dir=str(self.output_path),
-                                         encoding='utf-8',
-                                         delete=False) as index:
-            try:
-                index.file.write(self.homepage_template.format(**statistics))
-            except BaseException:
-                index.delete = True
-                raise
-            else:
-                os.fchmod(index.file.fileno(), 0o664)
-                os.replace(index.name, str(self.output_path / 'index.html'))
+        self.write_index(self.output_path / 'index.html',
+                         [self.homepage_template.format(**statistics)],
+                         mode=0o664)
 
     def write_search_index(self, search_index):
         """
-        Re-writes the JSON search index using the provided statistics.
+        Re-writes the JSON search index using the provided statistics. The
+        index is written a chunk at a time (see :func:`render_search_index`).
 
-        :param dict search_index:
-            A dict mapping package names to their download count obtained by
+        :param list search_index:
+            A list of (package name, download count) tuples obtained by
             :class:`BigBrother`.
         """
         self.logger.info('writing search index')
-        with tempfile.NamedTemporaryFile(mode='w', dir=str(self.output_path),
-                                         encoding='utf-8',
-                                         delete=False) as index:
-            try:
-                json.dump(search_index, index,
-                          check_circular=False, separators=(',', ':'))
-            except BaseException:
-                index.delete = True
-                raise
-            else:
-                os.fchmod(index.file.fileno(), 0o664)
-                os.replace(index.name, str(self.output_path / 'packages.json'))
+        self.write_index(self.output_path / 'packages.json',
+                         render_search_index(search_index), mode=0o664)
 
     def write_root_index(self):
         """
-        (Re)writes the index of all packages. This is implicitly called when a
-        request to write a package index is received for a package not present
-        in the task's cache.
+        (Re)writes the index of all packages. This is implicitly called (by
+        :meth:`loop`) some time after a request to write a package index is
+        received for a package not present in the task's cache.
+
+        The index is written a chunk at a time from :attr:`package_list` (see
+        :func:`render_root_index`) rather than constructed in memory first, as
+        it can be rather large.
         """
         self.logger.info('writing package index')
-        temp_dir = self.output_path / 'simple'
-        with tempfile.NamedTemporaryFile(mode='w', dir=str(temp_dir),
-                                         encoding='utf-8',
-                                         delete=False) as index:
-            try:
-                index.file.write('<!DOCTYPE html>\n')
-                index.file.write(
-                    tag.html(
-                        tag.head(
-                            tag.title('Pi Wheels Simple Index'),
-                            tag.meta(name='api-version', value=2),
-                        ),
-                        tag.body(
-                            (tag.a(package, href=package), tag.br())
-                            for package in self.package_cache
-                        )
-                    )
-                )
-            except BaseException:
-                index.delete = True
-                raise
-            else:
-                os.fchmod(index.file.fileno(), 0o644)
-                os.replace(index.name,
-                           str(self.output_path / 'simple' / 'index.html'))
+        self.write_index(self.output_path / 'simple' / 'index.json',
+                         render_root_json(self.package_list))
+        self.write_index(self.output_path / 'simple' / 'index.html',
+                         render_root_index(self.package_list))
+        self.root_index_due = None
+
+    def write_index(self, path, chunks, mode=0o644):
+        """
+        Atomically (re)writes the file at *path* from the series of strings in
+        *chunks*, along with its compressed copy (see :func:`write_file`).
+
+        :param pathlib.Path path:
+            The file to write.
+
+        :param chunks:
+            An iterable of strings which will be encoded as UTF-8.
+
+        :param int mode:
+            The permissions to give the file.
+        """
+        write_file(path, chunks, mode, self.gzip_output)
 
     def write_package_index(self, package, files):
         """
         (Re)writes the index of the specified package. The file meta-data
-        (including the hash) is retrieved from the database, *never* from the
-        file-system.
+        (including the hash) is retrieved from the database (or the build that
+        produced the files), *never* from the file-system. The JSON equivalent
+        of the index is written first. If the content of the index is
+        unchanged (and all the index files are in place, see
+        :func:`package_written`), neither is re-written.
 
         :param str package:
             The name of the package to write the index for
 
         :param list files:
-            A list of (filename, filehash) tuples.
+            A list of (filename, filehash, filesize) tuples.
+
+        :returns:
+            :data:`True` if the index was written, or :data:`False` if the
+            write was skipped.
         """
-        self.logger.info('writing index for %s', package)
         pkg_dir = self.output_path / 'simple' / package
-        mkdir_override_symlink(pkg_dir)
-        with tempfile.NamedTemporaryFile(mode='w', dir=str(pkg_dir),
-                                         encoding='utf-8',
-                                         delete=False) as index:
-            try:
-                index.file.write('<!DOCTYPE html>\n')
-                index.file.write(
-                    tag.html(
-                        tag.head(
-                            tag.title('Links for {}'.format(package))
-                        ),
-                        tag.body(
-                            tag.h1('Links for {}'.format(package)),
-                            ((tag.a(
-                                f.filename,
-                                href='{f.filename}#sha256={f.filehash}'.format(f=f),
-                                rel='internal'), tag.br())
-                             for f in files)
-                        )
-                    )
-                )
-            except BaseException:
-                index.delete = True
-                raise
-            else:
-                os.fchmod(index.file.fileno(), 0o644)
-                os.replace(index.name, str(pkg_dir / 'index.html'))
-                try:
-                    # Workaround for #20: after constructing the index for a
-                    # package attempt to symlink the "canonicalized" package
-                    # name to the actual package directory. The reasons for
-                    # doing things this way are rather complex...
-                    #
-                    # The older package name must exist for the benefit of
-                    # older versions of pip. If the symlink already exists *or
-                    # is a directory* we ignore it. Yes, it's possible to have
-                    # two packages which both have the same canonicalized name,
-                    # and for each to have different contents. I don't quite
-                    # know how PyPI handle this but their XML and JSON APIs
-                    # already include such situations (in a small number of
-                    # cases). This setup is designed to create canonicalized
-                    # links where possible but not to clobber "real" packages
-                    # if they exist.
-                    #
-                    # What about new packages that want to take the place of a
-                    # canonicalized symlink? We (and TransferState.commit)
-                    # handle that by removing the symlink and making a
-                    # directory in its place.
-                    canon_dir = pkg_dir.with_name(canonicalize_name(pkg_dir.name))
-                    canon_dir.symlink_to(pkg_dir.name)
-                except FileExistsError:
-                    pass
+        page = ''.join(render_package_index(package, files))
+        json_page = ''.join(render_package_json(package, files))
+        digest = hashlib.sha256(
+            (page + json_page).encode('utf-8')).digest()
+        if package_written(pkg_dir, self.gzip_output) and (
+                digest == self.page_digest(package, pkg_dir)):
+            self.logger.debug('skipping unchanged index for %s', package)
+            return False
+        self.logger.info('writing index for %s', package)
+        write_package(self.output_path, package, files, page, json_page,
+                      self.gzip_output)
+        self.page_digests[package] = digest
+        return True
+
+    def page_digest(self, package, pkg_dir):
+        """
+        Return the digest of the HTML and JSON indexes of *package* in
+        *pkg_dir*, as recorded in :attr:`page_digests` or, if it is not yet
+        recorded there, as calculated from the existing files. Returns
+        :data:`None` if either index does not exist.
+
+        :param str package:
+            The name of the package the index belongs to.
+
+        :param pathlib.Path pkg_dir:
+            The path of the package's directory.
+        """
+        paths = [pkg_dir / 'index.html', pkg_dir / 'index.json']
+        try:
+            if not all(path.is_file() for path in paths):
+                return None
+            return self.page_digests[package]
+        except KeyError:
+            digest = hashlib.sha256()
+            for path in paths:
+                with path.open('rb') as page:
+                    digest.update(page.read())
+            digest = digest.digest()
+            self.page_digests[package] = digest
+            return digest
+
+
+def write_gzip(path, gzip_output=True):
+    """
+    If *gzip_output* is :data:`True`, (re)writes a gzip-compressed copy of
+    *path* alongside it with an additional ".gz" suffix. Otherwise, removes
+    any such copy left from when the option was enabled (so that stale copies
+    are never served).
+    """
+    gz_path = path.with_name(path.name + '.gz')
+    if not gzip_output:
+        try:
+            gz_path.unlink()
+        except FileNotFoundError:
+            pass
+        return
+    with tempfile.NamedTemporaryFile(mode='wb', dir=str(path.parent),
+                                     delete=False) as temp:
+        try:
+            # Fix the mtime in the gzip header so that re-compressing the
+            # same content always produces the same output
+            with path.open('rb') as source, \
+                    gzip.GzipFile(filename=path.name, mode='wb',
+                                  fileobj=temp.file, mtime=0) as dest:
+                shutil.copyfileobj(source, dest)
+        except BaseException:
+            temp.delete = True
+            raise
+        else:
+            os.fchmod(temp.file.fileno(), path.stat().st_mode & 0o777)
+            os.replace(temp.name, str(gz_path))
+
+
+def write_file(path, chunks, mode=0o644, gzip_output=False):
+    """
+    Atomically (re)writes the file at *path* from the series of strings in
+    *chunks* (encoded as UTF-8) with the permissions *mode*, along with its
+    compressed copy (see :func:`write_gzip`). Each chunk is written to the
+    temporary file as soon as it's produced, so the content of the file is
+    never held in memory in its entirety (unless *chunks* is a single string).
+    """
+    with tempfile.NamedTemporaryFile(mode='w', dir=str(path.parent),
+                                     encoding='utf-8',
+                                     delete=False) as index:
+        try:
+            index.file.writelines(chunks)
+        except BaseException:
+            index.delete = True
+            raise
+        else:
+            os.fchmod(index.file.fileno(), mode)
+            os.replace(index.name, str(path))
+    write_gzip(path, gzip_output)
+
+
+def write_package(output_path, package, files, page=None, json_page=None,
+                  gzip_output=False):
+    """
+    Unconditionally (re)writes the HTML and JSON indexes of *package* under
+    *output_path* from *files* (a sequence of rows with ``filename``,
+    ``filehash`` and ``filesize`` attributes). If the HTML index has already
+    been rendered (with :func:`render_package_index`) it may be passed as
+    *page*, and likewise the JSON index (rendered with
+    :func:`render_package_json`) as *json_page*. The JSON index is written
+    first.
+    """
+    pkg_dir = output_path / 'simple' / package
+    if page is None:
+        page = ''.join(render_package_index(package, files))
+    if json_page is None:
+        json_page = render_package_json(package, files)
+    else:
+        json_page = [json_page]
+    mkdir_override_symlink(pkg_dir)
+    write_file(pkg_dir / 'index.json', json_page, gzip_output=gzip_output)
+    write_file(pkg_dir / 'index.html', [page], gzip_output=gzip_output)
+    try:
+        # Workaround for #20: after constructing the index for a package
+        # attempt to symlink the "canonicalized" package name to the actual
+        # package directory. The reasons for doing things this way are rather
+        # complex...
+        #
+        # The older package name must exist for the benefit of older versions
+        # of pip. If the symlink already exists *or is a directory* we ignore
+        # it. Yes, it's possible to have two packages which both have the same
+        # canonicalized name, and for each to have different contents. I don't
+        # quite know how PyPI handle this but their XML and JSON APIs already
+        # include such situations (in a small number of cases). This setup is
+        # designed to create canonicalized links where possible but not to
+        # clobber "real" packages if they exist.
+        #
+        # What about new packages that want to take the place of a
+        # canonicalized symlink? We (and TransferState.commit) handle that by
+        # removing the symlink and making a directory in its place.
+        canon_dir = pkg_dir.with_name(canonicalize_name(pkg_dir.name))
+        canon_dir.symlink_to(pkg_dir.name)
+    except FileExistsError:
+        pass
+
+
+def package_written(pkg_dir, gzip_output=False):
+    """
+    Returns :data:`True` if all the index files :func:`write_package` writes
+    are present in *pkg_dir*: the HTML and JSON indexes and, if *gzip_output*
+    is :data:`True`, their compressed copies (or if it is :data:`False`, none
+    of those copies; stale ones must be removed). If *pkg_dir* is a symlink,
+    it's a canonicalized alias of another package's directory and must be
+    replaced, so this also returns :data:`False`.
+    """
+    if pkg_dir.is_symlink():
+        return False
+    for name in ('index.html', 'index.json'):
+        if not (pkg_dir / name).exists():
+            return False
+        if (pkg_dir / (name + '.gz')).exists() != bool(gzip_output):
+            return False
+    return True
+
+
+# The simple index pages only ever take one of two fixed shapes, so rather than
+# construct them with TagFactory (which is flexible, but slow when given
+# hundreds of thousands of links) they are rendered from the following
+# templates. The output is identical to the TagFactory equivalent (see
+# tests/master/test_index_scribe.py); any change to these must preserve that
+ROOT_INDEX_HEAD = (
+    '<!DOCTYPE html>\n'
+    '<html><head><title>Pi Wheels Simple Index</title>'
+    '<meta name="api-version" value="2"></head><body>')
+ROOT_INDEX_LINK = '<a href="{0}">{0}</a><br>'
+PACKAGE_INDEX_HEAD = (
+    '<!DOCTYPE html>\n'
+    '<html><head><title>Links for {0}</title></head><body>'
+    '<h1>Links for {0}</h1>')
+PACKAGE_INDEX_LINK = '<a href="{0}#sha256={1}" rel="internal">{0}</a><br>'
+INDEX_FOOT = '</body></html>'
+
+
+def render_root_index(packages, chunk=1000):
+    """
+    Generate the root simple index listing all *packages* (an ordered
+    iterable of package names) as a series of strings, each of which contains
+    up to *chunk* links.
+    """
+    yield ROOT_INDEX_HEAD
+    links = (
+        ROOT_INDEX_LINK.format(escape(package))
+        for package in packages
+    )
+    while True:
+        result = ''.join(islice(links, chunk))
+        if not result:
+            break
+        yield result
+    yield INDEX_FOOT
+
+
+def render_package_index(package, files):
+    """
+    Generate the simple index for *package*, linking to all *files* (a
+    sequence of rows with ``filename`` and ``filehash`` attributes) as a
+    series of strings.
+    """
+    yield PACKAGE_INDEX_HEAD.format(escape(package))
+    yield ''.join(
+        PACKAGE_INDEX_LINK.format(escape(f.filename), escape(f.filehash))
+        for f in files
+    )
+    yield INDEX_FOOT
+
+
+# The JSON equivalents of the simple index pages are likewise rendered from
+# templates; only the variable parts are encoded by the json module
+JSON_API_META = '{"meta":{"api-version":"1.1"},'
+JSON_FOOT = ']}'
+
+
+def render_root_json(packages, chunk=1000):
+    """
+    Generate the :pep:`691` JSON equivalent of the root simple index listing
+    all *packages* (an ordered iterable of package names) as a series of
+    strings, each of which contains up to *chunk* projects.
+    """
+    yield JSON_API_META + '"projects":['
+    packages = iter(packages)
+    sep = ''
+    while True:
+        projects = [{'name': package} for package in islice(packages, chunk)]
+        if not projects:
+            break
+        # Strip the enclosing [] from each chunk's list
+        yield sep + json.dumps(projects, separators=(',', ':'))[1:-1]
+        sep = ','
+    yield JSON_FOOT
+
+
+def render_package_json(package, files):
+    """
+    Generate the :pep:`691` JSON equivalent of the simple index for
+    *package*, listing all *files* (a sequence of rows with ``filename``,
+    ``filehash`` and ``filesize`` attributes) as a series of strings. As the
+    files include their size, this is version 1.1 of the API (:pep:`700`)
+    which also requires the list of the project's versions; these are taken
+    from the wheel filenames.
+    """
+    files = list(files)
+    versions = sorted({f.filename.split('-')[1] for f in files})
+    yield (JSON_API_META + '"name":' + json.dumps(canonicalize_name(package)) +
+           ',"versions":' + json.dumps(versions, separators=(',', ':')) +
+           ',"files":[')
+    yield json.dumps([
+        {
+            'filename': f.filename,
+            'url': f.filename,
+            'hashes': {'sha256': f.filehash},
+            'size': f.filesize,
+        }
+        for f in files
+    ], separators=(',', ':'))[1:-1]
+    yield JSON_FOOT
+
+
+def render_search_index(search_index, chunk=1000):
+    """
+    Generate the JSON search index from *search_index* (an iterable of
+    (package name, download count) tuples) as a series of strings, each of
+    which contains up to *chunk* entries. The output is identical to encoding
+    the entire index with :func:`json.dumps` (with compact separators).
+    """
+    yield '['
+    search_index = iter(search_index)
+    sep = ''
+    while True:
+        entries = list(islice(search_index, chunk))
+        if not entries:
+            break
+        yield sep + json.dumps(entries, separators=(',', ':'))[1:-1]
+        sep = ','
+    yield ']'
 
 
 # From pip/_vendor/packaging/utils.py
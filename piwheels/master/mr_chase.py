@@ -198,18 +198,19 @@ class MrChase(PauseableTask):
         If a transfer fails to verify, another "SEND" message with the same
         filename is returned to the build slave.
         """
-        if self.fs.verify(0, state.package):
-            self.index_queue.send_pyobj(['PKG', state.package])
-            self.logger.info('verified transfer of %s', state.next_file)
-            state.files[state.next_file].verified()
-            if state.transfers_done:
-                return ['DONE']
-            else:
-                self.fs.expect(0, state.files[state.next_file])
-                self.logger.info('send %s', state.next_file)
-                return ['SEND', state.next_file]
+        verified = self.fs.verify(0, state.package)
+        for filename in verified:
+            self.logger.info('verified transfer of %s', filename)
+            state.files[filename].verified()
+        if verified:
+            self.index_queue.send_pyobj(
+                ['PKG', state.package, state.index_files])
+        if state.transfers_done:
+            return ['DONE']
         else:
-            self.logger.info('re-send %s', state.next_file)
+            self.fs.expect(0, state.files[state.next_file])
+            self.logger.info('%s %s', 'send' if verified else 're-send',
+                             state.next_file)
             return ['SEND', state.next_file]
 
     def do_remove(self, state):
@@ -34,6 +34,9 @@ transfers from build slaves.
 See :class:`~.file_juggler.FileJuggler` for the usage of these functions.
 
 
+.. autoclass:: RangeSet
+    :members:
+
 .. autofunction:: consolidate
 
 .. autofunction:: exclude
@@ -43,6 +46,97 @@ See :class:`~.file_juggler.FileJuggler` for the usage of these functions.
 .. autofunction:: split
 """
 
+from bisect import bisect_left, bisect_right
+
+
+class RangeSet:
+    """
+    A set of non-overlapping *ranges* (which must all have a step of 1),
+    stored as sorted lists of their starts and stops so that :meth:`exclude`,
+    :meth:`intersects`, and :meth:`next_range` can locate the relevant ranges
+    with a binary search rather than a scan of the whole set. Iterating over
+    the set yields its ranges in ascending order. For example::
+
+        >>> r = RangeSet([range(10)])
+        >>> r.exclude(range(2, 4))
+        >>> list(r)
+        [range(0, 2), range(4, 10)]
+        >>> r.intersects(range(2, 4))
+        False
+        >>> r.next_range(1, 5)
+        range(1, 2)
+    """
+    def __init__(self, ranges=()):
+        self._starts = []
+        self._stops = []
+        ranges = sorted((r for r in ranges if r), key=lambda r: r.start)
+        if ranges:
+            for r in consolidate(ranges):
+                assert r.step == 1
+                self._starts.append(r.start)
+                self._stops.append(r.stop)
+
+    def __repr__(self):
+        return 'RangeSet({!r})'.format(list(self))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        for start, stop in zip(self._starts, self._stops):
+            yield range(start, stop)
+
+    def __eq__(self, other):
+        if isinstance(other, RangeSet):
+            return (self._starts, self._stops) == (other._starts, other._stops)
+        return NotImplemented
+
+    def _overlaps(self, r):
+        # Returns the slice of indexes of ranges that overlap r
+        return slice(bisect_right(self._stops, r.start),
+                     bisect_left(self._starts, r.stop))
+
+    def exclude(self, ex):
+        """
+        Remove all values covered by the range *ex* from the set.
+        """
+        if ex:
+            overlaps = self._overlaps(ex)
+            if overlaps.start < overlaps.stop:
+                starts = []
+                stops = []
+                if self._starts[overlaps.start] < ex.start:
+                    starts.append(self._starts[overlaps.start])
+                    stops.append(ex.start)
+                if self._stops[overlaps.stop - 1] > ex.stop:
+                    starts.append(ex.stop)
+                    stops.append(self._stops[overlaps.stop - 1])
+                self._starts[overlaps] = starts
+                self._stops[overlaps] = stops
+
+    def intersects(self, r):
+        """
+        Returns ``True`` if any value in the range *r* is in the set.
+        """
+        overlaps = self._overlaps(r)
+        return bool(r) and overlaps.start < overlaps.stop
+
+    def next_range(self, offset, size):
+        """
+        Returns the first range (of at most *size* values) in the set from the
+        window of *size* values starting at *offset*. If nothing in that window
+        is in the set, the first *size* values of the first range in the set
+        are returned instead, or ``None`` if the set is empty.
+        """
+        if self._starts:
+            index = bisect_right(self._stops, offset)
+            if index < len(self._starts) and \
+                    self._starts[index] < offset + size:
+                return range(max(offset, self._starts[index]),
+                             min(offset + size, self._stops[index]))
+            return range(self._starts[0],
+                         min(self._starts[0] + size, self._stops[0]))
+
 
 def consolidate(ranges):
     """
@@ -34,8 +34,9 @@ Defines the :class:`SlaveDriver` task; see class for more details.
 """
 
 import pickle
-from datetime import datetime
-from collections import defaultdict
+from bisect import insort
+from datetime import datetime, timedelta
+from collections import defaultdict, deque
 
 import zmq
 
@@ -51,7 +52,9 @@ class SlaveDriver(Task):
     This task handles interaction with the build slaves using the slave
     protocol. Interaction is driven by the slaves (i.e. the master doesn't
     *push* jobs, rather the slaves *request* a job and the master replies with
-    the next (package, version) tuple from the internal "builds" queue).
+    the next (package, version) tuple from the internal "builds" queue). When
+    no job is available, the slave's request is "parked" until a suitable job
+    arrives or :attr:`max_park_time` elapses.
 
     The task also incidentally interacts with several other queues: the
     internal "status" queue is sent details of every reply sent to a build
@@ -62,16 +65,20 @@ class SlaveDriver(Task):
     """
     # pylint: disable=too-many-instance-attributes
     name = 'master.slave_driver'
+    abi_queue_size = 1000
+    schedule_lookahead = 50
+    max_park_time = timedelta(minutes=2)
+    parallel_transfers = True
 
     def __init__(self, config):
         super().__init__(config)
         self.paused = False
-        self.abi_queues = defaultdict(set)
-        slave_queue = self.ctx.socket(zmq.ROUTER)
-        slave_queue.ipv6 = True
-        slave_queue.bind(config.slave_queue)
-        self.register(slave_queue, self.handle_slave)
-        builds_queue = self.ctx.socket(zmq.PULL)
+        self.abi_queues = defaultdict(lambda: AbiQueue(self.abi_queue_size))
+        self.slave_queue = self.ctx.socket(zmq.ROUTER)
+        self.slave_queue.ipv6 = True
+        self.slave_queue.bind(config.slave_queue)
+        self.register(self.slave_queue, self.handle_slave)
+        builds_queue = self.ctx.socket(zmq.REP)
         builds_queue.hwm = 10
         builds_queue.connect(config.builds_queue)
         self.register(builds_queue, self.handle_build)
@@ -88,6 +95,9 @@ class SlaveDriver(Task):
         self.db = DbClient(config)
         self.fs = FsClient(config)
         self.slaves = {}
+        self.estimates = {}
+        self.estimate_errors = deque(maxlen=100)
+        self.stats_timestamp = datetime.utcnow()
         self.pypi_simple = config.pypi_simple
 
     def close(self):
@@ -114,8 +124,24 @@ class SlaveDriver(Task):
 
     def loop(self):
         """
-        Remove slaves which have exceeded their timeout.
+        Tell parked slaves that have waited too long for a job to sleep,
+        remove slaves which have exceeded their timeout, and periodically
+        report scheduling statistics.
         """
+        now = datetime.utcnow()
+        if now - self.stats_timestamp > timedelta(seconds=10):
+            self.stats_timestamp = now
+            self.send_schedule_stats()
+        for slave in self.slaves.values():
+            # Parked requests must be answered well before the slave gives
+            # up waiting for us, or we consider the slave expired
+            if slave.parked is not None and (
+                    now - slave.parked >
+                    min(self.max_park_time, slave.timeout / 2)):
+                self.logger.info('slave %d (%s): sleeping because no builds',
+                                 slave.slave_id, slave.label)
+                slave.unpark()
+                self.send_reply(slave, ['SLEEP', 0])
         expired = {
             address: slave
             for address, slave in self.slaves.items()
@@ -128,6 +154,7 @@ class SlaveDriver(Task):
             # monitors know to remove the entry
             slave.reply = ['BYE']
             del self.slaves[address]
+            self.estimates.pop(address, None)
 
     def handle_control(self, queue):
         """
@@ -135,9 +162,10 @@ class SlaveDriver(Task):
 
         Whilst the :class:`SlaveDriver` task is "pauseable", it can't simply
         stop responding to requests from build slaves. Instead, its pause is
-        implemented as an internal flag. While paused it simply tells build
-        slaves requesting a new job that none are currently available but
-        otherwise continues servicing requests.
+        implemented as an internal flag. While paused it parks build slaves
+        requesting a new job (as if none were available) but otherwise
+        continues servicing requests. Parked slaves are handed jobs upon
+        resumption.
 
         It also understands a couple of extra control messages unique to it,
         specifically "KILL" to tell a build slave to terminate, and "HELLO"
@@ -152,10 +180,14 @@ class SlaveDriver(Task):
             self.paused = True
         elif msg == 'RESUME':
             self.paused = False
+            self.dispatch_parked()
         elif msg == 'KILL':
             for slave in self.slaves.values():
                 if slave.slave_id == args[0]:
                     slave.kill()
+                    if slave.parked is not None:
+                        slave.unpark()
+                        self.send_reply(slave, ['BYE'])
                     break
         elif msg == 'HELLO':
             for slave in self.slaves.values():
@@ -166,19 +198,45 @@ class SlaveDriver(Task):
     def handle_build(self, queue):
         """
         Build up ABI-specific queues of package versions waiting to be built.
-        The queues are limited to 1000 packages per ABI, and are kept as sets
-        to eliminate duplicate versions that will inevitably appear due to
+        The queues are limited to :attr:`abi_queue_size` packages per ABI, and
+        are kept as :class:`AbiQueue` instances which order builds by priority
+        and eliminate duplicate versions that will inevitably appear due to
         re-runs of the build-queue query (in :class:`TheArchitect`) while
         queried versions are actively being built.
+
+        Builds arrive in batches; each batch is answered with the number of
+        further rows the queues have room for, which limits the size of the
+        next batch :class:`TheArchitect` will send. Slaves parked waiting for
+        builds of the ABIs in the batch are then handed their jobs.
         """
-        abi, package, version = queue.recv_pyobj()
-        queue = self.abi_queues[abi]
-        if len(queue) < 1000:
-            queue.add((package, version))
+        msg, *args = queue.recv_pyobj()
+        abis = set()
+        if msg == 'QUEUE':
+            for abi, package, version, priority, duration in args[0]:
+                self.abi_queues[abi].add(package, version, priority, duration)
+                abis.add(abi)
+        else:
+            self.logger.error('invalid builds message: %s', msg)
+        queue.send_pyobj(['CREDIT', self.build_credit()])
+        if abis:
+            self.dispatch_parked(abis)
         self.stats_queue.send_pyobj(['STATBQ', {
             abi: len(queue) for (abi, queue) in self.abi_queues.items()
         }])
 
+    def build_credit(self):
+        """
+        Returns the number of builds :class:`TheArchitect` may send in its
+        next batch. This is the total free space in the ABI queues, or a full
+        queue's worth if no ABIs are known yet.
+        """
+        if not self.abi_queues:
+            return self.abi_queue_size
+        return sum(
+            self.abi_queue_size - len(abi_queue)
+            for abi_queue in self.abi_queues.values()
+        )
+
     def handle_slave(self, queue):
         """
         Handle requests from build slaves.
@@ -191,7 +249,7 @@ class SlaveDriver(Task):
         return a reply (in the usual form of a list of strings) or ``None`` if
         no reply should be sent (e.g. for a final "BYE" message).
         """
-        address, empty, msg = queue.recv_multipart()
+        address, _, msg = queue.recv_multipart()
         try:
             msg, *args = pickle.loads(msg)
         except (ValueError, pickle.UnpicklingError):
@@ -203,7 +261,18 @@ class SlaveDriver(Task):
             slave = self.slaves[address]
         except KeyError:
             if msg == 'HELLO':
-                slave = SlaveState(address, *args)
+                if not args or args[0] != const.SLAVE_PROTOCOL:
+                    self.logger.error(
+                        'slave protocol version does not match master (%d); '
+                        'upgrade the slave', const.SLAVE_PROTOCOL)
+                    self.slave_queue.send_multipart(
+                        [address, b'', pickle.dumps(['BYE'])])
+                    return
+                try:
+                    slave = SlaveState(address, *args[1:])
+                except TypeError:
+                    self.logger.error('invalid HELLO message from slave')
+                    return
             else:
                 self.logger.error('invalid first message from slave: %s',
                                   msg)
@@ -216,6 +285,7 @@ class SlaveDriver(Task):
                 'BYE': self.do_bye,
                 'IDLE': self.do_idle,
                 'BUILT': self.do_built,
+                'RESUME': self.do_resume,
                 'SENT': self.do_sent,
             }[msg]
         except KeyError:
@@ -226,9 +296,25 @@ class SlaveDriver(Task):
         else:
             reply = handler(slave)
             if reply is not None:
-                slave.reply = reply
-                queue.send_multipart([address, empty, pickle.dumps(reply)])
-                self.logger.debug('TX: %r', reply)
+                self.send_reply(slave, reply)
+
+    def send_reply(self, slave, reply):
+        """
+        Send *reply* to the build *slave*, updating its associated state
+        accordingly. This is used both for replies to requests as they are
+        received, and for replies to requests that were parked by
+        :meth:`do_idle`.
+
+        :param SlaveState slave:
+            The object representing the current status of the build slave.
+
+        :param list reply:
+            The message to send to the build slave.
+        """
+        slave.reply = reply
+        self.slave_queue.send_multipart(
+            [slave.address, b'', pickle.dumps(reply)])
+        self.logger.debug('TX: %r', reply)
 
     def do_hello(self, slave):
         """
@@ -244,9 +330,10 @@ class SlaveDriver(Task):
             The object representing the current status of the build slave.
         """
         self.logger.warning(
-            'slave %d: hello (timeout=%s, abi=%s, platform=%s, label=%s)',
+            'slave %d: hello (timeout=%s, abi=%s, platform=%s, label=%s, '
+            'slot=%d/%d)',
             slave.slave_id, slave.timeout, slave.native_abi,
-            slave.native_platform, slave.label)
+            slave.native_platform, slave.label, slave.slot + 1, slave.slots)
         self.slaves[slave.address] = slave
         return ['HELLO', slave.slave_id, self.pypi_simple]
 
@@ -264,18 +351,23 @@ class SlaveDriver(Task):
         # monitors know to remove the entry
         slave.reply = ['BYE']
         del self.slaves[slave.address]
+        self.estimates.pop(slave.address, None)
         return None
 
     def do_idle(self, slave):
         """
         Handler for the build slave's "IDLE" message (which is effectively the
         slave requesting work). If the master wants to terminate the slave,
-        it sends back "BYE". If the build queue (for the slave's ABI) is empty
-        or the task is currently paused, "SLEEP" is returned indicating the
-        slave should wait a while and then try again.
+        it sends back "BYE".
 
         If a job can be retrieved from the (ABI specific) build queue, then
-        a "BUILD" message is sent back with the required package and version.
+        a "BUILD" message is sent back with the required package and version
+        (see :meth:`choose_build` for the selection process). If the build
+        queue (for the slave's ABI) has nothing suitable, or the task is
+        currently paused, the request is parked and no reply is sent; the
+        reply will instead be sent by :meth:`dispatch_parked` when a job
+        becomes available, or by :meth:`loop` (as "SLEEP") if none has arrived
+        within :attr:`max_park_time`.
 
         :param SlaveState slave:
             The object representing the current status of the build slave.
@@ -287,35 +379,111 @@ class SlaveDriver(Task):
             return ['BYE']
         elif slave.terminated:
             return ['BYE']
-        elif self.paused:
-            self.logger.info(
-                'slave %d (%s): sleeping because master is paused',
-                slave.slave_id, slave.label)
-            return ['SLEEP']
         else:
-            try:
-                package, version = self.abi_queues[slave.native_abi].pop()
-            except KeyError:
-                pass
-            else:
-                if (package, version) not in self.active_builds():
-                    self.logger.info(
-                        'slave %d: build %s %s',
-                        slave.slave_id, package, version)
-                    return ['BUILD', package, version]
+            reply = self.next_build(slave)
+            if reply is None:
+                self.logger.info(
+                    'slave %d (%s): parked because %s',
+                    slave.slave_id, slave.label,
+                    'master is paused' if self.paused else 'no builds')
+                slave.park()
+            return reply
+
+    def dispatch_parked(self, abis=None):
+        """
+        Hand jobs to parked slaves (those with an "IDLE" request awaiting a
+        reply), longest waiting first. If *abis* is specified, only slaves
+        with a native ABI in that set are considered.
+        """
+        parked = sorted(
+            (
+                slave for slave in self.slaves.values()
+                if slave.parked is not None
+                and (abis is None or slave.native_abi in abis)
+            ), key=lambda slave: slave.parked)
+        for slave in parked:
+            reply = self.next_build(slave)
+            if reply is not None:
+                slave.unpark()
+                self.send_reply(slave, reply)
+
+    def next_build(self, slave):
+        """
+        Return the "BUILD" message for the next job that *slave* should
+        perform, or ``None`` if the task is paused or no suitable job is
+        currently available.
+        """
+        if self.paused:
+            return None
+        try:
+            package, version, estimate = self.choose_build(slave)
+        except ValueError:
+            return None
+        else:
             self.logger.info(
-                'slave %d (%s): sleeping because no builds',
-                slave.slave_id, slave.label)
-            return ['SLEEP']
+                'slave %d: build %s %s (estimate %s)',
+                slave.slave_id, package, version, estimate)
+            self.estimates[slave.address] = (estimate, datetime.utcnow())
+            return ['BUILD', package, version]
+
+    def choose_build(self, slave):
+        """
+        Select, and remove from the relevant ABI queue, the build to hand to
+        *slave*, returning a (package, version, estimate) tuple where
+        *estimate* is the predicted duration of the build. Raises
+        :exc:`ValueError` if no suitable build is found.
+
+        Only the first :attr:`schedule_lookahead` builds (in priority order)
+        are considered. Builds already in progress on other slaves are
+        discarded. Builds predicted to exceed the slave's timeout are skipped,
+        but only when another slave with the same ABI has a longer timeout;
+        otherwise this slave is their best chance (the estimate may be wrong)
+        and they'd never leave the queue. Of the rest, the first build which
+        *only* this slave is expected to complete (because its estimate
+        exceeds the timeout of every other slave with the same ABI) is chosen,
+        falling back to the highest priority build. This ensures very long
+        builds find their way to slaves with generous timeouts.
+        """
+        abi_queue = self.abi_queues[slave.native_abi]
+        active_builds = set(self.active_builds())
+        other_timeout = max((
+            other.timeout
+            for other in self.slaves.values()
+            if other is not slave and other.native_abi == slave.native_abi
+        ), default=timedelta(0))
+        choice = None
+        for package, version in list(abi_queue)[:self.schedule_lookahead]:
+            if (package, version) in active_builds:
+                abi_queue.remove(package, version)
+                continue
+            estimate = abi_queue.estimate(package, version)
+            if estimate is None:
+                estimate = timedelta(0)
+            if estimate > slave.timeout:
+                if other_timeout > slave.timeout:
+                    continue
+                self.logger.warning(
+                    'slave %d (%s): %s %s is expected to exceed the longest '
+                    'timeout (estimate %s)', slave.slave_id, slave.label,
+                    package, version, estimate)
+            if estimate > other_timeout:
+                choice = (package, version, estimate)
+                break
+            if choice is None:
+                choice = (package, version, estimate)
+        if choice is None:
+            raise ValueError('no suitable build')
+        abi_queue.remove(*choice[:2])
+        return choice
 
     def do_built(self, slave):
         """
         Handler for the build slave's "BUILT" message, which is sent after an
         attempted package build succeeds or fails. The handler logs the result
         in the database and, if files have been generated by the build, informs
-        the :class:`~.file_juggler.FileJuggler` task to expect a file transfer
+        the :class:`~.file_juggler.FileJuggler` task to expect file transfers
         before sending "SEND" back to the build slave with the required
-        filename.
+        filenames (see :meth:`send_files`).
 
         If no files were generated (e.g. in the case of a failed build, or a
         degenerate success), "DONE" is returned indicating that the build slave
@@ -328,64 +496,144 @@ class SlaveDriver(Task):
                 slave.slave_id, slave.label, slave.reply[0])
             return ['BYE']
         else:
+            self.record_estimate_error(slave)
             build_armv6l_hack(slave.build)
             self.db.log_build(slave.build)
             if slave.build.status and not slave.build.transfers_done:
                 self.logger.info('slave %d (%s): build succeeded',
                                  slave.slave_id, slave.label)
-                self.fs.expect(slave.slave_id,
-                               slave.build.files[slave.build.next_file])
-                self.logger.info('slave %d (%s): send %s',
-                                 slave.slave_id, slave.label,
-                                 slave.build.next_file)
-                return ['SEND', slave.build.next_file]
+                return self.send_files(slave)
             else:
                 self.logger.info('slave %d (%s): build failed',
                                  slave.slave_id, slave.label)
-                self.index_queue.send_pyobj(['PKG', slave.build.package])
+                self.index_queue.send_pyobj(['PKG', slave.build.package, []])
+                return ['DONE']
+
+    def do_resume(self, slave):
+        """
+        Handler for the build slave's "RESUME" message, which is sent instead
+        of "IDLE" by a slave re-connecting (typically after the master has
+        been restarted) while the files of a successful build were still being
+        transferred. The build was logged when it was originally reported, so
+        the handler simply restarts the file transfers;
+        :class:`~.file_juggler.FileJuggler` resumes any transfer it had
+        checkpointed (or deduplicates any file it already has).
+
+        If nothing remains to be transferred, or the master wants to terminate
+        the slave, "DONE" or "BYE" is returned respectively.
+        """
+        if slave.reply[0] != 'HELLO':
+            self.logger.error(
+                'slave %d (%s): protocol error (RESUME after %s)',
+                slave.slave_id, slave.label, slave.reply[0])
+            return ['BYE']
+        elif slave.terminated:
+            return ['BYE']
+        elif slave.build is None or not slave.build.status:
+            return ['DONE']
+        else:
+            build_armv6l_hack(slave.build)
+            if slave.build.transfers_done:
                 return ['DONE']
+            self.logger.info('slave %d (%s): resuming build of %s %s',
+                             slave.slave_id, slave.label,
+                             slave.build.package, slave.build.version)
+            return self.send_files(slave)
 
     def do_sent(self, slave):
         """
         Handler for the build slave's "SENT" message indicating that it's
-        finished sending the requested file to :class:`FileJuggler`. The
+        finished sending the requested files to :class:`FileJuggler`. The
         :class:`FsClient` RPC mechanism is used to ask :class:`FileJuggler` to
-        verify the transfer against the stored hash and, if this is successful,
-        a message is sent to :class:`IndexScribe` to regenerate the package's
-        index.
-
-        If further files remain to be transferred, another "SEND" message is
-        returned to the build slave. Otherwise, "DONE" is sent to free all
-        build resources.
-
-        If a transfer fails to verify, another "SEND" message with the same
-        filename is returned to the build slave.
+        verify the transfers against the stored hashes and, if any are
+        successful, a message is sent to :class:`IndexScribe` to regenerate the
+        package's index (along with the build's transferred files, so the
+        index can be regenerated without querying the database).
+
+        If further files remain to be transferred (including any that failed
+        to verify), another "SEND" message is returned to the build slave.
+        Otherwise, "DONE" is sent to free all build resources.
         """
         if slave.reply[0] != 'SEND':
             self.logger.error(
                 'slave %d (%s): protocol error (SENT after %s)',
                 slave.slave_id, slave.label, slave.reply[0])
             return ['BYE']
-        elif self.fs.verify(slave.slave_id, slave.build.package):
-            self.index_queue.send_pyobj(['PKG', slave.build.package])
-            slave.build.files[slave.build.next_file].verified()
+        verified = self.fs.verify(slave.slave_id, slave.build.package)
+        for filename in verified:
+            slave.build.files[filename].verified()
             self.logger.info(
                 'slave %d (%s): verified transfer of %s',
-                slave.slave_id, slave.label, slave.reply[1])
-            if slave.build.transfers_done:
-                return ['DONE']
-            else:
-                self.fs.expect(slave.slave_id,
-                               slave.build.files[slave.build.next_file])
-                self.logger.info('slave %d (%s): send %s',
-                                 slave.slave_id, slave.label,
-                                 slave.build.next_file)
-                return ['SEND', slave.build.next_file]
+                slave.slave_id, slave.label, filename)
+        if verified:
+            self.index_queue.send_pyobj(
+                ['PKG', slave.build.package, slave.build.index_files])
+        if slave.build.transfers_done:
+            return ['DONE']
         else:
-            self.logger.info('slave %d (%s): re-send %s',
-                             slave.slave_id, slave.label,
-                             slave.build.next_file)
-            return ['SEND', slave.build.next_file]
+            return self.send_files(slave)
+
+    def send_files(self, slave):
+        """
+        Inform :class:`~.file_juggler.FileJuggler` to expect transfers of the
+        files of *slave*'s build which remain to be transferred, and return the
+        "SEND" message requesting them. If :attr:`parallel_transfers` is set,
+        all remaining files are requested at once (and the slave transfers
+        them concurrently); otherwise they are requested one at a time.
+        """
+        if self.parallel_transfers:
+            filenames = slave.build.pending_files
+        else:
+            filenames = [slave.build.next_file]
+        for filename in filenames:
+            self.fs.expect(slave.slave_id, slave.build.files[filename])
+        self.logger.info('slave %d (%s): send %s',
+                         slave.slave_id, slave.label, ', '.join(filenames))
+        return ['SEND'] + filenames
+
+    def record_estimate_error(self, slave):
+        """
+        Compare the actual duration of *slave*'s build with the duration
+        predicted when it was handed out, and update the scheduling
+        statistics.
+        """
+        try:
+            estimate, _ = self.estimates.pop(slave.address)
+        except KeyError:
+            return
+        if slave.build is not None:
+            actual = timedelta(seconds=slave.build.duration)
+            self.estimate_errors.append(abs(actual - estimate))
+
+    def send_schedule_stats(self):
+        """
+        Send the expected makespan (the predicted time to complete all queued
+        and active builds with the currently connected slaves) and the mean
+        error of recent build duration predictions to the stats queue.
+        """
+        now = datetime.utcnow()
+        makespan = timedelta(0)
+        for abi, abi_queue in self.abi_queues.items():
+            slaves = [
+                slave for slave in self.slaves.values()
+                if slave.native_abi == abi
+            ]
+            if slaves:
+                work = abi_queue.total_estimate()
+                for slave in slaves:
+                    try:
+                        estimate, started = self.estimates[slave.address]
+                    except KeyError:
+                        pass
+                    else:
+                        work += max(timedelta(0), estimate - (now - started))
+                makespan = max(makespan, work / len(slaves))
+        if self.estimate_errors:
+            error = sum(self.estimate_errors, timedelta(0)) / len(
+                self.estimate_errors)
+        else:
+            error = timedelta(0)
+        self.stats_queue.send_pyobj(['STATSCHED', makespan, error])
 
     def active_builds(self):
         """
@@ -398,6 +646,93 @@ class SlaveDriver(Task):
                     yield (slave.reply[1], slave.reply[2])
 
 
+class AbiQueue:
+    """
+    A bounded priority queue of (package, version) builds for a single ABI.
+    Adding a build that is already present simply updates its priority. When
+    the queue is full, a new build displaces the lowest priority build, if
+    the new build has a higher priority.
+
+    Iterating over the queue yields (package, version) tuples in priority
+    order (highest first).
+
+    :param int maxlen:
+        The maximum number of builds the queue may hold.
+    """
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._entries = {}
+        # Sorted in ascending order of (priority, package, version); with
+        # only a thousand or so entries, list insertion is cheap enough
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __iter__(self):
+        for _, package, version in reversed(self._queue):
+            yield package, version
+
+    def __contains__(self, build):
+        return build in self._entries
+
+    def add(self, package, version, priority, estimate=None):
+        """
+        Add the build of *package* at *version* with the specified *priority*
+        and *estimate* of its duration (a :class:`~datetime.timedelta`) to the
+        queue.
+        """
+        key = (package, version)
+        try:
+            old_priority, _ = self._entries[key]
+        except KeyError:
+            if len(self._queue) >= self.maxlen:
+                if not self._queue or priority <= self._queue[0][0]:
+                    return
+                self.remove(*self._queue[0][1:])
+        else:
+            if priority == old_priority:
+                self._entries[key] = (priority, estimate)
+                return
+            self.remove(package, version)
+        self._entries[key] = (priority, estimate)
+        insort(self._queue, (priority, package, version))
+
+    def estimate(self, package, version):
+        """
+        Return the estimated duration of the build of *package* at *version*.
+        Raises :exc:`KeyError` if the build isn't present.
+        """
+        return self._entries[(package, version)][1]
+
+    def total_estimate(self):
+        """
+        Return the sum of the estimated durations of all builds in the queue.
+        """
+        return sum((
+            estimate
+            for _, estimate in self._entries.values()
+            if estimate is not None
+        ), timedelta(0))
+
+    def remove(self, package, version):
+        """
+        Remove the build of *package* at *version* from the queue. Raises
+        :exc:`KeyError` if the build isn't present.
+        """
+        priority, _ = self._entries.pop((package, version))
+        self._queue.remove((priority, package, version))
+
+    def pop(self):
+        """
+        Remove and return the (package, version) of the highest priority build
+        in the queue. Raises :exc:`IndexError` if the queue is empty.
+        """
+        priority, package, version = self._queue.pop()
+        del self._entries[(package, version)]
+        return package, version
+
+
 def build_armv6l_hack(build):
     """
     A dirty hack for armv6l wheels; if the build contains any arch-specific
@@ -45,14 +45,19 @@ artifacts (:class:`FileState`).
     :members:
 """
 
+import io
+import os
+import json
+import zlib
 import hashlib
 import logging
 import tempfile
+from time import monotonic, time
 from pathlib import Path
 from datetime import datetime, timedelta
 from collections import namedtuple
 
-from .ranges import exclude, intersect
+from .ranges import RangeSet
 
 # pylint complains about all these classes having too many attributes (and thus
 # their constructors having too many arguments) and about the lack of (entirely
@@ -384,6 +389,28 @@ class BuildState:
                 return filename
         return None
 
+    @property
+    def pending_files(self):
+        """
+        Returns a sorted list of the filenames of all files that still need
+        transferring.
+        """
+        return sorted(
+            filename for filename, f in self._files.items()
+            if not f.transferred)
+
+    @property
+    def index_files(self):
+        """
+        Returns a sorted list of (filename, filehash, filesize) tuples for all
+        files that have been transferred, as sent to
+        :class:`~.index_scribe.IndexScribe` to update the package's index.
+        """
+        return [
+            (f.filename, f.filehash, f.filesize)
+            for filename, f in sorted(self._files.items())
+            if f.transferred]
+
     def logged(self, build_id):
         """
         Called to fill in the build's ID in the backend database.
@@ -398,17 +425,24 @@ class SlaveState:
     turn manages the associated :class:`BuildState` (accessible from
     :attr:`build`) and :class:`TransferState` (accessible from
     :attr:`transfer`). The class also tracks the time a request was last seen
-    from the build slave, and includes a :meth:`kill` method.
+    from the build slave, whether the slave's last request is currently
+    :attr:`parked` awaiting work, and includes a :meth:`kill` method.
+
+    A build slave running several builds concurrently connects once for each
+    of its build slots; each connection has its own state, distinguished by
+    :attr:`slot` (numbered from 0 to :attr:`slots` - 1).
     """
     counter = 0
     status_queue = None
 
     def __init__(self, address, timeout, native_py_version, native_abi,
-                 native_platform, label):
+                 native_platform, label, slot, slots):
         SlaveState.counter += 1
         self._address = address
         self._slave_id = SlaveState.counter
         self._label = label
+        self._slot = slot
+        self._slots = slots
         self._timeout = timedelta(seconds=timeout)
         self._native_py_version = native_py_version
         self._native_abi = native_abi
@@ -419,6 +453,7 @@ class SlaveState:
         self._reply = None
         self._build = None
         self._terminated = False
+        self._parked = None
 
     def __repr__(self):
         return (
@@ -438,7 +473,7 @@ class SlaveState:
         SlaveState.status_queue.send_pyobj(
             [self._slave_id, self._first_seen, 'HELLO',
              self._timeout, self._native_py_version, self._native_abi,
-             self._native_platform, self._label])
+             self._native_platform, self._label, self._slot, self._slots])
         if self._reply is not None and self._reply[0] != 'HELLO':
             # Replay the last reply for the sake of monitors that have just
             # connected to the master
@@ -448,10 +483,20 @@ class SlaveState:
     def kill(self):
         self._terminated = True
 
+    def park(self):
+        self._parked = datetime.utcnow()
+
+    def unpark(self):
+        self._parked = None
+
     @property
     def terminated(self):
         return self._terminated
 
+    @property
+    def parked(self):
+        return self._parked
+
     @property
     def address(self):
         return self._address
@@ -464,6 +509,14 @@ class SlaveState:
     def label(self):
         return self._label
 
+    @property
+    def slot(self):
+        return self._slot
+
+    @property
+    def slots(self):
+        return self._slots
+
     @property
     def timeout(self):
         return self._timeout
@@ -508,18 +561,23 @@ class SlaveState:
     def request(self, value):
         self._last_seen = datetime.utcnow()
         self._request = value
-        if value[0] == 'BUILT':
+        if value[0] in ('BUILT', 'RESUME'):
             try:
-                status, duration, output, files = value[1:]
+                if value[0] == 'BUILT':
+                    package, version = self._reply[1:3]
+                    status, duration, output, files = value[1:]
+                else:
+                    package, version, status, duration, output, files = \
+                        value[1:]
                 self._build = BuildState(
-                    self._slave_id, self._reply[1], self._reply[2],
+                    self._slave_id, package, version,
                     self.native_abi, status, duration, output, files={
                         filename: FileState(filename, *filestate)
                         for filename, filestate in files.items()
                     }
                 )
             except (ValueError, TypeError):
-                logging.error('Invalid BUILT message: %r', value)
+                logging.error('Invalid %s message: %r', value[0], value)
                 self._build = None
 
     @property
@@ -549,37 +607,130 @@ class TransferState:
     methods to write a recevied :meth:`chunk`, and to determine the next chunk
     to :meth:`fetch`, as well as a property to determine when the transfer is
     :attr:`done`.
+
+    The file's hash is calculated incrementally as contiguous chunks arrive.
+    Chunks that arrive out of order are buffered (up to :attr:`hash_buffer`
+    bytes) until the gap before them is filled; anything that couldn't be
+    buffered is re-read from the file by :meth:`verify`.
+
+    The size of the chunks requested, and the number of requests permitted in
+    flight (the "window"), start at :attr:`chunk_size` and
+    :attr:`pipeline_size` respectively and adapt to the round-trip time of
+    each request, in a manner similar to TCP congestion control. While
+    round-trip times stay close to the lowest seen, the window grows by
+    roughly one request per round-trip; when it reaches
+    :attr:`max_pipeline_size` the chunk size is doubled (and the window
+    halved) up to :attr:`max_chunk_size`. When round-trip times balloon
+    (beyond double the lowest seen, and by more than :attr:`rtt_tolerance`
+    seconds so that jitter on fast links isn't mistaken for queueing,
+    indicating requests are queueing somewhere), or the slave has to re-prod
+    us (indicating lost requests), the window is halved down to
+    :attr:`min_pipeline_size`, after which the chunk size is halved instead,
+    down to :attr:`min_chunk_size`.
+
+    If *source* is specified, it is the path of an existing (verified) file
+    with the same content as the file to be transferred. In this case the
+    temporary file is simply a hard-link to *source*, and the transfer is
+    :attr:`done` from the outset.
+
+    While a transfer is in progress, the path of its temporary file and the
+    ranges yet to be received are periodically (every
+    :attr:`checkpoint_interval` seconds) written to a checkpoint file
+    alongside it. After a restart, :meth:`checkpoints` finds these and, if
+    *resume* is specified, it is a ``(path, ranges)`` tuple from that method;
+    the transfer then continues writing into the existing temporary file and
+    only fetches the missing *ranges*.
+
+    Slaves may offer to compress chunks in transit; if one of the offered
+    codecs is in :attr:`codecs`, :meth:`negotiate` selects it as the
+    :attr:`codec` for the transfer and :meth:`chunk` decompresses any chunks
+    that arrive compressed. The number of bytes this saved is available from
+    :attr:`compression_saved`.
     """
 
     chunk_size = 65536
+    min_chunk_size = 16384
+    max_chunk_size = 262144
     pipeline_size = 10
+    min_pipeline_size = 2
+    max_pipeline_size = 40
+    rtt_tolerance = 0.01
+    hash_buffer = 4 * 1024 * 1024
+    checkpoint_interval = 5.0
+    checkpoint_expiry = 24 * 60 * 60
+    codecs = ('zlib',)
     output_path = Path('.')
 
-    def __init__(self, slave_id, file_state):
+    def __init__(self, slave_id, file_state, source=None, resume=None):
         self._slave_id = slave_id
         self._file_state = file_state
+        self._source = source
         try:
             (self.output_path / 'simple').mkdir()
         except FileExistsError:
             pass
-        self._file = tempfile.NamedTemporaryFile(
-            dir=str(self.output_path / 'simple'), delete=False)
-        self._file.seek(self._file_state.filesize)
-        self._file.truncate()
+        if resume is not None:
+            self._file = open(str(resume[0]), 'r+b')
+        elif source is None:
+            self._file = tempfile.NamedTemporaryFile(
+                dir=str(self.output_path / 'simple'), delete=False)
+            self._file.seek(self._file_state.filesize)
+            self._file.truncate()
+        else:
+            self._file = tempfile.NamedTemporaryFile(
+                dir=str(self.output_path / 'simple'), delete=False)
+            # Atomically replace the temporary file with a link to source
+            link = Path(self._file.name + '.link')
+            try:
+                os.link(str(source), str(link))
+            except OSError:
+                self._file.close()
+                Path(self._file.name).unlink()
+                raise
+            link.replace(self._file.name)
+            self._file.close()
+            self._file = open(self._file.name, 'rb')
         # See 0MQ guide's File Transfers section for more on the credit-driven
         # nature of this interaction
         self._credit = 0
         # _offset is the position that we will next return when the fetch()
         # method is called (or rather, it's the minimum position we'll return)
-        # whilst _map is a sorted list of ranges indicating which bytes of the
-        # file we have yet to received; this is manipulated by chunk()
+        # whilst _map is a RangeSet indicating which bytes of the file we have
+        # yet to received; this is manipulated by chunk()
         self._offset = 0
-        self._map = [range(self._file_state.filesize)]
+        if resume is not None:
+            self._map = RangeSet(resume[1])
+        elif source is None:
+            self._map = RangeSet([range(self._file_state.filesize)])
+        else:
+            self._map = RangeSet()
+        # _hash is the hash of the file up to the _hashed position; _pending
+        # maps the offsets of chunks beyond that position to their data, which
+        # is fed to the hash once the gap before them is filled
+        self._hash = hashlib.sha256()
+        self._hashed = 0
+        self._pending = {}
+        self._pending_size = 0
+        # _fetch_size and _window are the current chunk size and window
+        # (which is fractional to permit additive increase); _sent maps the
+        # offsets of fetches in flight to the time they were requested for
+        # the purposes of measuring round-trip times
+        self._fetch_size = self.chunk_size
+        self._window = float(self.pipeline_size)
+        self._sent = {}
+        self._rtt = None
+        self._min_rtt = None
+        self._backoff = 0.0
+        self._started = monotonic()
+        self._received = 0
+        self._compression_saved = 0
+        self._codec = None
+        self._checkpointed = self._started
         self.reset_credit()
 
     def __repr__(self):
         return "<TransferState: offset={offset} map={_map}>".format(
-            offset=self._offset, _map=self._map)
+            offset=self._offset, _map=list(self._map))
 
     @property
     def slave_id(self):
@@ -593,53 +744,248 @@ class TransferState:
     def done(self):
         return not self._map
 
+    @property
+    def deduplicated(self):
+        return self._source is not None
+
+    @property
+    def codec(self):
+        return self._codec
+
+    @property
+    def compression_saved(self):
+        return self._compression_saved
+
+    @property
+    def remaining(self):
+        return sum(len(r) for r in self._map)
+
+    @property
+    def fetch_size(self):
+        return self._fetch_size
+
+    @property
+    def window(self):
+        return int(self._window)
+
+    @property
+    def rtt(self):
+        return self._rtt
+
+    @property
+    def throughput(self):
+        return self._received / max(1e-6, monotonic() - self._started)
+
     def fetch(self):
-        if self._credit:
+        # NOTE: credit can be negative when the window shrinks; it must be
+        # repaid by received chunks before further fetches are permitted
+        if self._credit > 0:
             self._credit -= 1
-            assert self._credit >= 0
-            fetch_range = range(self._offset, self._offset + self.chunk_size)
-            while True:
-                for map_range in self._map:
-                    result = intersect(map_range, fetch_range)
-                    if result:
-                        self._offset = result.stop
-                        return result
-                try:
-                    fetch_range = range(self._map[0].start,
-                                        self._map[0].start + self.chunk_size)
-                except IndexError:
-                    return None
-
-    def chunk(self, offset, data):
-        # XXX Check we actually still need this chunk? I/O is expensive after all
-        self._file.seek(offset)
-        self._file.write(data)
-        self._map = list(exclude(self._map, range(offset, offset + len(data))))
+            result = self._map.next_range(self._offset, self._fetch_size)
+            if result is not None:
+                self._offset = result.stop
+                self._sent[result.start] = monotonic()
+            return result
+
+    def negotiate(self, offered):
+        """
+        Select the first of the *offered* compression codecs that is
+        supported as the :attr:`codec` of the transfer.
+        """
+        for codec in offered:
+            if codec in self.codecs:
+                self._codec = codec
+                break
+
+    def chunk(self, offset, data, codec=None):
+        if codec is not None:
+            if codec != self._codec:
+                raise ValueError('unexpected codec: %s' % codec)
+            compressed_size = len(data)
+            # Never inflate a chunk beyond the largest size we'd request
+            decompressor = zlib.decompressobj()
+            try:
+                data = decompressor.decompress(data, self.max_chunk_size)
+            except zlib.error as exc:
+                raise ValueError('corrupt chunk: %s' % exc)
+            if decompressor.unconsumed_tail:
+                raise ValueError('oversized chunk')
+            self._compression_saved += len(data) - compressed_size
+        chunk_range = range(offset, offset + len(data))
+        # Don't bother writing (or hashing) chunks we've already received in
+        # their entirety (e.g. duplicates due to fetch retries)
+        if self._map.intersects(chunk_range):
+            os.pwrite(self._file.fileno(), data, offset)
+            self._map.exclude(chunk_range)
+            self._hash_chunk(offset, data)
+            self._received += len(data)
+        sent = self._sent.pop(offset, None)
+        if sent is not None:
+            self._adapt(monotonic() - sent)
         if not self._map:
             self._credit = 0
         else:
             self._credit += 1
+            if monotonic() - self._checkpointed > self.checkpoint_interval:
+                self.checkpoint()
+
+    def _adapt(self, rtt):
+        now = monotonic()
+        if self._rtt is None:
+            self._rtt = rtt
+        else:
+            self._rtt = (self._rtt * 7 + rtt) / 8
+        if self._min_rtt is None or rtt < self._min_rtt:
+            self._min_rtt = rtt
+        window = int(self._window)
+        delayed = rtt > max(self._min_rtt * 2,
+                            self._min_rtt + self.rtt_tolerance)
+        if delayed and now > self._backoff:
+            # Only back off once per round-trip; the requests already in
+            # flight will likely all see similar delays
+            self._backoff = now + self._rtt
+            self._decrease()
+        else:
+            self._window += 1 / self._window
+            if self._window >= self.max_pipeline_size:
+                if self._fetch_size < self.max_chunk_size:
+                    self._resize(self._fetch_size * 2)
+                    self._window /= 2
+                else:
+                    self._window = float(self.max_pipeline_size)
+        self._credit += int(self._window) - window
+
+    def _decrease(self):
+        if self._window / 2 >= self.min_pipeline_size:
+            self._window /= 2
+        elif self._fetch_size > self.min_chunk_size:
+            self._resize(self._fetch_size // 2)
+        else:
+            self._window = float(self.min_pipeline_size)
+
+    def _resize(self, size):
+        self._fetch_size = max(self.min_chunk_size,
+                               min(self.max_chunk_size, size))
+        # Round-trip times for the new chunk size aren't comparable with the
+        # old ones
+        self._min_rtt = None
+
+    def _hash_chunk(self, offset, data):
+        if offset <= self._hashed < offset + len(data):
+            self._hash.update(data[self._hashed - offset:])
+            self._hashed = offset + len(data)
+            while self._pending:
+                try:
+                    data = self._pending.pop(self._hashed)
+                except KeyError:
+                    break
+                else:
+                    self._pending_size -= len(data)
+                    self._hash.update(data)
+                    self._hashed += len(data)
+        elif offset > self._hashed:
+            if self._pending_size + len(data) <= self.hash_buffer:
+                self._pending[offset] = data
+                self._pending_size += len(data)
 
     def reset_credit(self):
-        self._credit = max(1, min(self.pipeline_size,
-                           self._file_state.filesize // self.chunk_size))
+        if self._sent:
+            # Requests have been lost; back off
+            self._sent.clear()
+            self._decrease()
+        self._credit = max(1, min(int(self._window),
+                           self._file_state.filesize // self._fetch_size))
+
+    @property
+    def _checkpoint_path(self):
+        return Path(self._file.name + '.state')
+
+    def checkpoint(self):
+        """
+        Write the state of the transfer to its checkpoint file, permitting
+        :meth:`checkpoints` to find it after a restart. The ranges recorded are
+        never fewer than those actually missing (chunks are written before the
+        checkpoint is), and anything lost to a crash of the machine itself is
+        caught by :meth:`verify`.
+        """
+        state = {
+            'filename': self._file_state.filename,
+            'filesize': self._file_state.filesize,
+            'filehash': self._file_state.filehash,
+            'missing': [[r.start, r.stop] for r in self._map],
+        }
+        path = self._checkpoint_path
+        tmp_path = path.with_name(path.name + '.tmp')
+        with tmp_path.open('w') as f:
+            json.dump(state, f)
+        tmp_path.replace(path)
+        self._checkpointed = monotonic()
+
+    def _discard_checkpoint(self):
+        try:
+            self._checkpoint_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def checkpoints(cls):
+        """
+        Return a :class:`dict` mapping ``(filename, filehash)`` tuples to
+        ``(path, ranges)`` tuples for each interrupted transfer checkpointed
+        under :attr:`output_path`, suitable for the *resume* parameter.
+        Checkpoints older than :attr:`checkpoint_expiry` seconds (or otherwise
+        unusable) are removed along with their temporary files.
+        """
+        result = {}
+        for path in (cls.output_path / 'simple').glob('*.state'):
+            tmp_path = path.with_name(path.stem)
+            try:
+                if time() - path.stat().st_mtime > cls.checkpoint_expiry:
+                    raise ValueError('expired checkpoint')
+                with path.open('r') as f:
+                    state = json.load(f)
+                ranges = [
+                    range(start, stop) for start, stop in state['missing']]
+                if tmp_path.stat().st_size != state['filesize']:
+                    raise ValueError('wrong size for checkpointed transfer')
+            except (OSError, ValueError, KeyError, TypeError):
+                for p in (path, tmp_path):
+                    try:
+                        p.unlink()
+                    except FileNotFoundError:
+                        pass
+            else:
+                result[(state['filename'], state['filehash'])] = (
+                    tmp_path, ranges)
+        return result
 
     def verify(self):
-        # XXX Would be nicer to construct the hash from the transferred chunks
-        # with a tree, but this potentially costs quite a bit of memory
-        self._file.seek(0)
-        body = hashlib.sha256()
+        if self._source is not None:
+            # Deduplicated files are links to files that have already been
+            # verified (and aren't modified once committed); just make sure
+            # nothing has happened to the source in the meantime
+            size = self._file.seek(0, io.SEEK_END)
+            self._file.close()
+            if size != self._file_state.filesize:
+                raise IOError('wrong size for transfer at %s' % self._file.name)
+            return
+        # Only the portion of the file that couldn't be hashed as it arrived
+        # (because of gaps in the received chunks) needs reading back
+        self._pending.clear()
+        self._pending_size = 0
+        self._file.seek(self._hashed)
         while True:
             buf = self._file.read(self.chunk_size)
             if buf:
-                body.update(buf)
+                self._hash.update(buf)
+                self._hashed += len(buf)
             else:
                 break
-        size = self._file.tell()
+        size = self._file.seek(0, io.SEEK_END)
         self._file.close()
         if size != self._file_state.filesize:
             raise IOError('wrong size for transfer at %s' % self._file.name)
-        if body.hexdigest().lower() != self._file_state.filehash:
+        if self._hash.hexdigest().lower() != self._file_state.filehash:
             raise IOError('failed to verify transfer at %s' % self._file.name)
 
     def commit(self, package):
@@ -650,8 +996,21 @@ class TransferState:
         final_name = pkg_dir / self._file_state.filename
         # rename() will replace any existing file *or* symlink. This means in
         # the case of an actual armv6 build being uploaded, it will (rightly)
-        # clobber any symlink currently in place
-        tmp_file.rename(final_name)
+        # clobber any symlink currently in place. However, it does nothing if
+        # both names are links to the same file (as can happen when a
+        # deduplicated file is re-sent) so remove the temporary in that case
+        try:
+            final_stat = final_name.lstat()
+        except FileNotFoundError:
+            final_stat = None
+        tmp_stat = tmp_file.lstat()
+        if final_stat is not None and (
+                (final_stat.st_dev, final_stat.st_ino) ==
+                (tmp_stat.st_dev, tmp_stat.st_ino)):
+            tmp_file.unlink()
+        else:
+            tmp_file.rename(final_name)
+        self._discard_checkpoint()
         if self._file_state.platform_tag == 'linux_armv7l':
             # NOTE: dirty hack to symlink the armv7 wheel to the armv6 name;
             # the slave_driver task expects us to have done this
@@ -666,9 +1025,11 @@ class TransferState:
                 # overwrite it
                 pass
         self._file_state.verified()
+        return final_name
 
     def rollback(self):
         Path(self._file.name).unlink()
+        self._discard_checkpoint()
 
 
 DownloadState = namedtuple('DownloadState', (
@@ -688,7 +1049,7 @@ DownloadState = namedtuple('DownloadState', (
 def mkdir_override_symlink(pkg_dir):
     """
     Make *pkg_dir*, replacing any existing symlink in its place. See the
-    notes in :meth:`IndexScribe.write_package_index` for more information.
+    notes in :func:`~.index_scribe.write_package` for more information.
     """
     # There is a tiny possibility of a race here between two threads wanting
     # to replace a symlinked dir with a "real" dir, hence the loop below
@@ -33,6 +33,9 @@ Defines :class:`TheArchitect` task; see class for more details.
     :members:
 """
 
+from datetime import datetime, timedelta
+from itertools import islice
+
 import zmq
 
 from .tasks import Task
@@ -42,37 +45,112 @@ from .db import Database
 class TheArchitect(Task):
     """
     This task queries the backend database to determine which versions of
-    packages have yet to be built (and aren't marked to be skipped). It places
-    a tuple of (package, version) for each such build into the internal
-    "builds" queue for :class:`~.slave_driver.SlaveDriver` to read.
+    packages have yet to be built (and aren't marked to be skipped). It feeds
+    batches of (abi, package, version, priority, duration) tuples for such
+    builds, most valuable first, into the internal "builds" queue for
+    :class:`~.slave_driver.SlaveDriver` to read. The duration is an estimate
+    of how long the build will take, derived from the package's build history.
+
+    The feed is flow-controlled by a simple credit scheme: every batch sent is
+    answered by :class:`~.slave_driver.SlaveDriver` with the number of rows it
+    is currently willing to accept, and the next batch is limited to that
+    many rows (and at most :attr:`batch_size`).
     """
     name = 'master.the_architect'
+    batch_size = 500
+    requery_interval = timedelta(minutes=1)
+    reprioritize_interval = timedelta(hours=1)
 
     def __init__(self, config):
         super().__init__(config)
         self.db = Database(config.dsn)
         self.query = self.db.get_build_queue()
-        self.builds_queue = self.ctx.socket(zmq.PUSH)
-        self.builds_queue.hwm = 10
-        self.builds_queue.bind(config.builds_queue)
+        self.query_timestamp = datetime.utcnow()
+        self.reprioritize_timestamp = datetime.utcnow()
+        self.credit = 0
+        self.next_feed = datetime.utcnow()
+        self.fed_count = 0
+        self.fed_timestamp = datetime.utcnow()
+        builds_queue = self.ctx.socket(zmq.REQ)
+        builds_queue.hwm = 10
+        builds_queue.bind(config.builds_queue)
+        self.register(builds_queue, self.handle_credit)
+        self.builds_queue = builds_queue
+        self.stats_queue = self.ctx.socket(zmq.PUSH)
+        self.stats_queue.hwm = 10
+        self.stats_queue.connect(config.stats_queue)
 
     def close(self):
+        self.stats_queue.close()
         self.db.close()
         super().close()
 
     def loop(self):
         """
-        The architect simply runs the build queue query repeatedly. On each
-        loop iteration, an entry from the result set is added to the relevant
-        ABI queue. The queues are limited in length to prevent silly memory
-        usage on the initial run (which will involve millions of entries). This
-        does mean that a single loop over the query will potentially miss
-        entries, but that's fine as it'll just be repeated again.
+        The architect simply runs the build queue query repeatedly. Whenever
+        credit is available, the next batch of rows from the result set is
+        sent to :class:`~.slave_driver.SlaveDriver` which adds them to the
+        relevant ABI queues. Those queues are limited in length to prevent
+        silly memory usage on the initial run (which will involve millions of
+        entries). This does mean that a single loop over the query will
+        potentially miss entries, but that's fine as it'll just be repeated
+        again.
+
+        When no credit is available, an empty batch is sent (at most once a
+        second) to ask for more. When the query is exhausted, it is re-run
+        after a one second pause to avoid hammering the database. As the query
+        is ordered by priority, it is also re-run every
+        :attr:`requery_interval` so that valuable new builds don't have to wait
+        for a pass over the whole result set, and the priorities themselves are
+        re-calculated every :attr:`reprioritize_interval` (as they decay with
+        age and follow download counts).
         """
-        try:
-            row = next(self.query)
-            self.builds_queue.send_pyobj(
-                (row.abi_tag, row.package, row.version)
-            )
-        except StopIteration:
+        now = datetime.utcnow()
+        if now - self.fed_timestamp > timedelta(seconds=10):
+            self.stats_queue.send_pyobj([
+                'STATFEED',
+                self.fed_count / (now - self.fed_timestamp).total_seconds()
+            ])
+            self.fed_count = 0
+            self.fed_timestamp = now
+        if self.credit is None or now < self.next_feed:
+            # Either we're waiting for a reply to the last batch, or we're
+            # deliberately waiting before the next one
+            return
+        if now - self.reprioritize_timestamp > self.reprioritize_interval:
+            # Finish the current query before re-scoring the queue; the new
+            # query below will then pick up the new order
+            self.query.close()
+            self.db.reprioritize_build_queue()
+            self.reprioritize_timestamp = now
+            self.query_timestamp = datetime.min
+        if now - self.query_timestamp > self.requery_interval:
+            self.query = self.db.get_build_queue()
+            self.query_timestamp = now
+        batch = [
+            (row.abi_tag, row.package, row.version, row.priority,
+             row.duration)
+            for row in islice(self.query, min(self.credit, self.batch_size))
+        ]
+        if len(batch) < min(self.credit, self.batch_size):
             self.query = self.db.get_build_queue()
+            self.query_timestamp = now
+            self.next_feed = now + timedelta(seconds=1)
+        elif not batch:
+            self.next_feed = now + timedelta(seconds=1)
+        self.builds_queue.send_pyobj(['QUEUE', batch])
+        self.credit = None
+        self.fed_count += len(batch)
+
+    def handle_credit(self, queue):
+        """
+        Handle the reply from :class:`~.slave_driver.SlaveDriver` to a batch
+        of builds. This simply states how many further rows it is willing to
+        accept.
+        """
+        msg, *args = queue.recv_pyobj()
+        if msg == 'CREDIT':
+            self.credit = args[0]
+        else:
+            self.logger.error('invalid credit message: %s', msg)
+            self.credit = 0
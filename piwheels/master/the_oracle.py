@@ -98,7 +98,9 @@ class TheOracle(Task):
                 'LOGBUILD': self.do_logbuild,
                 'DELBUILD': self.do_delbuild,
                 'PKGFILES': self.do_pkgfiles,
+                'PKGSFILES': self.do_pkgsfiles,
                 'VERFILES': self.do_verfiles,
+                'HASHFILES': self.do_hashfiles,
                 'PKGEXISTS': self.do_pkgexists,
                 'GETABIS': self.do_getabis,
                 'GETPYPI': self.do_getpypi,
@@ -189,6 +191,13 @@ class TheOracle(Task):
         files = self.db.get_package_files(package)
         return list(files)
 
+    def do_pkgsfiles(self, packages):
+        """
+        Handler for "PKGSFILES" message, sent by :class:`DbClient` to request
+        details of all wheels associated with each of *packages* at once.
+        """
+        return self.db.get_packages_files(packages)
+
     def do_verfiles(self, package, version):
         """
         Handler for "VERFILES" message, sent by :class:`DbClient` to request
@@ -197,6 +206,14 @@ class TheOracle(Task):
         files = self.db.get_version_files(package, version)
         return set(files)
 
+    def do_hashfiles(self, filehash):
+        """
+        Handler for "HASHFILES" message, sent by :class:`DbClient` to request
+        the package and filename of all wheels with the content hash
+        *filehash*.
+        """
+        return self.db.get_files_with_hash(filehash)
+
     def do_pkgexists(self, package, version):
         """
         Handler for "PKGEXISTS" message, sent by :class:`DbClient` to request
@@ -335,12 +352,24 @@ class DbClient:
         """
         return self._execute(['PKGFILES', package])
 
+    def get_packages_files(self, packages):
+        """
+        See :meth:`.db.Database.get_packages_files`.
+        """
+        return self._execute(['PKGSFILES', packages])
+
     def get_version_files(self, package, version):
         """
         See :meth:`.db.Database.get_version_files`.
         """
         return self._execute(['VERFILES', package, version])
 
+    def get_files_with_hash(self, filehash):
+        """
+        See :meth:`.db.Database.get_files_with_hash`.
+        """
+        return self._execute(['HASHFILES', filehash])
+
     def get_build_abis(self):
         """
         See :meth:`.db.Database.get_build_abis`.
@@ -70,6 +70,7 @@ class PiWheelsMonitor:
         self.builds_label = None
         self.build_rate_label = None
         self.build_size_label = None
+        self.transfer_label = None
         self.build_time_label = None
         self.list_header = None
 
@@ -139,6 +140,7 @@ class PiWheelsMonitor:
         self.build_rate_label = widgets.Text('- pkgs/hour')
         self.build_time_label = widgets.Text('-:--:--')
         self.build_size_label = widgets.Text('- bytes')
+        self.transfer_label = widgets.Text('- Mbytes/s')
         self.list_header = widgets.AttrMap(
             widgets.Columns([
                 (2, widgets.Text('S')),
@@ -162,6 +164,7 @@ class PiWheelsMonitor:
                         widgets.Text('Build Rate'),
                         widgets.Text('Build Time'),
                         widgets.Text('Build Size'),
+                        widgets.Text('Transfers'),
                     ])),
                     widgets.Pile([
                         self.disk_bar,
@@ -169,6 +172,7 @@ class PiWheelsMonitor:
                         self.build_rate_label,
                         self.build_time_label,
                         self.build_size_label,
+                        self.transfer_label,
                     ]),
                 ]),
                 widgets.AttrMap(
@@ -283,7 +287,9 @@ class PiWheelsMonitor:
         self.disk_bar.set_completion(
             status_info['disk_free'] * 100 / status_info['disk_size'])
         self.builds_label.set_text(
-            '{} pkg(s)'.format(status_info['builds_pending']))
+            '{} pkg(s) ({:.0f} fed/s)'.format(
+                status_info['builds_pending'],
+                status_info.get('builds_feed_rate', 0)))
         self.build_rate_label.set_text(
             '{} pkgs/hour'.format(status_info['builds_last_hour']))
         self.build_size_label.set_text(
@@ -291,6 +297,13 @@ class PiWheelsMonitor:
         time = status_info['builds_time']
         time -= timedelta(microseconds=time.microseconds)
         self.build_time_label.set_text('{}'.format(time))
+        self.transfer_label.set_text(
+            '{:.1f} Mbytes/s ({:.0f}ms rtt, {} Mbytes deduped, '
+            '{} Mbytes compressed)'.format(
+                status_info.get('transfer_rate', 0) / 1048576,
+                status_info.get('transfer_rtt', 0) * 1000,
+                status_info.get('transfer_saved', 0) // 1048576,
+                status_info.get('transfer_compressed', 0) // 1048576))
 
     def quit(self, widget=None):
         """
@@ -504,6 +517,8 @@ class SlaveState:
         self.last_seen = None
         self.status = ''
         self.label = ''
+        self.slot = 0
+        self.slots = 1
 
     def update(self, timestamp, msg, *args):
         """
@@ -528,7 +543,9 @@ class SlaveState:
                 self.py_version,
                 self.abi,
                 self.platform,
-                self.label
+                self.label,
+                self.slot,
+                self.slots
             ) = args
         elif msg == 'SLEEP':
             self.status = 'Waiting for jobs'
@@ -567,7 +584,8 @@ class SlaveState:
         return [
             (self.state, '*'),
             ('status', str(self.slave_id)),
-            ('status', self.label),
+            ('status', self.label if self.slots == 1 else
+             '{}:{}'.format(self.label, self.slot)),
             ('status', since(self.first_seen)),
             ('status', since(self.last_seen)),
             ('status', self.abi),
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+# The piwheels project
+#   Copyright (c) 2017 Ben Nuttall <https://github.com/bennuttall>
+#   Copyright (c) 2017 Dave Jones <dave@waveform.org.uk>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+
+"""
+Contains the functions that implement the :program:`piw-rebuild` script.
+
+.. autofunction:: main
+
+.. autofunction:: do_rebuild
+
+.. autofunction:: rebuild_package
+"""
+
+import os
+import sys
+import logging
+from time import monotonic
+from pathlib import Path
+from itertools import groupby
+from operator import attrgetter
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .. import __version__, terminal, const
+from ..master.db import Database
+from ..master.index_scribe import (
+    write_file,
+    write_package,
+    package_written,
+    render_root_index,
+    render_root_json,
+    render_package_index,
+    render_package_json,
+)
+
+
+FileRow = namedtuple('FileRow', ('filename', 'filehash', 'filesize'))
+
+
+def main(args=None):
+    """
+    This is the main function for the :program:`piw-rebuild` script. It
+    re-writes the simple indexes of every package (and the root index) from
+    the database, spreading the work over several processes.
+    """
+    logging.getLogger().name = 'rebuild'
+    parser = terminal.configure_parser("""\
+The piw-rebuild script is used to re-write the simple indexes (HTML and JSON)
+of every package from the piwheels database, e.g. after a template change or
+the loss of the output directory. Indexes which are unchanged are left alone
+unless --force is given. This script must be run on the same node as the
+piw-master script, and should ideally be run while the master is stopped or
+paused.
+""")
+    parser.add_argument(
+        '-d', '--dsn', default=const.DSN,
+        help="The database to read package files from (default: "
+        "%(default)s)")
+    parser.add_argument(
+        '-o', '--output-path', metavar='PATH', default=const.OUTPUT_PATH,
+        help="The path under which the website has been written; must be "
+        "writable by the current user (default: %(default)s)")
+    parser.add_argument(
+        '--gzip-output', action='store_true',
+        help="Write a gzip-compressed copy of each index alongside it (with "
+        "a .gz suffix); this should match the setting of piw-master")
+    parser.add_argument(
+        '-j', '--jobs', metavar='NUM', type=int, default=os.cpu_count() or 1,
+        help="The number of processes to write indexes with (default: "
+        "%(default)s)")
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help="Re-write indexes even if their content is unchanged")
+    try:
+        config = parser.parse_args(args)
+        config.output_path = os.path.expanduser(config.output_path)
+        terminal.configure_logging(config.log_level, config.log_file)
+
+        logging.info("PiWheels Index Rebuilder version %s", __version__)
+        do_rebuild(config)
+    except RuntimeError as err:
+        logging.error(err)
+        return 1
+    except:  # pylint: disable=bare-except
+        return terminal.error_handler(*sys.exc_info())
+    else:
+        return 0
+
+
+def do_rebuild(config, report_interval=5):
+    """
+    Streams the files of all packages from the database (in a single ordered
+    query), and farms out the (re)writing of each package's indexes to a pool
+    of processes running :func:`rebuild_package`. Progress is reported every
+    *report_interval* seconds. Finally, the root index is re-written.
+
+    :param config:
+        The configuration obtained from parsing the command line.
+    """
+    output_path = Path(config.output_path)
+    if not (output_path / 'simple').is_dir():
+        raise RuntimeError('%s is not a piwheels output path' % output_path)
+    db = Database(config.dsn)
+    try:
+        written = skipped = 0
+        start = reported = monotonic()
+
+        def tally(futures):
+            nonlocal written, skipped
+            for future in futures:
+                if future.result():
+                    written += 1
+                else:
+                    skipped += 1
+
+        with ProcessPoolExecutor(max_workers=config.jobs) as executor:
+            # Limit the number of packages queued for the workers so that
+            # memory use doesn't depend on the number of packages
+            pending = set()
+            for package, rows in groupby(db.get_all_package_files(),
+                                         key=attrgetter('package')):
+                files = [
+                    FileRow(row.filename, row.filehash, row.filesize)
+                    for row in rows
+                ]
+                pending.add(executor.submit(
+                    rebuild_package, output_path, package, files,
+                    config.gzip_output, config.force))
+                if len(pending) >= config.jobs * 10:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    tally(done)
+                now = monotonic()
+                if now - reported >= report_interval:
+                    reported = now
+                    logging.info(
+                        '%d indexes written, %d unchanged (%.1f pages/s)',
+                        written, skipped, (written + skipped) / (now - start))
+            done, pending = wait(pending)
+            tally(done)
+        logging.info('writing root index')
+        packages = sorted(db.get_all_packages())
+        write_file(output_path / 'simple' / 'index.json',
+                   render_root_json(packages), gzip_output=config.gzip_output)
+        write_file(output_path / 'simple' / 'index.html',
+                   render_root_index(packages), gzip_output=config.gzip_output)
+        duration = monotonic() - start
+        logging.info(
+            'Rebuilt indexes: %d written, %d unchanged in %.1fs '
+            '(%.1f pages/s)', written, skipped, duration,
+            (written + skipped) / duration)
+    finally:
+        db.close()
+
+
+def rebuild_package(output_path, package, files, gzip_output=False,
+                    force=False):
+    """
+    Re-write the indexes of *package* under *output_path* from *files* (a list
+    of :class:`FileRow` tuples). Unless *force* is :data:`True`, the indexes
+    are left alone if the content of both the HTML and JSON indexes is
+    unchanged and all the index files (including the compressed copies when
+    *gzip_output* is :data:`True`) exist. Returns :data:`True` if the indexes
+    were written.
+    """
+    pkg_dir = output_path / 'simple' / package
+    page = ''.join(render_package_index(package, files))
+    json_page = ''.join(render_package_json(package, files))
+    if not force and package_written(pkg_dir, gzip_output):
+        try:
+            with (pkg_dir / 'index.html').open('rb') as f:
+                html_same = f.read() == page.encode('utf-8')
+            with (pkg_dir / 'index.json').open('rb') as f:
+                json_same = f.read() == json_page.encode('utf-8')
+            if html_same and json_same:
+                return False
+        except FileNotFoundError:
+            pass
+    write_package(output_path, package, files, page, json_page, gzip_output)
+    return True
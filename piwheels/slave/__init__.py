@@ -42,16 +42,16 @@ import os
 import sys
 import logging
 import socket
+import threading
 from datetime import datetime
 from time import time, sleep
-from random import randint
 
 import zmq
 import dateutil.parser
 from wheel import pep425tags
 
-from .. import __version__, terminal, systemd
-from .builder import PiWheelsBuilder
+from .. import __version__, terminal, systemd, const
+from .builder import PiWheelsBuilder, transfer
 
 
 class MasterTimeout(IOError):
@@ -68,6 +68,11 @@ class PiWheelsSlave:
     source packages directly from `PyPI`_, attempts to build a wheel in a
     sandbox directory and, if successful, transmits the results to the master.
 
+    If configured with several build slots, one instance of the class is
+    created for each slot and run in a separate thread; each slot introduces
+    itself to the master independently and runs its own builds in its own
+    sandbox.
+
     .. _PyPI: https://pypi.python.org/
     """
     def __init__(self):
@@ -76,7 +81,11 @@ class PiWheelsSlave:
         self.config = None
         self.slave_id = None
         self.builder = None
+        self.sending = False
         self.pypi_url = None
+        self.slot = 0
+        self.stopping = threading.Event()
+        self.failed = False
 
     def __call__(self, args=None):
         sys.excepthook = terminal.error_handler
@@ -97,6 +106,15 @@ terminated, either by Ctrl+C, SIGTERM, or by the remote piw-master script.
             default='3h', type=duration,
             help="The time to wait before assuming a build has failed; "
             "(default: %(default)s)")
+        parser.add_argument(
+            '-s', '--slots', env_var='PIW_SLOTS', metavar='NUM',
+            default=1, type=int,
+            help="The number of builds to run concurrently; "
+            "(default: %(default)s)")
+        parser.add_argument(
+            '-z', '--compress', env_var='PIW_COMPRESS', action='store_true',
+            help="Compress file transfers to the master where possible; "
+            "useful for slaves with limited bandwidth to the master")
         self.config = parser.parse_args(args)
         terminal.configure_logging(self.config.log_level,
                                    self.config.log_file)
@@ -105,6 +123,25 @@ terminated, either by Ctrl+C, SIGTERM, or by the remote piw-master script.
         if os.geteuid() == 0:
             self.logger.error('Slave must not be run as root')
             return 1
+        if self.config.slots < 1:
+            self.logger.error('Slave must have at least one build slot')
+            return 1
+        ctx = zmq.Context.instance()
+        try:
+            if self.config.slots == 1:
+                self.run()
+            else:
+                return self.run_slots()
+        finally:
+            systemd.stopping()
+            ctx.destroy(linger=1000)
+            ctx.term()
+
+    def run(self):
+        """
+        Connect to the master and run the slave protocol for this instance's
+        build slot, re-connecting whenever the master times out.
+        """
         ctx = zmq.Context.instance()
         queue = None
         try:
@@ -112,6 +149,8 @@ terminated, either by Ctrl+C, SIGTERM, or by the remote piw-master script.
                 queue = ctx.socket(zmq.REQ)
                 queue.hwm = 10
                 queue.ipv6 = True
+                # Permit a final "BYE" while a reply is outstanding
+                queue.req_relaxed = True
                 queue.connect('tcp://{master}:5555'.format(
                     master=self.config.master))
                 systemd.ready()
@@ -122,10 +161,69 @@ terminated, either by Ctrl+C, SIGTERM, or by the remote piw-master script.
                     self.logger.warning('Resetting connection')
                     queue.close(linger=1000)
         finally:
-            systemd.stopping()
-            queue.send_pyobj(['BYE'])
-            ctx.destroy(linger=1000)
-            ctx.term()
+            if queue is not None:
+                queue.send_pyobj(['BYE'])
+                queue.close(linger=1000)
+
+    def run_slots(self):
+        """
+        Run each of the configured build slots in a separate thread (see
+        :meth:`run_slot`). If any slot fails, or this thread is interrupted,
+        all slots are told to terminate, and any builds in progress are
+        stopped. Returns when all slots have terminated.
+        """
+        slaves = []
+        for slot in range(self.config.slots):
+            slave = PiWheelsSlave()
+            slave.config = self.config
+            slave.label = self.label
+            slave.slot = slot
+            slave.stopping = self.stopping
+            slaves.append(slave)
+        threads = [
+            threading.Thread(target=slave.run_slot, daemon=True,
+                             name='slot-%d' % slave.slot)
+            for slave in slaves
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while not self.stopping.is_set() and any(
+                    thread.is_alive() for thread in threads):
+                self.stopping.wait(1)
+        finally:
+            self.stopping.set()
+            # Slots in the midst of a build won't notice they've been told to
+            # stop until it finishes, so terminate their builds. The threads
+            # must have exited before the caller destroys the context, as
+            # their sockets can't be closed from this thread. A slot may start
+            # a build just after being told to stop, hence the repetition
+            for thread in threads:
+                while thread.is_alive():
+                    for slave in slaves:
+                        builder = slave.builder
+                        if builder is not None:
+                            builder.stop()
+                    thread.join(1)
+        return int(any(slave.failed for slave in slaves))
+
+    def run_slot(self):
+        """
+        The entry point for build slot threads. Calls :meth:`run` and, if it
+        fails, tells all other slots to terminate. Any build left behind is
+        cleaned up.
+        """
+        try:
+            self.run()
+        except SystemExit:
+            pass
+        except Exception:
+            self.failed = True
+            self.stopping.set()
+            raise
+        finally:
+            if self.builder is not None:
+                self.builder.clean()
 
     # A general note about the design of the slave: the build slave is
     # deliberately designed to be "brittle". In other words to fall over and
@@ -146,29 +244,47 @@ terminated, either by Ctrl+C, SIGTERM, or by the remote piw-master script.
         from the master and raises :exc:`MasterTimeout` if *timeout* seconds
         are exceeded.
         """
-        request = ['HELLO', self.config.timeout,
+        request = ['HELLO', const.SLAVE_PROTOCOL, self.config.timeout,
                    pep425tags.get_impl_ver(),
                    pep425tags.get_abi_tag(),
                    pep425tags.get_platform(),
-                   self.label]
+                   self.label, self.slot, self.config.slots]
         while True:
+            # Don't report the outcome of a build that was stopped
+            if self.stopping.is_set():
+                raise SystemExit(0)
             queue.send_pyobj(request)
             start = time()
             while True:
                 systemd.watchdog_ping()
-                if queue.poll(60000):
+                if self.stopping.is_set():
+                    raise SystemExit(0)
+                if queue.poll(1000):
                     reply, *args = queue.recv_pyobj()
                     request = self.handle_reply(reply, *args)
                     break
                 elif time() - start > timeout:
                     self.logger.warning('Timed out waiting for master')
-                    if self.builder:
-                        self.logger.warning('Discarding current build')
-                        self.builder.clean()
-                        self.builder = None
-                    self.slave_id = None
+                    self.reset()
                     raise MasterTimeout()
 
+    def reset(self):
+        """
+        Called when the master has disappeared to reset the slave's ID. If the
+        current build succeeded and its files were being transferred, it is
+        retained so that the transfers can be resumed when the master returns
+        (see :meth:`do_hello`); otherwise it is discarded.
+        """
+        if self.builder:
+            if self.builder.status and self.sending:
+                self.logger.warning('Retaining current build for resumption')
+            else:
+                self.logger.warning('Discarding current build')
+                self.builder.clean()
+                self.builder = None
+        self.sending = False
+        self.slave_id = None
+
     def handle_reply(self, reply, *args):
         """
         Dispatch a message from the master to an appropriate handler method.
@@ -195,24 +311,33 @@ terminated, either by Ctrl+C, SIGTERM, or by the remote piw-master script.
         the identifier in all future log messages for the ease of the
         administrator.
 
-        We reply with "IDLE" to indicate we're ready to accept a build job.
+        We reply with "IDLE" to indicate we're ready to accept a build job or,
+        if we retained a build whose files were being transferred when we lost
+        contact with the master (see :meth:`reset`), with "RESUME" and the full
+        report of that build so the master can request the files again.
         """
         assert self.slave_id is None, 'Duplicate hello'
         self.slave_id = int(new_id)
         self.pypi_url = pypi_url
         self.logger = logging.getLogger('slave-%d' % self.slave_id)
         self.logger.info('Connected to master')
+        if self.builder:
+            self.logger.info('Resuming transfer of build %s %s',
+                             self.builder.package, self.builder.version)
+            return ['RESUME'] + self.builder.as_message
         return ['IDLE']
 
-    def do_sleep(self):
+    def do_sleep(self, delay):
         """
-        If, in response to an "IDLE" message we receive "SLEEP" this indicates
-        the master has nothing for us to do currently. Sleep for a little while
-        then try "IDLE" again.
+        If, in response to an "IDLE" message we receive "SLEEP" *delay* this
+        indicates the master has nothing for us to do currently. Sleep for
+        *delay* seconds then try "IDLE" again. Note that the master may hold
+        our "IDLE" request for a while before replying, in case a job turns up
+        in the meantime, so *delay* is typically small.
         """
         assert self.slave_id is not None, 'Sleep before hello'
-        self.logger.info('No available jobs; sleeping')
-        sleep(randint(5, 15))
+        self.logger.info('No available jobs; sleeping for %ds', delay)
+        sleep(delay)
         return ['IDLE']
 
     def do_build(self, package, version):
@@ -232,29 +357,44 @@ terminated, either by Ctrl+C, SIGTERM, or by the remote piw-master script.
             self.logger.warning('Build failed')
         return ['BUILT'] + self.builder.as_message[2:]
 
-    def do_send(self, filename):
+    def do_send(self, *filenames):
         """
         If a build succeeds and generates files (detailed in a "BUILT"
-        message), the master will reply with "SEND" *filename* indicating we
-        should transfer the specified file (this is done on a separate socket
-        with a different protocol; see :meth:`builder.PiWheelsPackage.transfer`
-        for more details). Once the transfers concludes, reply to the master
-        with "SENT".
+        message), the master will reply with "SEND" *filenames* indicating we
+        should transfer the specified files (this is done on separate sockets,
+        one per file, with a different protocol; see :func:`builder.transfer`
+        for more details). The files are transferred concurrently. Once the
+        transfers conclude, reply to the master with "SENT". If the master
+        stops responding during the transfers, :exc:`MasterTimeout` is raised
+        (the build is retained; see :meth:`reset`).
         """
         assert self.slave_id is not None, 'Send before hello'
         assert self.builder, 'Send before build / after failed build'
         assert self.builder.status, 'Send after failed build'
-        pkg = [f for f in self.builder.files if f.filename == filename][0]
-        self.logger.info('Sending %s to master on localhost', pkg.filename)
+        self.sending = True
+        pkgs = [f for f in self.builder.files if f.filename in filenames]
+        assert len(pkgs) == len(filenames), 'Send of unknown file'
+        self.logger.info('Sending %s to master',
+                         ', '.join(pkg.filename for pkg in pkgs))
         ctx = zmq.Context.instance()
-        queue = ctx.socket(zmq.DEALER)
-        queue.ipv6 = True
-        queue.hwm = 10
-        queue.connect('tcp://{master}:5556'.format(master=self.config.master))
+        queues = []
         try:
-            pkg.transfer(queue, self.slave_id)
+            for pkg in pkgs:
+                queue = ctx.socket(zmq.DEALER)
+                queue.ipv6 = True
+                queue.hwm = 10
+                queue.connect(
+                    'tcp://{master}:5556'.format(master=self.config.master))
+                queues.append(queue)
+            transfer(list(zip(queues, pkgs)), self.slave_id,
+                     compress=self.config.compress)
+        except IOError:
+            self.logger.warning('Timed out transferring to master')
+            self.reset()
+            raise MasterTimeout()
         finally:
-            queue.close()
+            for queue in queues:
+                queue.close()
         return ['SENT']
 
     def do_done(self):
@@ -268,6 +408,7 @@ terminated, either by Ctrl+C, SIGTERM, or by the remote piw-master script.
         self.logger.info('Removing temporary build directories')
         self.builder.clean()
         self.builder = None
+        self.sending = False
         return ['IDLE']
 
     def do_bye(self):
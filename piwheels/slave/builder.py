@@ -34,18 +34,26 @@ Defines the classes which use ``pip`` to build wheels.
 
 .. autoclass:: PiWheelsBuilder
     :members:
+
+.. autofunction:: transfer
 """
 
 import os
+import mmap
+import zlib
 import zipfile
 import hashlib
 import resource
 import tempfile
+import threading
 import email.parser
 from time import time
 from pathlib import Path
+from contextlib import ExitStack
 from subprocess import Popen, DEVNULL, TimeoutExpired
 
+import zmq
+
 from .. import systemd
 
 
@@ -170,33 +178,94 @@ class PiWheelsPackage:
                     self._metadata = parser.parse(metadata)
         return self._metadata
 
-    def transfer(self, queue, slave_id):
+    def transfer(self, queue, slave_id, timeout=300):
         """
         Transfer the wheel via the specified *queue*. This is the client side
         implementation of the :class:`.file_juggler.FileJuggler` protocol.
+        Raises :exc:`IOError` if nothing is heard from the master for
+        *timeout* seconds. See :func:`transfer` for more details.
         """
-        with self.open() as f:
-            timeout = 0
-            while True:
-                if not queue.poll(timeout):
-                    # Initially, send HELLO immediately; in subsequent loops if
-                    # we hear nothing from the server for 5 seconds then it's
-                    # dropped a *lot* of packets; prod the master with HELLO
-                    queue.send_multipart(
-                        [b'HELLO', str(slave_id).encode('ascii')]
-                    )
-                    timeout = 5000
+        transfer([(queue, self)], slave_id, timeout)
+
+
+def transfer(transfers, slave_id, timeout=300, compress=False):
+    """
+    Transfer several wheels concurrently. *transfers* is a sequence of
+    (*queue*, *package*) tuples where each *queue* is a separate DEALER socket
+    connected to the master's :class:`.file_juggler.FileJuggler` and *package*
+    is the :class:`PiWheelsPackage` to send over it. Each transfer is tagged
+    with the package's filename in its initial "HELLO".
+
+    The wheels are memory-mapped and chunks are sent as slices of the maps so
+    that no copies of the data are made prior to transmission. Raises
+    :exc:`IOError` if nothing is heard about a transfer from the master for
+    *timeout* seconds.
+
+    If *compress* is ``True``, zlib compression is offered to the master. If
+    the master accepts (by including the codec in its "FETCH" requests), each
+    chunk is compressed, and sent compressed if that saves any bytes.
+    """
+    with ExitStack() as stack:
+        poller = zmq.Poller()
+        views = {}
+        for queue, package in transfers:
+            f = stack.enter_context(package.open())
+            try:
+                # The map is deliberately not closed explicitly; 0MQ may still
+                # hold references to slices of it (from redundant FETCH
+                # requests) after the transfer completes
+                view = memoryview(mmap.mmap(f.fileno(), 0,
+                                            access=mmap.ACCESS_READ))
+            except ValueError:
+                # Empty files can't be mapped
+                view = memoryview(b'')
+            views[queue] = (package, view)
+            poller.register(queue, zmq.POLLIN)
+
+        def hello(queue, package):
+            queue.send_multipart([
+                b'HELLO', str(slave_id).encode('ascii'),
+                package.filename.encode('utf-8')
+            ] + ([b'zlib'] if compress else []))
+            prodded[queue] = time()
+
+        heard = {queue: time() for queue in views}
+        prodded = {}
+        for queue, (package, view) in views.items():
+            hello(queue, package)
+        while views:
+            now = time()
+            for queue, (package, view) in views.items():
+                # If we hear nothing from the server about a transfer for 5
+                # seconds then it's dropped a *lot* of packets; prod the master
+                # with HELLO
+                if now - max(heard[queue], prodded[queue]) > 5:
+                    if now - heard[queue] > timeout:
+                        raise IOError('timed out transferring %s' %
+                                      package.filename)
+                    hello(queue, package)
                     # Transfers are generally very fast but if we wind up
                     # having to restart there's a possibility we'll miss the
-                    # watchdog timer, so ping it each time the poll fails
+                    # watchdog timer, so ping it each time we prod the master
                     systemd.watchdog_ping()
+            for queue, _ in poller.poll(1000):
                 req, *args = queue.recv_multipart()
+                heard[queue] = time()
                 if req == b'DONE':
-                    return
+                    poller.unregister(queue)
+                    del views[queue]
                 elif req == b'FETCH':
-                    offset, size = args
-                    f.seek(int(offset))
-                    queue.send_multipart([b'CHUNK', offset, f.read(int(size))])
+                    offset, size, *codec = args
+                    start = int(offset)
+                    package, view = views[queue]
+                    data = view[start:start + int(size)]
+                    if compress and codec == [b'zlib']:
+                        compressed = zlib.compress(data, 1)
+                        if len(compressed) < len(data):
+                            queue.send_multipart(
+                                [b'CHUNK', offset, compressed, b'zlib'])
+                            continue
+                    queue.send_multipart([b'CHUNK', offset, data], copy=False)
 
 
 class PiWheelsBuilder:
@@ -217,6 +286,8 @@ class PiWheelsBuilder:
         self.output = ''
         self.files = []
         self.status = False
+        self._proc = None
+        self._stopped = threading.Event()
 
     @property
     def as_message(self):
@@ -290,16 +361,19 @@ class PiWheelsBuilder:
                     stderr=DEVNULL,
                     env=env
                 )
-                # If the build times out attempt to kill it with SIGTERM; if
-                # that hasn't worked after 10 seconds, resort to SIGKILL.
-                # Builds frequently exceed the watchdog timeout (2 minutes) so
-                # ping every 60 seconds
+                self._proc = proc
+                if self._stopped.is_set():
+                    proc.terminate()
+                # If the build times out (or is stopped) attempt to kill it
+                # with SIGTERM; if that hasn't worked after 10 seconds, resort
+                # to SIGKILL. Builds frequently exceed the watchdog timeout (2
+                # minutes) so ping every 60 seconds
                 while True:
                     systemd.watchdog_ping()
                     try:
                         proc.wait(60)
                     except TimeoutExpired:
-                        if time() - start > timeout:
+                        if self._stopped.is_set() or time() - start > timeout:
                             proc.terminate()
                             try:
                                 proc.wait(10)
@@ -312,6 +386,8 @@ class PiWheelsBuilder:
                 error = exc
             else:
                 error = None
+            finally:
+                self._proc = None
             self.duration = time() - start
             self.status = proc.returncode == 0
             if error is not None:
@@ -325,6 +401,17 @@ class PiWheelsBuilder:
                     self.files.append(PiWheelsPackage(path))
             return self.status
 
+    def stop(self):
+        """
+        Terminate the build in progress (if any). This may be called from
+        another thread; the build fails as if it had timed out, and
+        :meth:`build` returns once the ``pip`` process has exited.
+        """
+        self._stopped.set()
+        proc = self._proc
+        if proc is not None:
+            proc.terminate()
+
     def clean(self):
         """
         Remove the temporary build directory and all its contents.
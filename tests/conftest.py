@@ -250,7 +250,9 @@ def master_config(request, tmpdir):
         db=PIWHEELS_TESTDB
     )
     config.output_path = str(tmpdir)
+    config.gzip_output = False
     config.index_queue = 'inproc://tests-indexes'
+    config.index_delay = 0.0
     config.status_queue = 'inproc://tests-status'
     config.control_queue = 'inproc://tests-control'
     config.builds_queue = 'inproc://tests-builds'
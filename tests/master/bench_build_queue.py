@@ -0,0 +1,245 @@
+# The piwheels project
+#   Copyright (c) 2017 Ben Nuttall <https://github.com/bennuttall>
+#   Copyright (c) 2017 Dave Jones <dave@waveform.org.uk>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compares reading the master's build queue from the ``build_queue`` table (as
+:meth:`~piwheels.master.db.Database.get_build_queue` does) against the old
+scan of the ``builds_pending`` view, on a synthetic database. It reports the
+time to the first row and to the whole result for each, the query plans, the
+cost the ``build_queue`` triggers add to logging builds, and the time taken to
+re-score the whole queue. This isn't part
+of the test suite; run it directly against the *test* database (which it
+wipes, just like the test suite does)::
+
+    $ python tests/master/bench_build_queue.py
+"""
+
+import os
+from time import perf_counter
+from datetime import timedelta
+
+from sqlalchemy import create_engine
+
+from piwheels.initdb import get_script, parse_statements
+
+
+# The same environment variables as the test suite (see tests/conftest.py)
+PIWHEELS_TESTDB = os.environ.get('PIWHEELS_TESTDB', 'piwheels_test')
+PIWHEELS_USER = os.environ.get('PIWHEELS_USER', 'piwheels')
+PIWHEELS_SUPERUSER = os.environ.get('PIWHEELS_SUPERUSER', 'postgres')
+PIWHEELS_SUPERPASS = os.environ.get('PIWHEELS_SUPERPASS', '')
+
+OLD_QUERY = "SELECT * FROM builds_pending"
+NEW_QUERY = "SELECT * FROM build_queue ORDER BY priority DESC"
+
+
+def create_schema(conn):
+    with conn.begin():
+        conn.execute("DROP SCHEMA public CASCADE")
+        conn.execute("CREATE SCHEMA public AUTHORIZATION postgres")
+        conn.execute("GRANT CREATE ON SCHEMA public TO PUBLIC")
+        conn.execute("GRANT USAGE ON SCHEMA public TO PUBLIC")
+        for stmt in parse_statements(get_script()):
+            conn.execute(stmt.format(username=PIWHEELS_USER))
+
+
+def populate(conn, packages, versions):
+    # Roughly the shape of the production database: most versions have been
+    # tried, most of those produced a file, and most files are pure-Python.
+    # The triggers are disabled while loading; build_queue is filled in one
+    # go at the end instead
+    with conn.begin():
+        for table in ('versions', 'builds', 'files'):
+            conn.execute("ALTER TABLE %s DISABLE TRIGGER USER" % table)
+        conn.execute("INSERT INTO build_abis VALUES ('cp34m'), ('cp35m')")
+        conn.execute(
+            "INSERT INTO packages(package) "
+            "SELECT 'pkg-' || p FROM generate_series(1, %s) AS p", packages)
+        conn.execute(
+            "INSERT INTO versions(package, version) "
+            "SELECT 'pkg-' || p, v || '.0' "
+            "FROM generate_series(1, %s) AS p, generate_series(1, %s) AS v",
+            packages, versions)
+        conn.execute(
+            "INSERT INTO builds"
+            "(package, version, built_by, duration, status, abi_tag) "
+            "SELECT package, version, 1, "
+            "INTERVAL '1 second' * (10 + random() * 600), random() < 0.9, "
+            "'cp34m' "
+            "FROM versions WHERE random() < 0.8")
+        conn.execute(
+            "INSERT INTO files"
+            "(filename, build_id, filesize, filehash, package_tag, "
+            "package_version_tag, py_version_tag, abi_tag, platform_tag) "
+            "SELECT package || '-' || version || '-' || build_id || '.whl', "
+            "build_id, 123456, repeat('0', 64), package, version, 'cp34', "
+            "CASE WHEN random() < 0.7 THEN 'none' ELSE 'cp34m' END, "
+            "'linux_armv7l' "
+            "FROM builds WHERE status")
+        # Downloads are heavily skewed towards a few popular packages: each
+        # file of pkg-N is downloaded 20000/N times over the last two months
+        conn.execute(
+            "INSERT INTO downloads(filename, accessed_by, accessed_at) "
+            "SELECT f.filename, '192.168.0.1', "
+            "CURRENT_TIMESTAMP - INTERVAL '60 days' * random() "
+            "FROM files AS f JOIN builds AS b ON b.build_id = f.build_id, "
+            "generate_series(1, 20000 / "
+            "CAST(SUBSTRING(b.package FROM 5) AS INTEGER))")
+        for table in ('versions', 'builds', 'files'):
+            conn.execute("ALTER TABLE %s ENABLE TRIGGER USER" % table)
+        conn.execute("SELECT build_queue_rebuild()")
+
+
+def vacuum(engine):
+    # VACUUM can't run inside a transaction, so this uses a separate
+    # connection in autocommit mode
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(
+            "VACUUM ANALYZE")
+
+
+def bench_read(conn, label, query):
+    with conn.begin():
+        start = perf_counter()
+        result = conn.execution_options(stream_results=True).execute(query)
+        result.fetchone()
+        first = perf_counter() - start
+        count = 1 + sum(1 for row in result)
+        total = perf_counter() - start
+    print('{label}: {count} rows in {total:.3f}s, first row after '
+          '{first:.4f}s'.format(
+              label=label, count=count, total=total, first=first))
+
+
+def explain(conn, label, query):
+    with conn.begin():
+        plan = [
+            row[0] for row in
+            conn.execute("EXPLAIN (ANALYZE, BUFFERS) " + query)
+        ]
+    print('{label}:'.format(label=label))
+    for line in plan:
+        print('    ' + line)
+    return plan
+
+
+def bench_triggers(conn, count, triggers=True):
+    # The master builds in priority order, so this logs builds of the most
+    # popular packages, just as it would
+    with conn.begin():
+        versions = conn.execute(
+            "SELECT package, version FROM build_queue "
+            "ORDER BY priority DESC LIMIT %s", count
+        ).fetchall()
+        if not triggers:
+            for table in ('builds', 'files'):
+                conn.execute("ALTER TABLE %s DISABLE TRIGGER USER" % table)
+    start = perf_counter()
+    for package, version in versions:
+        with conn.begin():
+            build_id = conn.execute(
+                "INSERT INTO builds"
+                "(package, version, built_by, duration, status, abi_tag) "
+                "VALUES (%s, %s, 1, %s, true, 'cp34m') "
+                "RETURNING build_id", package, version,
+                timedelta(seconds=60)).scalar()
+            conn.execute(
+                "INSERT INTO files"
+                "(filename, build_id, filesize, filehash, package_tag, "
+                "package_version_tag, py_version_tag, abi_tag, platform_tag) "
+                "VALUES (%s, %s, 123456, repeat('0', 64), %s, %s, 'cp34', "
+                "'cp34m', 'linux_armv7l')",
+                '{}-{}-{}.whl'.format(package, version, build_id), build_id,
+                package, version)
+    total = perf_counter() - start
+    if not triggers:
+        with conn.begin():
+            for table in ('builds', 'files'):
+                conn.execute("ALTER TABLE %s ENABLE TRIGGER USER" % table)
+            conn.execute("SELECT build_queue_rebuild()")
+    print('{count} builds and files logged {triggers} the triggers: '
+          '{total:.3f}s ({each:.2f}ms each)'.format(
+              count=len(versions), total=total,
+              triggers='with' if triggers else 'without',
+              each=total * 1000 / len(versions)))
+
+
+def bench_reprioritize(conn):
+    with conn.begin():
+        start = perf_counter()
+        conn.execute("SELECT build_queue_reprioritize()")
+        total = perf_counter() - start
+    print('build_queue_reprioritize(): {total:.3f}s'.format(total=total))
+
+
+def check_equivalent(conn):
+    with conn.begin():
+        diff = conn.execute(
+            "SELECT COUNT(*) FROM ("
+            "(SELECT package, version, abi_tag FROM builds_pending "
+            "EXCEPT SELECT package, version, abi_tag FROM build_queue) "
+            "UNION ALL "
+            "(SELECT package, version, abi_tag FROM build_queue "
+            "EXCEPT SELECT package, version, abi_tag FROM builds_pending)"
+            ") AS t").scalar()
+    assert diff == 0, 'build_queue differs from builds_pending'
+
+
+def main():
+    engine = create_engine('postgres://{username}:{password}@/{db}'.format(
+        username=PIWHEELS_SUPERUSER,
+        password=PIWHEELS_SUPERPASS,
+        db=PIWHEELS_TESTDB
+    ))
+    conn = engine.connect()
+    try:
+        conn.execute("SET SESSION synchronous_commit TO OFF")
+        create_schema(conn)
+        populate(conn, packages=100000, versions=10)
+        vacuum(engine)
+        check_equivalent(conn)
+        bench_read(conn, 'builds_pending view', OLD_QUERY)
+        bench_read(conn, 'build_queue table', NEW_QUERY)
+        explain(conn, 'builds_pending plan', OLD_QUERY)
+        plan = explain(conn, 'build_queue plan', NEW_QUERY)
+        # The ordered read must come straight off the index; a Sort node
+        # means the first row waits for the whole table to be read
+        assert not any('Sort' in line for line in plan), \
+            'build_queue read is sorted, not served by its index'
+        bench_triggers(conn, 1000, triggers=False)
+        bench_triggers(conn, 1000)
+        check_equivalent(conn)
+        bench_reprioritize(conn)
+    finally:
+        conn.close()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# The piwheels project
+#   Copyright (c) 2017 Ben Nuttall <https://github.com/bennuttall>
+#   Copyright (c) 2017 Dave Jones <dave@waveform.org.uk>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compares the speed of rendering simple index pages with the precompiled
+templates in :mod:`piwheels.master.index_scribe` against the equivalent
+:class:`~piwheels.master.html.TagFactory` construction, and the size and
+client parse time of the HTML pages against their JSON equivalents. It also
+measures the additional peak memory used when writing indexes of 1M packages
+in one piece versus streaming them with the render functions. This isn't part
+of the test suite; run it directly::
+
+    $ python tests/master/bench_index_scribe.py
+"""
+
+import os
+import json
+import resource
+import tempfile
+from timeit import timeit
+from html.parser import HTMLParser
+
+from piwheels.master.index_scribe import (
+    render_root_index,
+    render_package_index,
+    render_root_json,
+    render_package_json,
+    render_search_index,
+)
+
+from test_index_scribe import Row, tag_root_index, tag_package_index
+
+
+class LinkParser(HTMLParser):
+    # Roughly what pip does with a simple index page
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.links.append(dict(attrs))
+
+
+def parse_html(page):
+    parser = LinkParser()
+    parser.feed(page)
+    parser.close()
+    return parser.links
+
+
+def bench(label, tag_func, render_func, *args, number=1):
+    assert ''.join(render_func(*args)) == tag_func(*args)
+    tag_time = timeit(lambda: tag_func(*args), number=number) / number
+    render_time = timeit(
+        lambda: ''.join(render_func(*args)), number=number) / number
+    print('{label}: TagFactory {tag:.4f}s, template {render:.4f}s '
+          '({ratio:.1f}x faster)'.format(
+              label=label, tag=tag_time, render=render_time,
+              ratio=tag_time / render_time))
+
+
+def bench_formats(label, html_func, json_func, *args, number=1):
+    html_page = ''.join(html_func(*args))
+    json_page = ''.join(json_func(*args))
+    html_time = timeit(lambda: parse_html(html_page), number=number) / number
+    json_time = timeit(lambda: json.loads(json_page), number=number) / number
+    print('{label}: HTML {html_size} bytes parsed in {html_time:.4f}s, '
+          'JSON {json_size} bytes parsed in {json_time:.4f}s'.format(
+              label=label,
+              html_size=len(html_page.encode('utf-8')), html_time=html_time,
+              json_size=len(json_page.encode('utf-8')), json_time=json_time))
+
+
+def peak_rss(func, *args):
+    # Run func in a child process (so that each measurement starts afresh) and
+    # return how much its peak RSS (in KB) grew while writing func's output
+    # to a file
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with tempfile.TemporaryFile(mode='w', encoding='utf-8') as f:
+            f.writelines(func(*args))
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_fd, str(after - before).encode('ascii'))
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as result:
+        growth = int(result.read())
+    os.waitpid(pid, 0)
+    return growth
+
+
+def bench_memory(count):
+    packages = ['package-{}'.format(i) for i in range(count)]
+    search_index = [(package, i) for i, package in enumerate(packages)]
+    for label, func, args in (
+        ('root index (TagFactory)', lambda p: [tag_root_index(p)],
+         (packages,)),
+        ('root index (streamed)', render_root_index, (packages,)),
+        ('root JSON (json.dumps)',
+         lambda p: [json.dumps({'meta': {'api-version': '1.1'},
+                                'projects': [{'name': n} for n in p]})],
+         (packages,)),
+        ('root JSON (streamed)', render_root_json, (packages,)),
+        ('search index (json.dumps)',
+         lambda s: [json.dumps(s, separators=(',', ':'))], (search_index,)),
+        ('search index (streamed)', render_search_index, (search_index,)),
+    ):
+        print('{label}, {count} packages: peak RSS grew by {growth} KB'.format(
+            label=label, count=count, growth=peak_rss(func, *args)))
+
+
+def main():
+    for count, number in ((500000, 1), (1000, 100)):
+        packages = ['package-{}'.format(i) for i in range(count)]
+        bench('root index, {} links'.format(count),
+              tag_root_index, render_root_index, packages, number=number)
+        bench_formats('root index, {} links'.format(count),
+                      render_root_index, render_root_json, packages,
+                      number=number)
+        files = [
+            Row('foo-{}-cp34-cp34m-linux_armv7l.whl'.format(i),
+                '0123456789abcdef' * 4, 123456)
+            for i in range(count)
+        ]
+        bench('package index, {} links'.format(count),
+              tag_package_index, render_package_index, 'foo', files,
+              number=number)
+        bench_formats('package index, {} links'.format(count),
+                      render_package_index, render_package_json, 'foo', files,
+                      number=number)
+    bench_memory(1000000)
+
+
+if __name__ == '__main__':
+    main()
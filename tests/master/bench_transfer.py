@@ -0,0 +1,338 @@
+# The piwheels project
+#   Copyright (c) 2017 Ben Nuttall <https://github.com/bennuttall>
+#   Copyright (c) 2017 Dave Jones <dave@waveform.org.uk>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compares the speed of tracking the outstanding ranges of a file transfer with
+:class:`~piwheels.master.ranges.RangeSet` against the list of ranges
+manipulated with the generator functions in :mod:`piwheels.master.ranges`
+that :class:`~piwheels.master.states.TransferState` used previously. It also
+compares hashing a transfer incrementally as its chunks arrive against
+re-reading the whole file once it's complete, and the throughput of whole
+transfers (between a real :class:`~piwheels.master.file_juggler.FileJuggler`
+and the slave's :func:`~piwheels.slave.builder.transfer` over the loopback
+interface) with the adaptive chunk size and window against the fixed pipeline
+of 10 requests of 64KB. This isn't part of the test suite; run it directly::
+
+    $ python tests/master/bench_transfer.py
+
+The port used for the loopback transfers (default 5556) can be changed with
+the ``PIWHEELS_BENCH_PORT`` environment variable. To see how the window copes
+with latency, add some to the loopback interface first (e.g. ``tc qdisc add
+dev lo root netem delay 10ms``).
+"""
+
+import os
+import random
+import hashlib
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from timeit import timeit
+from statistics import median
+from unittest import mock
+
+import zmq
+
+from piwheels.master.ranges import RangeSet, exclude, intersect
+from piwheels.master.states import FileState, TransferState
+from piwheels.master.file_juggler import FileJuggler
+from piwheels.slave.builder import PiWheelsPackage, transfer
+
+
+CHUNK_SIZE = 65536
+
+
+def list_next_range(ranges, offset, size):
+    # The search TransferState.fetch used to perform over a list of ranges
+    fetch_range = range(offset, offset + size)
+    while True:
+        for map_range in ranges:
+            result = intersect(map_range, fetch_range)
+            if result:
+                return result
+        try:
+            fetch_range = range(ranges[0].start, ranges[0].start + size)
+        except IndexError:
+            return None
+
+
+def receive_list(filesize, chunks):
+    ranges = [range(filesize)]
+    for chunk in chunks:
+        ranges = list(exclude(ranges, chunk))
+    return ranges
+
+
+def receive_rangeset(filesize, chunks):
+    ranges = RangeSet([range(filesize)])
+    for chunk in chunks:
+        ranges.exclude(chunk)
+    return ranges
+
+
+def bench_receive(count, number=1):
+    # Receive every chunk of a file, in random order
+    filesize = count * CHUNK_SIZE
+    chunks = [
+        range(offset, offset + CHUNK_SIZE)
+        for offset in range(0, filesize, CHUNK_SIZE)
+    ]
+    random.Random(count).shuffle(chunks)
+    assert receive_list(filesize, chunks) == []
+    assert not receive_rangeset(filesize, chunks)
+    list_time = timeit(
+        lambda: receive_list(filesize, chunks), number=number) / number
+    set_time = timeit(
+        lambda: receive_rangeset(filesize, chunks), number=number) / number
+    print('receive {count} chunks: list {list:.4f}s, RangeSet {set:.4f}s '
+          '({ratio:.1f}x faster)'.format(
+              count=count, list=list_time, set=set_time,
+              ratio=list_time / set_time))
+
+
+def bench_next_range(count, lookups=2000, number=1):
+    # Find the next gap from random offsets in a map with every other chunk
+    # missing (the worst case for the list, which is scanned from the start)
+    filesize = count * CHUNK_SIZE
+    missing = [
+        range(offset, offset + CHUNK_SIZE)
+        for offset in range(0, filesize, CHUNK_SIZE * 2)
+    ]
+    ranges = RangeSet(missing)
+    rand = random.Random(count)
+    offsets = [rand.randrange(filesize) for i in range(lookups)]
+    for offset in offsets:
+        assert (list_next_range(missing, offset, CHUNK_SIZE) ==
+                ranges.next_range(offset, CHUNK_SIZE))
+    list_time = timeit(lambda: [
+        list_next_range(missing, offset, CHUNK_SIZE) for offset in offsets
+    ], number=number) / number
+    set_time = timeit(lambda: [
+        ranges.next_range(offset, CHUNK_SIZE) for offset in offsets
+    ], number=number) / number
+    print('{lookups} next-gap lookups in {count} chunks: list {list:.4f}s, '
+          'RangeSet {set:.4f}s ({ratio:.1f}x faster)'.format(
+              lookups=lookups, count=count, list=list_time, set=set_time,
+              ratio=list_time / set_time))
+
+
+def chunk_orders(count, window=10):
+    in_order = list(range(0, count * CHUNK_SIZE, CHUNK_SIZE))
+    # Chunks shuffled within each window of requests in flight, as happens
+    # when fetches are retried or the network reorders replies
+    windowed = []
+    rand = random.Random(count)
+    for start in range(0, len(in_order), window):
+        part = in_order[start:start + window]
+        rand.shuffle(part)
+        windowed.extend(part)
+    # Chunks in a completely random order; most of the file can't be hashed
+    # on arrival (it exceeds TransferState.hash_buffer)
+    shuffled = in_order[:]
+    rand.shuffle(shuffled)
+    return (
+        ('in order', in_order),
+        ('windowed shuffle', windowed),
+        ('random order', shuffled),
+    )
+
+
+def receive_reread(output_path, content, order):
+    # What TransferState used to do: write each chunk as it arrives, then
+    # re-read the whole file to hash it once the transfer is complete
+    view = memoryview(content)
+    with tempfile.NamedTemporaryFile(dir=str(output_path)) as f:
+        f.truncate(len(content))
+        start = perf_counter()
+        for offset in order:
+            os.pwrite(f.fileno(), view[offset:offset + CHUNK_SIZE], offset)
+        received = perf_counter()
+        f.seek(0)
+        body = hashlib.sha256()
+        while True:
+            buf = f.read(CHUNK_SIZE)
+            if buf:
+                body.update(buf)
+            else:
+                break
+        verified = perf_counter()
+    return body.hexdigest(), received - start, verified - received
+
+
+def receive_incremental(file_state, content, order):
+    view = memoryview(content)
+    transfer = TransferState(1, file_state)
+    start = perf_counter()
+    for offset in order:
+        transfer.chunk(offset, view[offset:offset + CHUNK_SIZE])
+    received = perf_counter()
+    transfer.verify()  # raises IOError if the hash doesn't match
+    verified = perf_counter()
+    os.unlink(transfer._file.name)
+    return received - start, verified - received
+
+
+def bench_hashing(count):
+    content = os.urandom(count * CHUNK_SIZE)
+    filehash = hashlib.sha256(content).hexdigest()
+    file_state = FileState(
+        'foo-0.1-cp34-cp34m-linux_armv7l.whl', len(content), filehash,
+        'foo', '0.1', 'cp34', 'cp34m', 'linux_armv7l')
+    save_output_path = TransferState.output_path
+    with tempfile.TemporaryDirectory() as output_path:
+        TransferState.output_path = Path(output_path)
+        try:
+            for label, order in chunk_orders(count):
+                result, reread_recv, reread_verify = receive_reread(
+                    output_path, content, order)
+                assert result == filehash
+                incr_recv, incr_verify = receive_incremental(
+                    file_state, content, order)
+                print('{label}, {size}MB: re-read receive {rr:.3f}s + '
+                      'verify {rv:.3f}s, incremental receive {ir:.3f}s + '
+                      'verify {iv:.3f}s'.format(
+                          label=label, size=len(content) // 1048576,
+                          rr=reread_recv, rv=reread_verify,
+                          ir=incr_recv, iv=incr_verify))
+        finally:
+            TransferState.output_path = save_output_path
+
+
+def juggler_config(output_path):
+    config = mock.Mock()
+    config.output_path = output_path
+    config.file_queue = 'tcp://127.0.0.1:{port}'.format(
+        port=os.environ.get('PIWHEELS_BENCH_PORT', '5556'))
+    config.fs_queue = 'inproc://bench-fs'
+    config.db_queue = 'inproc://bench-db'
+    config.stats_queue = 'inproc://bench-stats'
+    config.control_queue = 'inproc://bench-control'
+    return config
+
+
+def run_transfer(ctx, config, fs_queue, db_queue, stats_queue, package,
+                 file_state):
+    fs_queue.send_pyobj(['EXPECT', 1, file_state])
+    # The juggler looks for a stored copy of the file; there isn't one
+    assert db_queue.recv_pyobj() == ['HASHFILES', file_state.filehash]
+    db_queue.send_pyobj(['OK', []])
+    assert fs_queue.recv_pyobj() == ['OK', None]
+    queue = ctx.socket(zmq.DEALER)
+    queue.hwm = 10
+    queue.connect(config.file_queue)
+    try:
+        start = perf_counter()
+        transfer([(queue, package)], 1)
+        elapsed = perf_counter() - start
+    finally:
+        queue.close()
+    while True:
+        msg, *args = stats_queue.recv_pyobj()
+        if msg == 'STATXFER':
+            throughput, rtt, saved = args
+            break
+    # The transfer is never verified; just throw away the temporary file
+    for path in (Path(config.output_path) / 'simple').glob('tmp*'):
+        path.unlink()
+    return elapsed, rtt
+
+
+def bench_throughput(count, runs=5):
+    # The adaptive settings are just the defaults
+    adaptive = {
+        'pipeline_size': TransferState.pipeline_size,
+        'chunk_size': TransferState.chunk_size,
+    }
+    fixed = {
+        'min_pipeline_size': TransferState.pipeline_size,
+        'max_pipeline_size': TransferState.pipeline_size,
+        'min_chunk_size': TransferState.chunk_size,
+        'max_chunk_size': TransferState.chunk_size,
+    }
+    ctx = zmq.Context.instance()
+    with tempfile.TemporaryDirectory() as output_path:
+        wheel = Path(output_path) / 'foo-0.1-cp34-cp34m-linux_armv7l.whl'
+        wheel.write_bytes(os.urandom(count * CHUNK_SIZE))
+        package = PiWheelsPackage(wheel)
+        file_state = FileState(
+            package.filename, package.filesize, package.filehash,
+            'foo', '0.1', 'cp34', 'cp34m', 'linux_armv7l')
+        config = juggler_config(output_path)
+        stats_queue = ctx.socket(zmq.PULL)
+        stats_queue.bind(config.stats_queue)
+        control_queue = ctx.socket(zmq.PULL)
+        control_queue.bind(config.control_queue)
+        db_queue = ctx.socket(zmq.REP)
+        db_queue.bind(config.db_queue)
+        save_output_path = TransferState.output_path
+        juggler = FileJuggler(config)
+        juggler.start()
+        fs_queue = ctx.socket(zmq.REQ)
+        fs_queue.connect(config.fs_queue)
+        try:
+            for label, settings in (('fixed', fixed), ('adaptive', adaptive)):
+                with mock.patch.multiple(TransferState, **settings):
+                    results = [
+                        run_transfer(ctx, config, fs_queue, db_queue,
+                                     stats_queue, package, file_state)
+                        for run in range(runs)
+                    ]
+                elapsed = median(elapsed for elapsed, rtt in results)
+                rtt = median(rtt for elapsed, rtt in results)
+                print('{label} window, {size}MB: {elapsed:.3f}s '
+                      '({rate:.1f}MB/s), final RTT {rtt:.2f}ms '
+                      '(median of {runs})'.format(
+                          label=label, size=package.filesize // 1048576,
+                          elapsed=elapsed,
+                          rate=package.filesize / elapsed / 1048576,
+                          rtt=rtt * 1000, runs=runs))
+        finally:
+            fs_queue.close()
+            juggler.quit()
+            juggler.join()
+            TransferState.output_path = save_output_path
+            db_queue.close()
+            control_queue.close()
+            stats_queue.close()
+
+
+def main():
+    # 100MB and 1GB files in 64KB chunks
+    for count in (1600, 16384):
+        bench_receive(count)
+        bench_next_range(count)
+    # Note that the re-read is served from the page cache here; on the
+    # master, with many concurrent transfers, it often isn't
+    bench_hashing(1600)
+    for count in (16, 1600):
+        bench_throughput(count)
+
+
+if __name__ == '__main__':
+    main()
@@ -68,6 +68,20 @@ def stats_dict(request):
         'builds_time': timedelta(0),
         'builds_size': 0,
         'builds_pending': 0,
+        'builds_feed_rate': 0.0,
+        'builds_makespan': timedelta(0),
+        'builds_estimate_error': timedelta(0),
+        'transfer_rate': 0.0,
+        'transfer_rtt': 0.0,
+        'transfer_saved': 0,
+        'transfer_compressed': 0,
+        'verify_queue': 0,
+        'verify_latency': 0.0,
+        'index_requests': 0,
+        'index_writes': 0,
+        'index_skipped': 0,
+        'index_cache_hits': 0,
+        'index_cache_misses': 0,
         'files_count': 0,
         'disk_free': 0,
         'disk_size': 1,
@@ -178,6 +192,31 @@ def test_gen_queue_stats(db_queue, master_status_queue, index_queue, task,
         assert index_queue.recv_pyobj() == ['SEARCH', [('foo', 10)]]
 
 
+def test_gen_transfer_stats(db_queue, master_status_queue, index_queue, task,
+                            stats_queue, stats_result, stats_dict):
+    with mock.patch('piwheels.master.big_brother.datetime') as dt:
+        dt.utcnow.return_value = datetime(2018, 1, 1, 12, 30, 40)
+        task.timestamp = datetime(2018, 1, 1, 12, 30, 0)
+        stats_queue.send_pyobj(['STATXFER', 1048576.0, 0.01, 1000])
+        while task.stats['transfer_rate'] == 0:
+            task.poll()
+        stats_queue.send_pyobj(['STATXFER', 2097152.0, None, 0])
+        while task.stats['transfer_rate'] == 1048576.0:
+            task.poll()
+        stats_dict['transfer_rate'] = 2097152.0
+        stats_dict['transfer_rtt'] = 0.01
+        stats_dict['transfer_compressed'] = 1000
+        db_queue.expect(['GETSTATS'])
+        db_queue.send(['OK', stats_result])
+        db_queue.expect(['GETDL'])
+        db_queue.send(['OK', {'foo': 10}])
+        task.loop()
+        db_queue.check()
+        assert index_queue.recv_pyobj() == ['HOME', stats_dict]
+        assert master_status_queue.recv_pyobj() == [-1, dt.utcnow.return_value, 'STATUS', stats_dict]
+        assert index_queue.recv_pyobj() == ['SEARCH', [('foo', 10)]]
+
+
 def test_bad_stats(db_queue, master_status_queue, index_queue, task,
                          stats_queue, stats_result, stats_dict):
     task.logger = mock.Mock()
@@ -189,3 +228,74 @@ def test_bad_stats(db_queue, master_status_queue, index_queue, task,
             task.poll()
         assert task.logger.error.call_args == mock.call(
             'invalid big_brother message: %s', 'FOO')
+
+
+def test_gen_dedup_stats(db_queue, master_status_queue, index_queue, task,
+                         stats_queue, stats_result, stats_dict):
+    with mock.patch('piwheels.master.big_brother.datetime') as dt:
+        dt.utcnow.return_value = datetime(2018, 1, 1, 12, 30, 40)
+        task.timestamp = datetime(2018, 1, 1, 12, 30, 0)
+        stats_queue.send_pyobj(['STATDEDUP', 123456])
+        while task.stats['transfer_saved'] == 0:
+            task.poll()
+        stats_queue.send_pyobj(['STATDEDUP', 1000])
+        while task.stats['transfer_saved'] == 123456:
+            task.poll()
+        stats_dict['transfer_saved'] = 124456
+        db_queue.expect(['GETSTATS'])
+        db_queue.send(['OK', stats_result])
+        db_queue.expect(['GETDL'])
+        db_queue.send(['OK', {'foo': 10}])
+        task.loop()
+        db_queue.check()
+        assert index_queue.recv_pyobj() == ['HOME', stats_dict]
+        assert master_status_queue.recv_pyobj() == [-1, dt.utcnow.return_value, 'STATUS', stats_dict]
+        assert index_queue.recv_pyobj() == ['SEARCH', [('foo', 10)]]
+
+
+def test_gen_verify_stats(db_queue, master_status_queue, index_queue, task,
+                          stats_queue, stats_result, stats_dict):
+    with mock.patch('piwheels.master.big_brother.datetime') as dt:
+        dt.utcnow.return_value = datetime(2018, 1, 1, 12, 30, 40)
+        task.timestamp = datetime(2018, 1, 1, 12, 30, 0)
+        stats_queue.send_pyobj(['STATVERIFY', 1, 0.5])
+        while task.stats['verify_latency'] == 0.0:
+            task.poll()
+        stats_dict['verify_queue'] = 1
+        stats_dict['verify_latency'] = 0.5
+        db_queue.expect(['GETSTATS'])
+        db_queue.send(['OK', stats_result])
+        db_queue.expect(['GETDL'])
+        db_queue.send(['OK', {'foo': 10}])
+        task.loop()
+        db_queue.check()
+        assert index_queue.recv_pyobj() == ['HOME', stats_dict]
+        assert master_status_queue.recv_pyobj() == [-1, dt.utcnow.return_value, 'STATUS', stats_dict]
+        assert index_queue.recv_pyobj() == ['SEARCH', [('foo', 10)]]
+
+
+def test_gen_index_stats(db_queue, master_status_queue, index_queue, task,
+                         stats_queue, stats_result, stats_dict):
+    with mock.patch('piwheels.master.big_brother.datetime') as dt:
+        dt.utcnow.return_value = datetime(2018, 1, 1, 12, 30, 40)
+        task.timestamp = datetime(2018, 1, 1, 12, 30, 0)
+        stats_queue.send_pyobj(['STATINDEX', 5, 1, 0, 0, 1])
+        while task.stats['index_writes'] == 0:
+            task.poll()
+        stats_queue.send_pyobj(['STATINDEX', 3, 1, 1, 2, 0])
+        while task.stats['index_requests'] == 5:
+            task.poll()
+        stats_dict['index_requests'] = 8
+        stats_dict['index_writes'] = 2
+        stats_dict['index_skipped'] = 1
+        stats_dict['index_cache_hits'] = 2
+        stats_dict['index_cache_misses'] = 1
+        db_queue.expect(['GETSTATS'])
+        db_queue.send(['OK', stats_result])
+        db_queue.expect(['GETDL'])
+        db_queue.send(['OK', {'foo': 10}])
+        task.loop()
+        db_queue.check()
+        assert index_queue.recv_pyobj() == ['HOME', stats_dict]
+        assert master_status_queue.recv_pyobj() == [-1, dt.utcnow.return_value, 'STATUS', stats_dict]
+        assert index_queue.recv_pyobj() == ['SEARCH', [('foo', 10)]]
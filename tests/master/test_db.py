@@ -242,12 +242,133 @@ def test_get_all_package_versions(db_intf, with_package_version):
     assert db_intf.get_all_package_versions() == {('foo', '0.1')}
 
 
+def build_queue(db_intf):
+    return [
+        (row.package, row.version, row.abi_tag)
+        for row in db_intf.get_build_queue()
+    ]
+
+
 def test_get_build_queue_full(db_intf, with_package_version):
-    assert list(db_intf.get_build_queue()) == [('foo', '0.1', 'cp34m')]
+    assert build_queue(db_intf) == [('foo', '0.1', 'cp34m')]
 
 
 def test_get_build_queue_partial(db_intf, with_build):
-    assert list(db_intf.get_build_queue()) == [('foo', '0.1', 'cp35m')]
+    assert build_queue(db_intf) == [('foo', '0.1', 'cp35m')]
+
+
+def test_get_build_queue_files(db_intf, db, with_files):
+    assert build_queue(db_intf) == [('foo', '0.1', 'cp35m')]
+    with db.begin():
+        db.execute("UPDATE files SET abi_tag = 'none'")
+    assert build_queue(db_intf) == []
+    with db.begin():
+        db.execute("DELETE FROM files")
+    assert build_queue(db_intf) == [('foo', '0.1', 'cp35m')]
+
+
+def test_get_build_queue_skip(db_intf, with_build):
+    db_intf.skip_package_version('foo', '0.1')
+    assert build_queue(db_intf) == []
+    db_intf.add_new_package_version('foo', '0.2')
+    assert build_queue(db_intf) == [('foo', '0.2', 'cp34m')]
+    db_intf.skip_package('foo')
+    assert build_queue(db_intf) == []
+
+
+def test_get_build_queue_delete_build(db_intf, with_files):
+    db_intf.delete_build('foo', '0.1')
+    assert build_queue(db_intf) == [('foo', '0.1', 'cp34m')]
+
+
+def test_get_build_queue_build_abis(db_intf, db, with_build):
+    with db.begin():
+        db.execute("INSERT INTO build_abis VALUES ('cp33m')")
+    assert build_queue(db_intf) == [('foo', '0.1', 'cp33m')]
+    with db.begin():
+        db.execute("DELETE FROM build_abis WHERE abi_tag <> 'cp34m'")
+    assert build_queue(db_intf) == []
+
+
+def test_get_build_queue_priority(db_intf, db, with_files, download_state):
+    with db.begin():
+        db.execute(
+            "INSERT INTO packages(package) VALUES ('bar'), ('baz')")
+        db.execute(
+            "INSERT INTO versions(package, version, added_at) VALUES "
+            "('bar', '1.0', TIMESTAMP '2000-01-01'), "
+            "('baz', '1.0', NOW() AT TIME ZONE 'UTC')")
+        db.execute(
+            "INSERT INTO downloads(filename, accessed_by, accessed_at) "
+            "VALUES (%s, '192.168.0.1', NOW() AT TIME ZONE 'UTC')",
+            download_state.filename)
+    # Downloads don't fire the build_queue triggers; they're only counted
+    # when the queue is reprioritized
+    db_intf.reprioritize_build_queue()
+    queue = list(db_intf.get_build_queue())
+    # foo has downloads, is new, and has files for another ABI
+    assert [(row.package, row.version) for row in queue] == [
+        ('foo', '0.1'), ('baz', '1.0'), ('bar', '1.0')]
+    assert queue[0].priority > queue[1].priority > queue[2].priority
+    assert 0 <= queue[2].priority < 0.1
+
+
+def test_get_build_queue_priority_trigger(db_intf, db, with_package_version):
+    with db.begin():
+        db.execute(
+            "INSERT INTO versions(package, version, added_at) VALUES "
+            "('foo', '0.0', TIMESTAMP '2000-01-01')")
+    queue = list(db_intf.get_build_queue())
+    # New rows are scored as they're inserted, without waiting for the
+    # periodic reprioritization
+    assert [(row.package, row.version) for row in queue] == [
+        ('foo', '0.1'), ('foo', '0.0')]
+    assert 2.9 < queue[0].priority <= 3
+    assert 0 <= queue[1].priority < 0.1
+
+
+def test_get_build_queue_priority_kept(db_intf, db, with_files,
+                                       download_state):
+    with db.begin():
+        db.execute(
+            "INSERT INTO downloads(filename, accessed_by, accessed_at) "
+            "VALUES (%s, '192.168.0.1', NOW() AT TIME ZONE 'UTC')",
+            download_state.filename)
+    db_intf.reprioritize_build_queue()
+    [before] = list(db_intf.get_build_queue())
+    # Re-evaluating the row with the triggers keeps its score (including the
+    # popularity the triggers don't calculate) and estimate
+    with db.begin():
+        db.execute(
+            "UPDATE versions SET skip = false "
+            "WHERE package = 'foo' AND version = '0.1'")
+    [after] = list(db_intf.get_build_queue())
+    assert (after.priority, after.duration) == (
+        before.priority, before.duration)
+
+
+def test_get_build_queue_duration(db_intf, db, with_build):
+    with db.begin():
+        db.execute(
+            "INSERT INTO packages(package) VALUES ('bar')")
+        db.execute(
+            "INSERT INTO versions(package, version) VALUES "
+            "('bar', '1.0'), ('bar', '1.1')")
+        db.execute(
+            "INSERT INTO builds"
+            "(package, version, built_by, duration, status, abi_tag) "
+            "VALUES ('bar', '1.0', 1, INTERVAL '60 seconds', false, 'cp34m'), "
+            "('bar', '1.0', 2, INTERVAL '60 seconds', false, 'cp35m')")
+    db_intf.reprioritize_build_queue()
+    # The global prior (the mean of recent builds) is (300 + 60 + 60) / 3 =
+    # 140s; foo has one 300s build and bar has two 60s builds
+    assert {
+        (row.package, row.version, row.duration)
+        for row in db_intf.get_build_queue()
+    } == {
+        ('foo', '0.1', timedelta(seconds=(300 + 3 * 140) / 4)),
+        ('bar', '1.1', timedelta(seconds=(120 + 3 * 140) / 5)),
+    }
 
 
 def test_get_statistics(db_intf, with_files):
@@ -263,14 +384,37 @@ def test_get_downloads_recent(db_intf, with_downloads):
 
 def test_get_package_files(db_intf, with_files):
     assert {
-        (r.filename, r.filehash)
+        (r.filename, r.filehash, r.filesize)
         for r in db_intf.get_package_files('foo')
     } == {
-        (s.filename, s.filehash)
+        (s.filename, s.filehash, s.filesize)
         for s in with_files
     }
 
 
+def test_get_packages_files(db_intf, with_files):
+    files = db_intf.get_packages_files(['foo', 'bar'])
+    assert files.keys() == {'foo', 'bar'}
+    assert {
+        (r.filename, r.filehash, r.filesize)
+        for r in files['foo']
+    } == {
+        (s.filename, s.filehash, s.filesize)
+        for s in with_files
+    }
+    assert files['bar'] == []
+
+
+def test_get_all_package_files(db_intf, with_files):
+    assert [
+        (r.package, r.filename, r.filehash, r.filesize)
+        for r in db_intf.get_all_package_files()
+    ] == sorted(
+        (s.package_tag, s.filename, s.filehash, s.filesize)
+        for s in with_files
+    )
+
+
 def test_get_version_files(db_intf, with_files):
     assert db_intf.get_version_files('foo', '0.1') == {
         s.filename for s in with_files
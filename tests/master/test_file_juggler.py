@@ -27,6 +27,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import zlib
 from pathlib import Path
 from unittest import mock
 
@@ -97,17 +98,19 @@ def test_bad_request(task, fs_queue):
     assert fs_queue.recv_pyobj()[:1] == ['ERR']
 
 
-def test_expect_file(task, master_config, fs_queue, file_state):
+def test_expect_file(task, master_config, fs_queue, file_state, db_queue):
     root = Path(master_config.output_path)
     task.logger = mock.Mock()
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', []])
     fs_queue.send_pyobj(['EXPECT', 1, file_state])
     task.poll()
     assert fs_queue.recv_pyobj() == ['OK', None]
     assert task.logger.info.call_count == 1
     assert (root / 'simple').is_dir()
-    assert 1 in task.pending
-    assert task.pending[1].slave_id == 1
-    assert task.pending[1].file_state == file_state
+    assert (1, file_state.filename) in task.pending
+    assert task.pending[1, file_state.filename].slave_id == 1
+    assert task.pending[1, file_state.filename].file_state == file_state
 
 
 def test_transfer_bad_start(task, file_queue):
@@ -121,18 +124,22 @@ def test_transfer_bad_start(task, file_queue):
 
 
 def test_transfer_success(task, master_config, stats_queue, fs_queue,
-                          file_queue, file_state, file_content, statvfs):
+                          file_queue, file_state, file_content, statvfs,
+                          db_queue):
     task.logger = mock.Mock()
     root = Path(master_config.output_path)
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', []])
     fs_queue.send_pyobj(['EXPECT', 1, file_state])
     task.poll()
     assert fs_queue.recv_pyobj() == ['OK', None]
-    assert 1 in task.pending
+    assert (1, file_state.filename) in task.pending
     assert not task.active
     assert not task.complete
     assert task.logger.info.call_count == 1
     assert (root / 'simple').is_dir()
-    file_queue.send_multipart([b'HELLO', b'1'])
+    file_queue.send_multipart(
+        [b'HELLO', b'1', file_state.filename.encode('utf-8')])
     task.poll()
     assert file_queue.recv_multipart() == [b'FETCH', b'0', b'65536']
     assert not task.pending
@@ -144,30 +151,255 @@ def test_transfer_success(task, master_config, stats_queue, fs_queue,
     file_queue.send_multipart([b'CHUNK', b'65536', file_content[65536:123456]])
     task.poll()
     assert file_queue.recv_multipart() == [b'DONE']
+    msg, rate, rtt, saved = stats_queue.recv_pyobj()
+    assert msg == 'STATXFER'
+    assert rate > 0
+    assert rtt > 0
+    assert saved == 0
     assert not task.pending
     assert not task.active
-    assert 1 in task.complete
+    assert (1, file_state.filename) in task.complete
     assert task.logger.info.call_count == 2
     fs_queue.send_pyobj(['VERIFY', 1, file_state.package_tag])
     task.poll()
-    assert fs_queue.recv_pyobj() == ['OK', None]
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', [file_state.filename]]
     assert stats_queue.recv_pyobj() == ['STATFS', statvfs]
+    msg, depth, latency = stats_queue.recv_pyobj()
+    assert msg == 'STATVERIFY'
+    assert depth == 0
+    assert latency > 0
     assert task.logger.info.call_count == 3
     assert not task.pending
     assert not task.active
     assert not task.complete
     assert (root / 'simple' / 'foo' / file_state.filename).exists()
+    assert task.hashes == {
+        file_state.filehash: root / 'simple' / 'foo' / file_state.filename}
+
+
+def test_transfer_dedup(task, master_config, stats_queue, fs_queue,
+                        file_queue, file_state, file_content, statvfs):
+    task.logger = mock.Mock()
+    root = Path(master_config.output_path)
+    existing = root / 'simple' / 'bar' / file_state.filename
+    existing.parent.mkdir(parents=True)
+    existing.write_bytes(file_content)
+    task.hashes[file_state.filehash] = existing
+    fs_queue.send_pyobj(['EXPECT', 1, file_state])
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', None]
+    assert task.pending[1, file_state.filename].deduplicated
+    file_queue.send_multipart(
+        [b'HELLO', b'1', file_state.filename.encode('utf-8')])
+    task.poll()
+    assert file_queue.recv_multipart() == [b'DONE']
+    assert stats_queue.recv_pyobj() == ['STATDEDUP', file_state.filesize]
+    assert not task.pending
+    assert not task.active
+    assert (1, file_state.filename) in task.complete
+    fs_queue.send_pyobj(['VERIFY', 1, file_state.package_tag])
+    task.poll()
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', [file_state.filename]]
+    assert stats_queue.recv_pyobj() == ['STATFS', statvfs]
+    final_path = root / 'simple' / 'foo' / file_state.filename
+    assert final_path.samefile(existing)
+    assert task.hashes[file_state.filehash] == final_path
+
+
+def test_expect_dedup_missing(task, master_config, fs_queue, file_state,
+                              db_queue):
+    root = Path(master_config.output_path)
+    task.hashes[file_state.filehash] = root / 'simple' / 'bar' / 'gone.whl'
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', []])
+    fs_queue.send_pyobj(['EXPECT', 1, file_state])
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', None]
+    assert not task.pending[1, file_state.filename].deduplicated
+    assert not task.hashes
+
+
+def test_expect_dedup_db(task, master_config, fs_queue, file_state,
+                         file_content, db_queue):
+    root = Path(master_config.output_path)
+    existing = root / 'simple' / 'bar' / file_state.filename
+    existing.parent.mkdir(parents=True)
+    existing.write_bytes(file_content)
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', [
+        ('baz', file_state.filename),
+        ('bar', file_state.filename),
+    ]])
+    fs_queue.send_pyobj(['EXPECT', 1, file_state])
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', None]
+    db_queue.check()
+    assert task.pending[1, file_state.filename].deduplicated
+    assert task.hashes == {file_state.filehash: existing}
+
+
+def test_expect_dedup_vanished(task, master_config, fs_queue, file_state,
+                               file_content):
+    root = Path(master_config.output_path)
+    existing = root / 'simple' / 'bar' / file_state.filename
+    existing.parent.mkdir(parents=True)
+    existing.write_bytes(file_content)
+    task.hashes[file_state.filehash] = existing
+    # The stored file disappears between the check and the hard-link
+    with mock.patch('piwheels.master.states.os.link') as link:
+        link.side_effect = FileNotFoundError
+        fs_queue.send_pyobj(['EXPECT', 1, file_state])
+        task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', None]
+    assert not task.pending[1, file_state.filename].deduplicated
+    assert not task.hashes
+    assert len(list((root / 'simple').glob('tmp*'))) == 1
+
+
+def test_transfer_resume(zmq_context, master_config, stats_queue, fs_queue,
+                         file_queue, file_state, file_content, db_queue):
+    save_output_path = TransferState.output_path
+    TransferState.output_path = Path(master_config.output_path)
+    try:
+        interrupted = TransferState(1, file_state)
+        interrupted.fetch()
+        interrupted.chunk(0, file_content[:65536])
+        interrupted.checkpoint()
+        interrupted._file.close()
+        task = FileJuggler(master_config)
+        try:
+            task.logger = mock.Mock()
+            assert (file_state.filename, file_state.filehash) in task.interrupted
+            db_queue.expect(['HASHFILES', file_state.filehash])
+            db_queue.send(['OK', []])
+            fs_queue.send_pyobj(['EXPECT', 2, file_state])
+            task.poll()
+            assert fs_queue.recv_pyobj() == ['OK', None]
+            assert not task.interrupted
+            file_queue.send_multipart(
+                [b'HELLO', b'2', file_state.filename.encode('utf-8')])
+            task.poll()
+            assert file_queue.recv_multipart() == [b'FETCH', b'65536', b'57920']
+            file_queue.send_multipart(
+                [b'CHUNK', b'65536', file_content[65536:123456]])
+            task.poll()
+            assert file_queue.recv_multipart() == [b'DONE']
+        finally:
+            task.close()
+    finally:
+        TransferState.output_path = save_output_path
+
+
+def test_transfer_compressed(task, stats_queue, fs_queue, file_queue,
+                             file_state, file_content, db_queue):
+    task.logger = mock.Mock()
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', []])
+    fs_queue.send_pyobj(['EXPECT', 1, file_state])
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', None]
+    file_queue.send_multipart(
+        [b'HELLO', b'1', file_state.filename.encode('utf-8'), b'bz2,zlib'])
+    task.poll()
+    assert file_queue.recv_multipart() == [b'FETCH', b'0', b'65536', b'zlib']
+    file_queue.send_multipart(
+        [b'CHUNK', b'0', zlib.compress(file_content[0:65536]), b'zlib'])
+    task.poll()
+    assert file_queue.recv_multipart() == [
+        b'FETCH', b'65536', b'57920', b'zlib']
+    # Uncompressed chunks are still acceptable
+    file_queue.send_multipart([b'CHUNK', b'65536', file_content[65536:123456]])
+    task.poll()
+    assert file_queue.recv_multipart() == [b'DONE']
+    msg, rate, rtt, saved = stats_queue.recv_pyobj()
+    assert msg == 'STATXFER'
+    assert saved == 65536 - len(zlib.compress(file_content[0:65536]))
+    fs_queue.send_pyobj(['VERIFY', 1, file_state.package_tag])
+    task.poll()
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', [file_state.filename]]
+
+
+def test_transfer_compressed_corrupt(task, fs_queue, file_queue, file_state,
+                                     file_content, db_queue):
+    task.logger = mock.Mock()
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', []])
+    fs_queue.send_pyobj(['EXPECT', 1, file_state])
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', None]
+    file_queue.send_multipart(
+        [b'HELLO', b'1', file_state.filename.encode('utf-8'), b'zlib'])
+    task.poll()
+    assert file_queue.recv_multipart() == [b'FETCH', b'0', b'65536', b'zlib']
+    file_queue.send_multipart([b'CHUNK', b'0', b'foo', b'zlib'])
+    task.poll()
+    assert task.logger.error.call_count == 1
+    file_queue.send_multipart([b'CHUNK', b'0', b'foo', b'bz2'])
+    task.poll()
+    assert task.logger.error.call_count == 2
+
+
+def test_transfer_parallel(task, zmq_context, master_config, fs_queue,
+                           file_queue, file_state, file_state_universal,
+                           file_content, db_queue):
+    task.logger = mock.Mock()
+    root = Path(master_config.output_path)
+    file_queue2 = zmq_context.socket(zmq.DEALER)
+    file_queue2.hwm = 10
+    file_queue2.connect(master_config.file_queue)
+    try:
+        for state in (file_state, file_state_universal):
+            db_queue.expect(['HASHFILES', state.filehash])
+            db_queue.send(['OK', []])
+            fs_queue.send_pyobj(['EXPECT', 1, state])
+            task.poll()
+            assert fs_queue.recv_pyobj() == ['OK', None]
+        for queue, state in ((file_queue, file_state),
+                             (file_queue2, file_state_universal)):
+            queue.send_multipart(
+                [b'HELLO', b'1', state.filename.encode('utf-8')])
+            task.poll()
+            assert queue.recv_multipart() == [b'FETCH', b'0', b'65536']
+        for queue in (file_queue, file_queue2):
+            queue.send_multipart([b'CHUNK', b'0', file_content[0:65536]])
+            task.poll()
+            assert queue.recv_multipart() == [b'FETCH', b'65536', b'57920']
+        for queue in (file_queue, file_queue2):
+            queue.send_multipart(
+                [b'CHUNK', b'65536', file_content[65536:123456]])
+            task.poll()
+            assert queue.recv_multipart() == [b'DONE']
+        assert len(task.complete) == 2
+        fs_queue.send_pyobj(['VERIFY', 1, 'foo'])
+        while not fs_queue.poll(0):
+            task.poll()
+        status, verified = fs_queue.recv_pyobj()
+        assert status == 'OK'
+        assert sorted(verified) == sorted(
+            [file_state.filename, file_state_universal.filename])
+        assert not task.complete
+        assert not task.verifying
+        for state in (file_state, file_state_universal):
+            assert (root / 'simple' / 'foo' / state.filename).exists()
+    finally:
+        file_queue2.close()
 
 
 def test_verify_failure(task, master_config, fs_queue, file_queue, file_state,
-                        file_content):
+                        file_content, db_queue):
     task.logger = mock.Mock()
     root = Path(master_config.output_path)
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', []])
     fs_queue.send_pyobj(['EXPECT', 1, file_state])
     task.poll()
     assert fs_queue.recv_pyobj() == ['OK', None]
     assert (root / 'simple').is_dir()
-    file_queue.send_multipart([b'HELLO', b'1'])
+    file_queue.send_multipart(
+        [b'HELLO', b'1', file_state.filename.encode('utf-8')])
     task.poll()
     assert file_queue.recv_multipart() == [b'FETCH', b'0', b'65536']
     file_queue.send_multipart([b'CHUNK', b'0', b'\x01' * 65536])
@@ -178,18 +410,22 @@ def test_verify_failure(task, master_config, fs_queue, file_queue, file_state,
     assert file_queue.recv_multipart() == [b'DONE']
     fs_queue.send_pyobj(['VERIFY', 1, file_state.package_tag])
     task.poll()
-    assert fs_queue.recv_pyobj()[:1] == ['ERR']
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', []]
     assert task.logger.warning.call_count == 1
     assert not (root / 'simple' / 'foo' / file_state.filename).exists()
 
 
-def test_transfer_restart(task, fs_queue, file_queue, file_state,
-                          file_content):
+def test_transfer_restart(task, fs_queue, file_queue, file_state, file_content,
+                          db_queue):
     task.logger = mock.Mock()
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', []])
     fs_queue.send_pyobj(['EXPECT', 1, file_state])
     task.poll()
     assert fs_queue.recv_pyobj() == ['OK', None]
-    file_queue.send_multipart([b'HELLO', b'1'])
+    file_queue.send_multipart(
+        [b'HELLO', b'1', file_state.filename.encode('utf-8')])
     task.poll()
     assert file_queue.recv_multipart() == [b'FETCH', b'0', b'65536']
     file_queue.send_multipart([b'CHUNK', b'0', file_content[:65536]])
@@ -197,7 +433,8 @@ def test_transfer_restart(task, fs_queue, file_queue, file_state,
     assert file_queue.recv_multipart() == [b'FETCH', b'65536', b'57920']
     # Pretend we've lost so many packets that we're attempting to restart; this
     # should be accepted with no error reported
-    file_queue.send_multipart([b'HELLO', b'1'])
+    file_queue.send_multipart(
+        [b'HELLO', b'1', file_state.filename.encode('utf-8')])
     task.poll()
     assert task.logger.error.call_count == 0
     assert file_queue.recv_multipart() == [b'FETCH', b'65536', b'57920']
@@ -206,12 +443,15 @@ def test_transfer_restart(task, fs_queue, file_queue, file_state,
     assert file_queue.recv_multipart() == [b'DONE']
     fs_queue.send_pyobj(['VERIFY', 1, file_state.package_tag])
     task.poll()
-    assert fs_queue.recv_pyobj() == ['OK', None]
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', [file_state.filename]]
 
 
 def test_transfer_error_recovery(task, fs_queue, file_queue, file_state,
-                                 file_content):
+                                 file_content, db_queue):
     task.logger = mock.Mock()
+    db_queue.expect(['HASHFILES', file_state.filehash])
+    db_queue.send(['OK', []])
     fs_queue.send_pyobj(['EXPECT', 1, file_state])
     task.poll()
     assert fs_queue.recv_pyobj() == ['OK', None]
@@ -226,7 +466,8 @@ def test_transfer_error_recovery(task, fs_queue, file_queue, file_state,
     assert task.logger.error.call_count == 1
     # Carry on with the transfer to make sure it succeeds after the initial
     # hiccups
-    file_queue.send_multipart([b'HELLO', b'1'])
+    file_queue.send_multipart(
+        [b'HELLO', b'1', file_state.filename.encode('utf-8')])
     task.poll()
     assert file_queue.recv_multipart() == [b'FETCH', b'0', b'65536']
     file_queue.send_multipart([b'CHUNK', b'0', file_content[:65536]])
@@ -241,7 +482,8 @@ def test_transfer_error_recovery(task, fs_queue, file_queue, file_state,
     assert file_queue.recv_multipart() == [b'DONE']
     fs_queue.send_pyobj(['VERIFY', 1, file_state.package_tag])
     task.poll()
-    assert fs_queue.recv_pyobj() == ['OK', None]
+    task.poll()
+    assert fs_queue.recv_pyobj() == ['OK', [file_state.filename]]
 
 
 def test_remove_success(task, master_config, stats_queue, fs_queue, statvfs):
@@ -27,6 +27,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import gzip
 import json
 from unittest import mock
 from pathlib import Path
@@ -39,10 +40,18 @@ import zmq
 import pytest
 from pkg_resources import resource_listdir
 
-from piwheels.master.index_scribe import IndexScribe
+from piwheels.master.html import tag
+from piwheels.master.index_scribe import (
+    IndexScribe,
+    render_root_index,
+    render_package_index,
+    render_root_json,
+    render_package_json,
+    render_search_index,
+)
 
 
-Row = namedtuple('Row', ('filename', 'filehash'))
+Row = namedtuple('Row', ('filename', 'filehash', 'filesize'))
 
 
 @pytest.fixture()
@@ -55,12 +64,52 @@ def index_queue(request, zmq_context, master_config):
 
 
 @pytest.fixture()
-def task(request, zmq_context, master_config, db_queue):
+def stats_queue(request, zmq_context, master_config):
+    queue = zmq_context.socket(zmq.PULL)
+    queue.hwm = 10
+    queue.bind(master_config.stats_queue)
+    yield queue
+    queue.close()
+
+
+@pytest.fixture()
+def task(request, zmq_context, master_config, db_queue, stats_queue):
     task = IndexScribe(master_config)
     yield task
     task.close()
 
 
+def tag_root_index(packages):
+    # The original TagFactory rendering of the root index, for comparison
+    return '<!DOCTYPE html>\n' + tag.html(
+        tag.head(
+            tag.title('Pi Wheels Simple Index'),
+            tag.meta(name='api-version', value=2),
+        ),
+        tag.body(
+            (tag.a(package, href=package), tag.br())
+            for package in packages
+        )
+    )
+
+
+def tag_package_index(package, files):
+    # The original TagFactory rendering of a package index, for comparison
+    return '<!DOCTYPE html>\n' + tag.html(
+        tag.head(
+            tag.title('Links for {}'.format(package))
+        ),
+        tag.body(
+            tag.h1('Links for {}'.format(package)),
+            ((tag.a(
+                f.filename,
+                href='{f.filename}#sha256={f.filehash}'.format(f=f),
+                rel='internal'), tag.br())
+             for f in files)
+        )
+    )
+
+
 def wait_for_file(path, timeout=1):
     # Eurgh ... no built-in efficient file polling in the stdlib?
     start = time()
@@ -181,13 +230,14 @@ def test_write_pkg_index(db_queue, task, index_queue, master_config):
     db_queue.expect(['ALLPKGS'])
     db_queue.send(['OK', {'foo'}])
     index_queue.send_pyobj(['PKG', 'foo'])
-    db_queue.expect(['PKGFILES', 'foo'])
-    db_queue.send(['OK', [
-        Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456'),
-        Row('foo-0.1-cp34-cp34m-linux_armv6l.whl', '123456123456'),
-    ]])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': [
+        Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456),
+        Row('foo-0.1-cp34-cp34m-linux_armv6l.whl', '123456123456', 123456),
+    ]}])
     task.once()
     task.poll()
+    task.loop()
     db_queue.check()
     root = Path(master_config.output_path)
     index = root / 'simple' / 'foo' / 'index.html'
@@ -204,16 +254,17 @@ def test_write_pkg_index_fails(db_queue, task, index_queue, master_config):
     db_queue.expect(['ALLPKGS'])
     db_queue.send(['OK', {'foo'}])
     index_queue.send_pyobj(['PKG', 'foo'])
-    db_queue.expect(['PKGFILES', 'foo'])
-    db_queue.send(['OK', [
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': [
         # Send ordinary tuples (method expects rows with attributes named
         # after columns)
         ('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456'),
         ('foo-0.1-cp34-cp34m-linux_armv6l.whl', '123456123456'),
-    ]])
+    ]}])
     task.once()
+    task.poll()
     with pytest.raises(AttributeError):
-        task.poll()
+        task.loop()
     db_queue.check()
     root = Path(master_config.output_path)
     index = root / 'simple' / 'foo' / 'index.html'
@@ -221,16 +272,18 @@ def test_write_pkg_index_fails(db_queue, task, index_queue, master_config):
 
 
 def test_write_new_pkg_index(db_queue, task, index_queue, master_config):
+    task.root_index_delay = 0
     db_queue.expect(['ALLPKGS'])
     db_queue.send(['OK', {'foo'}])
     index_queue.send_pyobj(['PKG', 'bar'])
-    db_queue.expect(['PKGFILES', 'bar'])
-    db_queue.send(['OK', [
-        Row('bar-1.0-cp34-cp34m-linux_armv7l.whl', '123456abcdef'),
-        Row('bar-1.0-cp34-cp34m-linux_armv6l.whl', '123456abcdef'),
-    ]])
+    db_queue.expect(['PKGSFILES', ['bar']])
+    db_queue.send(['OK', {'bar': [
+        Row('bar-1.0-cp34-cp34m-linux_armv7l.whl', '123456abcdef', 123456),
+        Row('bar-1.0-cp34-cp34m-linux_armv6l.whl', '123456abcdef', 123456),
+    ]}])
     task.once()
     task.poll()
+    task.loop()
     db_queue.check()
     root = Path(master_config.output_path)
     root_index = root / 'simple' / 'index.html'
@@ -244,6 +297,373 @@ def test_write_new_pkg_index(db_queue, task, index_queue, master_config):
     assert contains_elem(
         pkg_index, 'a', [('href', 'bar-1.0-cp34-cp34m-linux_armv7l.whl#sha256=123456abcdef')]
     )
+    root_json = json.loads(
+        (root / 'simple' / 'index.json').read_text(encoding='utf-8'))
+    assert root_json['meta'] == {'api-version': '1.1'}
+    assert {'name': 'bar'} in root_json['projects']
+    pkg_json = json.loads(
+        (root / 'simple' / 'bar' / 'index.json').read_text(encoding='utf-8'))
+    assert pkg_json == {
+        'meta': {'api-version': '1.1'},
+        'name': 'bar',
+        'versions': ['1.0'],
+        'files': [
+            {
+                'filename': 'bar-1.0-cp34-cp34m-linux_armv6l.whl',
+                'url': 'bar-1.0-cp34-cp34m-linux_armv6l.whl',
+                'hashes': {'sha256': '123456abcdef'},
+                'size': 123456,
+            },
+            {
+                'filename': 'bar-1.0-cp34-cp34m-linux_armv7l.whl',
+                'url': 'bar-1.0-cp34-cp34m-linux_armv7l.whl',
+                'hashes': {'sha256': '123456abcdef'},
+                'size': 123456,
+            },
+        ],
+    }
+
+
+def test_write_pkg_index_coalesced(db_queue, task, index_queue, stats_queue,
+                                   master_config):
+    task.index_delay = 60
+    task.root_index_delay = 0
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    task.once()
+    db_queue.check()
+    for package in ('foo', 'foo', 'bar', 'foo'):
+        index_queue.send_pyobj(['PKG', package])
+    while sum(count for requested, count in task.pending.values()) < 4:
+        task.poll()
+    task.loop()
+    root = Path(master_config.output_path)
+    assert not (root / 'simple' / 'foo' / 'index.html').exists()
+    assert not (root / 'simple' / 'bar' / 'index.html').exists()
+    task.index_delay = 0
+    db_queue.expect(['PKGSFILES', ['bar', 'foo']])
+    db_queue.send(['OK', {
+        'bar': [
+            Row('bar-1.0-cp34-cp34m-linux_armv7l.whl', '123456abcdef', 123456),
+        ],
+        'foo': [
+            Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456),
+        ],
+    }])
+    task.loop()
+    db_queue.check()
+    assert not task.pending
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 4, 2, 0, 0, 2]
+    assert (root / 'simple' / 'foo' / 'index.html').exists()
+    assert (root / 'simple' / 'bar' / 'index.html').exists()
+    assert contains_elem(root / 'simple' / 'index.html', 'a', [('href', 'bar')])
+
+
+def test_write_root_index_delayed(db_queue, task, index_queue, master_config):
+    task.root_index_delay = 60
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo', 'qux'}])
+    task.once()
+    db_queue.check()
+    root = Path(master_config.output_path)
+    root_index = root / 'simple' / 'index.html'
+    for package in ('bar', 'baz'):
+        index_queue.send_pyobj(['PKG', package])
+        db_queue.expect(['PKGSFILES', [package]])
+        db_queue.send(['OK', {package: []}])
+        while package not in task.pending:
+            task.poll()
+        task.loop()
+        db_queue.check()
+        assert (root / 'simple' / package / 'index.html').exists()
+    assert not contains_elem(root_index, 'a', [('href', 'bar')])
+    assert not contains_elem(root_index, 'a', [('href', 'baz')])
+    task.root_index_delay = 0
+    task.loop()
+    assert task.root_index_due is None
+    content = root_index.read_text(encoding='utf-8')
+    assert content.index('"bar"') < content.index('"baz"') < \
+        content.index('"foo"') < content.index('"qux"')
+
+
+def test_write_root_index_on_close(db_queue, task, index_queue,
+                                   master_config):
+    task.root_index_delay = 60
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    task.once()
+    index_queue.send_pyobj(['PKG', 'bar'])
+    db_queue.expect(['PKGSFILES', ['bar']])
+    db_queue.send(['OK', {'bar': []}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    root_index = Path(master_config.output_path) / 'simple' / 'index.html'
+    assert not contains_elem(root_index, 'a', [('href', 'bar')])
+    task.close()
+    assert contains_elem(root_index, 'a', [('href', 'bar')])
+
+
+def test_write_pkg_index_on_close(db_queue, task, index_queue, master_config):
+    task.index_delay = 60
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    task.once()
+    index_queue.send_pyobj(['PKG', 'foo'])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': [
+        Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456),
+    ]}])
+    task.close()
+    db_queue.check()
+    root = Path(master_config.output_path)
+    assert (root / 'simple' / 'foo' / 'index.html').exists()
+
+
+def test_write_gzip_output(db_queue, task, index_queue, master_config):
+    task.gzip_output = True
+    task.root_index_delay = 0
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    index_queue.send_pyobj(['PKG', 'bar'])
+    db_queue.expect(['PKGSFILES', ['bar']])
+    db_queue.send(['OK', {'bar': [
+        Row('bar-1.0-cp34-cp34m-linux_armv7l.whl', '123456abcdef', 123456),
+    ]}])
+    task.once()
+    task.poll()
+    task.loop()
+    db_queue.check()
+    root = Path(master_config.output_path)
+    for path in (
+        root / 'styles.css',
+        root / 'simple' / 'index.html',
+        root / 'simple' / 'bar' / 'index.html',
+    ):
+        gz_path = path.with_name(path.name + '.gz')
+        assert gz_path.exists() and gz_path.is_file()
+        assert gzip.decompress(gz_path.read_bytes()) == path.read_bytes()
+        assert gz_path.stat().st_mode == path.stat().st_mode
+    assert not (root / 'mythic_beasts_logo.png.gz').exists()
+    assert 'bar' in gzip.decompress(
+        (root / 'simple' / 'index.html.gz').read_bytes()).decode('utf-8')
+
+
+def test_write_gzip_output_disabled(db_queue, task, index_queue,
+                                    master_config):
+    root = Path(master_config.output_path)
+    (root / 'simple' / 'foo').mkdir(parents=True)
+    (root / 'simple' / 'foo' / 'index.html.gz').touch()
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    index_queue.send_pyobj(['PKG', 'foo'])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': [
+        Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456),
+    ]}])
+    task.once()
+    task.poll()
+    task.loop()
+    db_queue.check()
+    assert (root / 'simple' / 'foo' / 'index.html').exists()
+    assert not (root / 'simple' / 'foo' / 'index.html.gz').exists()
+    assert not (root / 'simple' / 'index.html.gz').exists()
+    assert not (root / 'styles.css.gz').exists()
+
+
+def test_write_pkg_index_unchanged(db_queue, task, index_queue, stats_queue,
+                                   master_config):
+    files = [
+        Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456),
+    ]
+    root = Path(master_config.output_path)
+    index = root / 'simple' / 'foo' / 'index.html'
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    task.once()
+    # Pre-existing index is read to determine its digest
+    index.parent.mkdir()
+    index.write_text(''.join(render_package_index('foo', files)),
+                     encoding='utf-8')
+    (index.parent / 'index.json').write_text(
+        ''.join(render_package_json('foo', files)), encoding='utf-8')
+    inode = index.stat().st_ino
+    # The second attempt uses the digest recorded by the first
+    for attempt in range(2):
+        index_queue.send_pyobj(['PKG', 'foo'])
+        db_queue.expect(['PKGSFILES', ['foo']])
+        db_queue.send(['OK', {'foo': files}])
+        while not task.pending:
+            task.poll()
+        task.loop()
+        db_queue.check()
+        assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 0, 1, 0, 1]
+        assert index.stat().st_ino == inode
+    files.append(Row('foo-0.1-cp34-cp34m-linux_armv6l.whl', '123456123456', 123456))
+    index_queue.send_pyobj(['PKG', 'foo'])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': files}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 1, 0, 0, 1]
+    assert index.stat().st_ino != inode
+    assert contains_elem(
+        index, 'a', [('href', 'foo-0.1-cp34-cp34m-linux_armv6l.whl#sha256=123456123456')]
+    )
+    # Removing the index forces it to be re-written, even if unchanged
+    index.unlink()
+    index_queue.send_pyobj(['PKG', 'foo'])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': files}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 1, 0, 0, 1]
+    assert index.exists()
+
+
+def test_write_pkg_index_unchanged_gzip(db_queue, task, index_queue,
+                                        stats_queue, master_config):
+    task.gzip_output = True
+    files = [
+        Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456),
+    ]
+    root = Path(master_config.output_path)
+    index = root / 'simple' / 'foo' / 'index.html'
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    task.once()
+    # An unchanged index written before gzip_output was enabled is re-written
+    # to produce the compressed copies
+    index.parent.mkdir()
+    index.write_text(''.join(render_package_index('foo', files)),
+                     encoding='utf-8')
+    (index.parent / 'index.json').write_text(
+        ''.join(render_package_json('foo', files)), encoding='utf-8')
+    index_queue.send_pyobj(['PKG', 'foo'])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': files}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 1, 0, 0, 1]
+    for name in ('index.html.gz', 'index.json.gz'):
+        assert (index.parent / name).exists()
+    # Once they're in place, it's skipped
+    index_queue.send_pyobj(['PKG', 'foo'])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': files}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 0, 1, 0, 1]
+    # But not if one of them is lost
+    (index.parent / 'index.json.gz').unlink()
+    index_queue.send_pyobj(['PKG', 'foo'])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': files}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 1, 0, 0, 1]
+    assert (index.parent / 'index.json.gz').exists()
+
+
+def test_write_pkg_index_stale_json(db_queue, task, index_queue, stats_queue,
+                                    master_config):
+    files = [
+        Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456),
+    ]
+    root = Path(master_config.output_path)
+    index = root / 'simple' / 'foo' / 'index.html'
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    task.once()
+    # An unchanged HTML index doesn't prevent a stale JSON index (e.g. one
+    # written by an older version) from being re-written
+    index.parent.mkdir()
+    index.write_text(''.join(render_package_index('foo', files)),
+                     encoding='utf-8')
+    (index.parent / 'index.json').write_text(
+        '{"meta": {"api-version": "1.0"}}', encoding='utf-8')
+    index_queue.send_pyobj(['PKG', 'foo'])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': files}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 1, 0, 0, 1]
+    assert (index.parent / 'index.json').read_text(encoding='utf-8') == (
+        ''.join(render_package_json('foo', files)))
+
+
+def test_write_pkg_index_cached(db_queue, task, index_queue, stats_queue,
+                                master_config):
+    armv7l = Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456)
+    armv6l = Row('foo-0.1-cp34-cp34m-linux_armv6l.whl', '123456123456', 123456)
+    index = Path(master_config.output_path) / 'simple' / 'foo' / 'index.html'
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo'}])
+    task.once()
+    index_queue.send_pyobj(['PKG', 'foo', [tuple(armv7l)]])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': [armv7l]}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 1, 0, 0, 1]
+    # The package is now cached, so the files accompanying the request are
+    # merged into the cached list without consulting the database
+    index_queue.send_pyobj(['PKG', 'foo', [tuple(armv7l), tuple(armv6l)]])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 1, 0, 1, 0]
+    assert index.read_text(encoding='utf-8') == ''.join(
+        render_package_index('foo', [armv6l, armv7l]))
+    # A request without files invalidates the cached list
+    index_queue.send_pyobj(['PKG', 'foo'])
+    db_queue.expect(['PKGSFILES', ['foo']])
+    db_queue.send(['OK', {'foo': [armv7l]}])
+    while not task.pending:
+        task.poll()
+    task.loop()
+    db_queue.check()
+    assert stats_queue.recv_pyobj() == ['STATINDEX', 1, 1, 0, 0, 1]
+    assert not contains_elem(
+        index, 'a', [('href', armv6l.filename + '#sha256=123456123456')])
+
+
+def test_files_cache_evicted(db_queue, task, index_queue, master_config):
+    task.files_cache_size = 2
+    task.root_index_delay = 60
+    db_queue.expect(['ALLPKGS'])
+    db_queue.send(['OK', {'foo', 'bar', 'baz'}])
+    task.once()
+    for package in ('foo', 'bar', 'foo', 'baz'):
+        index_queue.send_pyobj(['PKG', package, []])
+        if package not in task.files_cache:
+            db_queue.expect(['PKGSFILES', [package]])
+            db_queue.send(['OK', {package: []}])
+        while package not in task.pending:
+            task.poll()
+        task.loop()
+        db_queue.check()
+    # bar was the least recently used, so it was evicted when baz was added
+    assert list(task.files_cache) == ['foo', 'baz']
 
 
 def test_write_search_index(db_queue, task, index_queue, master_config):
@@ -278,3 +698,73 @@ def test_write_search_index_fails(db_queue, task, index_queue, master_config):
     root = Path(master_config.output_path)
     packages_json = root / 'packages.json'
     assert not packages_json.exists()
+
+
+def test_render_root_index():
+    packages = ['bar', 'foo', 'f<o>o', 'a&b', 'quo"te'] + [
+        'pkg%d' % i for i in range(2500)]
+    assert ''.join(render_root_index(packages)) == tag_root_index(packages)
+    assert ''.join(render_root_index([])) == tag_root_index([])
+    assert len(list(render_root_index(packages, chunk=1000))) == 5
+
+
+def test_render_package_index():
+    files = [
+        Row('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 123456),
+        Row('foo-0.1-cp34-cp34m-linux_armv6l.whl', '123456123456', 123456),
+        Row('f&o<o>-0.1-cp34-cp34m-linux_armv6l.whl', '"123456"', 123456),
+    ]
+    for package in ('foo', 'f&o<o>'):
+        assert ''.join(render_package_index(package, files)) == \
+            tag_package_index(package, files)
+        assert ''.join(render_package_index(package, [])) == \
+            tag_package_index(package, [])
+
+
+def test_render_root_json():
+    packages = ['bar', 'foo', 'f"o\\o', 'b\u00e4r'] + [
+        'pkg%d' % i for i in range(2500)]
+    assert json.loads(''.join(render_root_json(packages))) == {
+        'meta': {'api-version': '1.1'},
+        'projects': [{'name': package} for package in packages],
+    }
+    assert json.loads(''.join(render_root_json([]))) == {
+        'meta': {'api-version': '1.1'},
+        'projects': [],
+    }
+
+
+def test_render_package_json():
+    files = [
+        Row('Foo_Bar-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 1024),
+        Row('Foo_Bar-0.1-cp34-cp34m-linux_armv6l.whl', '123456123456', 2048),
+        Row('Foo_Bar-0.2-py3-none-any.whl', '123456123456', 512),
+    ]
+    assert json.loads(''.join(render_package_json('Foo_Bar', files))) == {
+        'meta': {'api-version': '1.1'},
+        'name': 'foo-bar',
+        'versions': ['0.1', '0.2'],
+        'files': [
+            {
+                'filename': f.filename,
+                'url': f.filename,
+                'hashes': {'sha256': f.filehash},
+                'size': f.filesize,
+            }
+            for f in files
+        ],
+    }
+    assert json.loads(''.join(render_package_json('foo', []))) == {
+        'meta': {'api-version': '1.1'},
+        'name': 'foo',
+        'versions': [],
+        'files': [],
+    }
+
+
+def test_render_search_index():
+    search_index = [('foo', 10), ('bar', 1), ('b"az', 0)] + [
+        ('pkg%d' % i, i) for i in range(2500)]
+    assert ''.join(render_search_index(search_index)) == json.dumps(
+        search_index, separators=(',', ':'))
+    assert ''.join(render_search_index([])) == '[]'
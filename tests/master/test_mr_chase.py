@@ -109,9 +109,10 @@ def test_normal_import(db_queue, fs_queue, index_queue, task, import_queue,
 
     import_queue.send_pyobj(['SENT'])
     fs_queue.expect(['VERIFY', 0, bsh.package])
-    fs_queue.send(['OK', None])
+    fs_queue.send(['OK', [bsh.next_file]])
     task.poll()
-    assert index_queue.recv_pyobj() == ['PKG', bsh.package]
+    bsh.files[bsh.next_file].verified()
+    assert index_queue.recv_pyobj() == ['PKG', bsh.package, bsh.index_files]
     assert import_queue.recv_pyobj() == ['DONE']
     assert len(task.states) == 0
     db_queue.check()
@@ -151,21 +152,22 @@ def test_import_dual_files(db_queue, fs_queue, index_queue, task, import_queue,
 
     import_queue.send_pyobj(['SENT'])
     fs_queue.expect(['VERIFY', 0, bsh.package])
-    fs_queue.send(['OK', None])
+    fs_queue.send(['OK', [filename]])
     bsh.files[filename].verified()
     fs_queue.expect(['EXPECT', 0, bsh.files[bsh.next_file]])
     fs_queue.send(['OK', None])
     task.poll()
-    assert index_queue.recv_pyobj() == ['PKG', bsh.package]
+    assert index_queue.recv_pyobj() == ['PKG', bsh.package, bsh.index_files]
     msg, filename = import_queue.recv_pyobj()
     assert msg == 'SEND'
     assert filename in bsh.files
 
     import_queue.send_pyobj(['SENT'])
     fs_queue.expect(['VERIFY', 0, bsh.package])
-    fs_queue.send(['OK', None])
+    fs_queue.send(['OK', [filename]])
     task.poll()
-    assert index_queue.recv_pyobj() == ['PKG', bsh.package]
+    bsh.files[filename].verified()
+    assert index_queue.recv_pyobj() == ['PKG', bsh.package, bsh.index_files]
     assert import_queue.recv_pyobj() == ['DONE']
     assert len(task.states) == 0
     db_queue.check()
@@ -199,13 +201,15 @@ def test_import_resend_file(db_queue, fs_queue, task, import_queue,
 
     import_queue.send_pyobj(['SENT'])
     fs_queue.expect(['VERIFY', 0, bsh.package])
-    fs_queue.send(['ERR', IOError('hash failed')])
+    fs_queue.send(['OK', []])
+    fs_queue.expect(['EXPECT', 0, bsh.files[bsh.next_file]])
+    fs_queue.send(['OK', None])
     task.poll()
     assert import_queue.recv_pyobj() == ['SEND', bsh.next_file]
 
     import_queue.send_pyobj(['SENT'])
     fs_queue.expect(['VERIFY', 0, bsh.package])
-    fs_queue.send(['OK', None])
+    fs_queue.send(['OK', [bsh.next_file]])
     task.poll()
     assert import_queue.recv_pyobj() == ['DONE']
     assert len(task.states) == 0
@@ -28,6 +28,7 @@
 
 
 from piwheels.master.ranges import (
+    RangeSet,
     consolidate,
     split,
     exclude,
@@ -56,3 +57,66 @@ def test_intersect():
     assert intersect(range(10), range(5)) == range(5)
     assert intersect(range(10), range(10, 2)) is None
     assert intersect(range(10), range(2, 5)) == range(2, 5)
+
+
+def test_range_set_init():
+    assert list(RangeSet()) == []
+    assert list(RangeSet([range(0)])) == []
+    assert list(RangeSet([range(5, 10), range(5)])) == [range(10)]
+    assert list(RangeSet([range(6, 10), range(5)])) == [range(5), range(6, 10)]
+    assert len(RangeSet([range(6, 10), range(5)])) == 2
+    assert not RangeSet()
+    assert RangeSet([range(5)]) == RangeSet([range(3), range(2, 5)])
+    assert repr(RangeSet([range(5)])) == 'RangeSet([range(0, 5)])'
+
+
+def test_range_set_exclude():
+    r = RangeSet([range(10)])
+    r.exclude(range(2))
+    assert list(r) == [range(2, 10)]
+    r.exclude(range(4, 6))
+    assert list(r) == [range(2, 4), range(6, 10)]
+    r.exclude(range(5, 5))
+    assert list(r) == [range(2, 4), range(6, 10)]
+    r.exclude(range(20, 30))
+    assert list(r) == [range(2, 4), range(6, 10)]
+    r.exclude(range(3, 8))
+    assert list(r) == [range(2, 3), range(8, 10)]
+    r.exclude(range(0, 20))
+    assert list(r) == []
+    r = RangeSet([range(0, 2), range(4, 6), range(8, 10)])
+    r.exclude(range(2, 4))
+    assert list(r) == [range(0, 2), range(4, 6), range(8, 10)]
+    r.exclude(range(1, 9))
+    assert list(r) == [range(0, 1), range(9, 10)]
+
+
+def test_range_set_exclude_matches_exclude():
+    ranges = [range(100)]
+    r = RangeSet(ranges)
+    for ex in (range(10, 20), range(15, 25), range(0, 5), range(90, 200),
+               range(30, 31), range(29, 32), range(50, 60), range(40, 70)):
+        ranges = list(exclude(ranges, ex))
+        r.exclude(ex)
+        assert list(r) == ranges
+
+
+def test_range_set_intersects():
+    r = RangeSet([range(2, 4), range(6, 10)])
+    assert r.intersects(range(3, 5))
+    assert r.intersects(range(0, 20))
+    assert not r.intersects(range(4, 6))
+    assert not r.intersects(range(0, 2))
+    assert not r.intersects(range(10, 20))
+    assert not r.intersects(range(3, 3))
+
+
+def test_range_set_next_range():
+    r = RangeSet([range(2, 4), range(6, 10)])
+    assert r.next_range(0, 3) == range(2, 3)
+    assert r.next_range(3, 5) == range(3, 4)
+    assert r.next_range(4, 5) == range(6, 9)
+    assert r.next_range(8, 5) == range(8, 10)
+    assert r.next_range(10, 5) == range(2, 4)
+    assert r.next_range(10, 1) == range(2, 3)
+    assert RangeSet().next_range(0, 5) is None
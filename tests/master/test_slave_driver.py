@@ -35,13 +35,13 @@ import pytest
 
 from piwheels import const
 from piwheels.master.tasks import TaskQuit
-from piwheels.master.slave_driver import SlaveDriver
+from piwheels.master.slave_driver import SlaveDriver, AbiQueue
 from piwheels.master.states import SlaveState, BuildState
 
 
 @pytest.fixture()
 def builds_queue(request, zmq_context, master_config):
-    queue = zmq_context.socket(zmq.PUSH)
+    queue = zmq_context.socket(zmq.REQ)
     queue.hwm = 1
     queue.bind(master_config.builds_queue)
     yield queue
@@ -116,19 +116,23 @@ def test_control_bad_message(task):
 
 def test_new_builds(task, builds_queue, stats_queue):
     assert not task.abi_queues
-    builds_queue.send_pyobj(['cp34m', 'foo', '0.1'])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
     task.poll()
-    assert task.abi_queues['cp34m'] == {('foo', '0.1')}
+    assert builds_queue.recv_pyobj() == ['CREDIT', 999]
+    assert set(task.abi_queues['cp34m']) == {('foo', '0.1')}
     assert stats_queue.recv_pyobj() == ['STATBQ', {'cp34m': 1}]
-    builds_queue.send_pyobj(['cp35m', 'foo', '0.1'])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp35m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
     task.poll()
-    assert task.abi_queues['cp35m'] == {('foo', '0.1')}
+    assert builds_queue.recv_pyobj() == ['CREDIT', 1998]
+    assert set(task.abi_queues['cp35m']) == {('foo', '0.1')}
     assert stats_queue.recv_pyobj() == ['STATBQ', {'cp34m': 1, 'cp35m': 1}]
 
 
 def test_slave_says_hello(task, slave_queue):
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     for state in task.slaves.values():
         assert state.slave_id == 1
@@ -144,6 +148,17 @@ def test_slave_says_hello(task, slave_queue):
         assert False, "No slaves found"
 
 
+def test_slave_protocol_mismatch(task, slave_queue):
+    task.logger = mock.Mock()
+    # A slave from before the protocol was versioned
+    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
+                            'linux_armv7l', 'piwheels1', 0, 1])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['BYE']
+    assert not task.slaves
+    assert task.logger.error.call_count == 1
+
+
 def test_slave_invalid_message(task, slave_queue):
     task.logger = mock.Mock()
     slave_queue.send(b'HELLO')
@@ -160,10 +175,40 @@ def test_slave_invalid_first_message(task, slave_queue):
     assert task.logger.error.call_count == 1
 
 
+def test_slave_invalid_hello(task, slave_queue):
+    task.logger = mock.Mock()
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1'])
+    task.poll()
+    assert not task.slaves
+    assert task.logger.error.call_count == 1
+
+
+def test_slave_slots(task, zmq_context, slave_queue, master_config):
+    slot_queue = zmq_context.socket(zmq.REQ)
+    slot_queue.hwm = 1
+    slot_queue.connect(master_config.slave_queue)
+    try:
+        for slot, queue in enumerate((slave_queue, slot_queue), start=1):
+            queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                              'cp34m', 'linux_armv7l', 'piwheels1',
+                              slot - 1, 2])
+            task.poll()
+            assert queue.recv_pyobj() == [
+                'HELLO', slot, master_config.pypi_simple]
+        assert len(task.slaves) == 2
+        assert {
+            (state.label, state.slot, state.slots)
+            for state in task.slaves.values()
+        } == {('piwheels1', 0, 2), ('piwheels1', 1, 2)}
+    finally:
+        slot_queue.close()
+
+
 def test_slave_protocol_error(task, slave_queue, master_config):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
     assert task.logger.error.call_count == 0
@@ -177,15 +222,15 @@ def test_slave_commits_suicide(task, slave_queue, master_status_queue,
     with mock.patch('piwheels.master.states.datetime') as dt:
         dt.utcnow.return_value = datetime.utcnow()
         task.logger = mock.Mock()
-        slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                                'linux_armv7l', 'piwheels1'])
+        slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                                'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
         task.poll()
         assert task.logger.warning.call_count == 1
         assert slave_queue.recv_pyobj() == ['HELLO', 1,
                                             master_config.pypi_simple]
         assert master_status_queue.recv_pyobj() == [
             1, dt.utcnow.return_value, 'HELLO', timedelta(seconds=300),
-            'cp34', 'cp34m', 'linux_armv7l', 'piwheels1'
+            'cp34', 'cp34m', 'linux_armv7l', 'piwheels1', 0, 1
         ]
         assert task.slaves
         slave_queue.send_pyobj(['BYE'])
@@ -207,20 +252,20 @@ def test_master_lists_slaves(task, slave_queue, master_config,
                              master_status_queue):
     with mock.patch('piwheels.master.states.datetime') as dt:
         dt.utcnow.return_value = datetime.utcnow()
-        slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                                'linux_armv7l', 'piwheels1'])
+        slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                                'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
         task.poll()
         assert slave_queue.recv_pyobj() == ['HELLO', 1,
                                             master_config.pypi_simple]
         assert master_status_queue.recv_pyobj() == [
             1, dt.utcnow.return_value, 'HELLO', timedelta(seconds=300),
-            'cp34', 'cp34m', 'linux_armv7l', 'piwheels1'
+            'cp34', 'cp34m', 'linux_armv7l', 'piwheels1', 0, 1
         ]
         task.list_slaves()
         task.poll()
         assert master_status_queue.recv_pyobj() == [
             1, dt.utcnow.return_value, 'HELLO', timedelta(seconds=300),
-            'cp34', 'cp34m', 'linux_armv7l', 'piwheels1'
+            'cp34', 'cp34m', 'linux_armv7l', 'piwheels1', 0, 1
         ]
 
 
@@ -228,13 +273,13 @@ def test_slave_remove_expired(task, slave_queue, master_config,
                               master_status_queue):
     with mock.patch('piwheels.master.states.datetime') as dt:
         dt.utcnow.return_value = datetime.utcnow()
-        slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                                'linux_armv7l', 'piwheels1'])
+        slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                                'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
         task.poll()
         assert len(task.slaves) == 1
         assert master_status_queue.recv_pyobj() == [
             1, dt.utcnow.return_value, 'HELLO', timedelta(seconds=300),
-            'cp34', 'cp34m', 'linux_armv7l', 'piwheels1'
+            'cp34', 'cp34m', 'linux_armv7l', 'piwheels1', 0, 1
         ]
         old_now = dt.utcnow.return_value
         dt.utcnow.return_value = dt.utcnow.return_value + timedelta(hours=4)
@@ -244,8 +289,8 @@ def test_slave_remove_expired(task, slave_queue, master_config,
 
 
 def test_slave_says_hello(task, slave_queue):
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     for state in task.slaves.values():
         assert state.slave_id == 1
@@ -263,8 +308,8 @@ def test_slave_says_hello(task, slave_queue):
 
 def test_slave_says_idle_invalid(task, slave_queue, master_config):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
     for slave in task.slaves.values():
@@ -284,8 +329,8 @@ def test_master_kills_nothing(task):
 
 
 def test_master_says_idle_when_terminated(task, slave_queue, master_config):
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
     task.kill_slave(1)
@@ -296,70 +341,240 @@ def test_master_says_idle_when_terminated(task, slave_queue, master_config):
 
 
 def test_master_kills_correct_slave(task, slave_queue, master_config):
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
     task.kill_slave(2)
     task.poll()
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
-    assert slave_queue.recv_pyobj() == ['SLEEP']
+    assert not slave_queue.poll(100)
+    task.kill_slave(1)
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['BYE']
 
 
 def test_slave_says_idle_no_builds(task, slave_queue, builds_queue,
                                    master_config):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
+    slave_queue.send_pyobj(['IDLE'])
+    task.poll()
+    assert not slave_queue.poll(100)
+    for slave in task.slaves.values():
+        assert slave.parked is not None
+    task.loop()
+    assert not slave_queue.poll(100)
+    task.max_park_time = timedelta(0)
+    task.loop()
+    assert slave_queue.recv_pyobj() == ['SLEEP', 0]
+    for slave in task.slaves.values():
+        assert slave.parked is None
+    slave_queue.send_pyobj(['IDLE'])
+    task.poll()
+    assert not slave_queue.poll(100)
+
+
+def test_slave_parked_until_build(task, slave_queue, builds_queue,
+                                  stats_queue, master_config):
+    task.logger = mock.Mock()
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
-    assert slave_queue.recv_pyobj() == ['SLEEP']
+    assert not slave_queue.poll(100)
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp35m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
+    task.poll()
+    builds_queue.recv_pyobj()
+    assert not slave_queue.poll(100)
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
+    task.poll()
+    builds_queue.recv_pyobj()
+    assert slave_queue.recv_pyobj() == ['BUILD', 'foo', '0.1']
+    for slave in task.slaves.values():
+        assert slave.parked is None
 
 
 def test_slave_says_idle_with_build(task, slave_queue, builds_queue,
                                     master_config):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
-    builds_queue.send_pyobj(['cp34m', 'foo', '0.1'])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
     task.poll()
-    builds_queue.send_pyobj(['cp35m', 'bar', '0.1'])
+    builds_queue.recv_pyobj()
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp35m', 'bar', '0.1', 1.0, timedelta(minutes=1))]])
     task.poll()
+    builds_queue.recv_pyobj()
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
     assert slave_queue.recv_pyobj() == ['BUILD', 'foo', '0.1']
 
 
+def test_slave_says_idle_priority(task, slave_queue, builds_queue,
+                                  master_config):
+    task.logger = mock.Mock()
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', 'foo', '0.1', 1.0, timedelta(minutes=1)),
+        ('cp34m', 'bar', '0.1', 5.0, timedelta(minutes=1)),
+        ('cp34m', 'baz', '0.1', 3.0, timedelta(minutes=1)),
+    ]])
+    task.poll()
+    builds_queue.recv_pyobj()
+    slave_queue.send_pyobj(['IDLE'])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['BUILD', 'bar', '0.1']
+
+
+def test_abi_queue_estimates():
+    queue = AbiQueue(3)
+    assert queue.total_estimate() == timedelta(0)
+    queue.add('foo', '0.1', 1.0, timedelta(minutes=1))
+    queue.add('bar', '0.1', 2.0, timedelta(minutes=2))
+    queue.add('baz', '0.1', 3.0)
+    assert queue.estimate('foo', '0.1') == timedelta(minutes=1)
+    assert queue.estimate('baz', '0.1') is None
+    assert queue.total_estimate() == timedelta(minutes=3)
+    queue.add('foo', '0.1', 1.0, timedelta(minutes=5))
+    assert queue.total_estimate() == timedelta(minutes=7)
+
+
+def test_abi_queue():
+    queue = AbiQueue(3)
+    assert not queue
+    queue.add('foo', '0.1', 1.0)
+    queue.add('bar', '0.1', 5.0)
+    queue.add('baz', '0.1', 3.0)
+    assert len(queue) == 3
+    assert ('foo', '0.1') in queue
+    assert list(queue) == [('bar', '0.1'), ('baz', '0.1'), ('foo', '0.1')]
+    queue.add('foo', '0.1', 4.0)
+    assert list(queue) == [('bar', '0.1'), ('foo', '0.1'), ('baz', '0.1')]
+    queue.add('quux', '0.1', 2.0)
+    assert ('quux', '0.1') not in queue
+    queue.add('quux', '0.1', 6.0)
+    assert list(queue) == [('quux', '0.1'), ('bar', '0.1'), ('foo', '0.1')]
+    assert queue.pop() == ('quux', '0.1')
+    queue.remove('bar', '0.1')
+    assert queue.pop() == ('foo', '0.1')
+    with pytest.raises(IndexError):
+        queue.pop()
+    with pytest.raises(KeyError):
+        queue.remove('foo', '0.1')
+
+
+def test_choose_build(task):
+    slaves = [
+        SlaveState(address, timeout, 'cp34', 'cp34m', 'linux_armv7l', label,
+                   0, 1)
+        for address, timeout, label in (
+            (b'1', 300, 'short'),
+            (b'2', 600, 'medium'),
+            (b'3', 3600, 'long'),
+        )
+    ]
+    task.slaves = {slave.address: slave for slave in slaves}
+    queue = task.abi_queues['cp34m']
+    queue.add('long', '1.0', 5.0, timedelta(minutes=20))
+    queue.add('mid', '1.0', 3.0, timedelta(minutes=8))
+    queue.add('short', '1.0', 1.0, timedelta(minutes=1))
+    # Nothing else fits the short slave
+    assert task.choose_build(slaves[0]) == (
+        'short', '1.0', timedelta(minutes=1))
+    with pytest.raises(ValueError):
+        task.choose_build(slaves[0])
+    # The medium slave gets the highest priority build that fits it
+    assert task.choose_build(slaves[1]) == ('mid', '1.0', timedelta(minutes=8))
+    queue.add('mid', '1.0', 3.0, timedelta(minutes=8))
+    # The long slave prefers the build only it can complete
+    queue.add('short', '1.0', 10.0, timedelta(minutes=1))
+    assert task.choose_build(slaves[2]) == (
+        'long', '1.0', timedelta(minutes=20))
+
+
+def test_choose_build_exceeds_all_timeouts(task):
+    task.logger = mock.Mock()
+    slaves = [
+        SlaveState(address, timeout, 'cp34', 'cp34m', 'linux_armv7l', label,
+                   0, 1)
+        for address, timeout, label in (
+            (b'1', 300, 'short'),
+            (b'2', 600, 'medium'),
+        )
+    ]
+    task.slaves = {slave.address: slave for slave in slaves}
+    queue = task.abi_queues['cp34m']
+    for i in range(task.schedule_lookahead):
+        queue.add('huge', str(i), 5.0, timedelta(hours=1))
+    queue.add('short', '1.0', 1.0, timedelta(minutes=1))
+    # The short slave leaves the huge builds for the medium one; with the
+    # lookahead full of them there's nothing else it can see
+    with pytest.raises(ValueError):
+        task.choose_build(slaves[0])
+    # The medium slave has the longest timeout so it gets them regardless
+    for i in range(task.schedule_lookahead):
+        package, version, estimate = task.choose_build(slaves[1])
+        assert (package, estimate) == ('huge', timedelta(hours=1))
+    assert task.logger.warning.call_count == task.schedule_lookahead
+    # And the queue doesn't stay clogged
+    assert task.choose_build(slaves[0]) == (
+        'short', '1.0', timedelta(minutes=1))
+
+
+def test_schedule_stats(task, stats_queue):
+    slave = SlaveState(b'1', 300, 'cp34', 'cp34m', 'linux_armv7l', 'foo', 0, 1)
+    task.slaves = {slave.address: slave}
+    task.abi_queues['cp34m'].add('foo', '0.1', 1.0, timedelta(minutes=1))
+    task.abi_queues['cp34m'].add('bar', '0.1', 1.0, timedelta(minutes=2))
+    task.abi_queues['cp35m'].add('bar', '0.1', 1.0, timedelta(minutes=2))
+    task.estimate_errors.extend([timedelta(seconds=10), timedelta(seconds=20)])
+    task.stats_timestamp = datetime.utcnow() - timedelta(seconds=20)
+    task.loop()
+    assert stats_queue.recv_pyobj() == [
+        'STATSCHED', timedelta(minutes=3), timedelta(seconds=15)]
+
+
 def test_slave_says_idle_when_paused(task, slave_queue, builds_queue,
                                      master_config):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
-    builds_queue.send_pyobj(['cp34m', 'foo', '0.1'])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
     task.poll()
+    builds_queue.recv_pyobj()
     task.pause()
     task.poll()
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
-    assert slave_queue.recv_pyobj() == ['SLEEP']
+    assert not slave_queue.poll(100)
     task.resume()
     task.poll()
-    slave_queue.send_pyobj(['IDLE'])
-    task.poll()
     assert slave_queue.recv_pyobj() == ['BUILD', 'foo', '0.1']
 
 
 def test_slave_says_built_invalid(task, slave_queue, master_config):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
     slave_queue.send_pyobj(['BUILT', False, 5, '', {}])
@@ -371,12 +586,14 @@ def test_slave_says_built_invalid(task, slave_queue, master_config):
 def test_slave_says_built_failed(task, db_queue, slave_queue, builds_queue,
                                  index_queue, master_config):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
-    builds_queue.send_pyobj(['cp34m', 'foo', '0.1'])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
     task.poll()
+    builds_queue.recv_pyobj()
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
     assert slave_queue.recv_pyobj() == ['BUILD', 'foo', '0.1']
@@ -386,7 +603,7 @@ def test_slave_says_built_failed(task, db_queue, slave_queue, builds_queue,
     db_queue.send(['OK', 1])
     task.poll()
     assert task.logger.info.call_count == 2
-    assert index_queue.recv_pyobj() == ['PKG', 'foo']
+    assert index_queue.recv_pyobj() == ['PKG', 'foo', []]
     assert slave_queue.recv_pyobj() == ['DONE']
     db_queue.check()
 
@@ -395,12 +612,14 @@ def test_slave_says_built_succeeded(task, db_queue, fs_queue, slave_queue,
                                     builds_queue, index_queue, master_config,
                                     file_state, file_state_hacked):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
-    builds_queue.send_pyobj(['cp34m', 'foo', '0.1'])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
     task.poll()
+    builds_queue.recv_pyobj()
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
     assert slave_queue.recv_pyobj() == ['BUILD', 'foo', '0.1']
@@ -424,12 +643,62 @@ def test_slave_says_built_succeeded(task, db_queue, fs_queue, slave_queue,
     assert slave_queue.recv_pyobj() == ['SEND', file_state.filename]
     db_queue.check()
     fs_queue.check()
+    assert list(task.estimate_errors) == [timedelta(seconds=55)]
+
+
+def test_slave_says_resume(task, fs_queue, slave_queue, master_config,
+                           file_state):
+    task.logger = mock.Mock()
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
+    slave_queue.send_pyobj([
+        'RESUME', 'foo', '0.1', True, 5, 'Woohoo!',
+        {file_state.filename: file_state[1:8]}
+    ])
+    fs_queue.expect(['EXPECT', 1, file_state])
+    fs_queue.send(['OK', None])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['SEND', file_state.filename]
+    fs_queue.check()
+
+
+def test_slave_says_resume_nothing(task, slave_queue, master_config):
+    task.logger = mock.Mock()
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
+    slave_queue.send_pyobj(['RESUME', 'foo', '0.1', False, 5, '', {}])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['DONE']
+
+
+def test_slave_says_resume_invalid(task, slave_queue, builds_queue,
+                                   master_config):
+    task.logger = mock.Mock()
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', 'foo', '0.1', 1.0, timedelta(minutes=1))]])
+    task.poll()
+    builds_queue.recv_pyobj()
+    slave_queue.send_pyobj(['IDLE'])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['BUILD', 'foo', '0.1']
+    slave_queue.send_pyobj(['RESUME', 'foo', '0.1', False, 5, '', {}])
+    task.poll()
+    assert task.logger.error.call_count == 1
+    assert slave_queue.recv_pyobj() == ['BYE']
 
 
 def test_slave_says_sent_invalid(task, slave_queue, master_config):
     task.logger = mock.Mock()
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
     slave_queue.send_pyobj(['SENT'])
@@ -444,12 +713,14 @@ def test_slave_says_sent_failed(task, db_queue, fs_queue, slave_queue,
     bs = build_state_hacked
     fs1 = [f for f in bs.files.values() if not f.transferred][0]
     fs2 = [f for f in bs.files.values() if f.transferred][0]
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
-    builds_queue.send_pyobj(['cp34m', bs.package, bs.version])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', bs.package, bs.version, 1.0, timedelta(minutes=1))]])
     task.poll()
+    builds_queue.recv_pyobj()
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
     assert slave_queue.recv_pyobj() == ['BUILD', bs.package, bs.version]
@@ -464,7 +735,9 @@ def test_slave_says_sent_failed(task, db_queue, fs_queue, slave_queue,
     assert slave_queue.recv_pyobj() == ['SEND', fs1.filename]
     slave_queue.send_pyobj(['SENT'])
     fs_queue.expect(['VERIFY', 1, bs.package])
-    fs_queue.send(['ERR', IOError()])
+    fs_queue.send(['OK', []])
+    fs_queue.expect(['EXPECT', 1, fs1])
+    fs_queue.send(['OK', None])
     task.poll()
     assert slave_queue.recv_pyobj() == ['SEND', fs1.filename]
     db_queue.check()
@@ -477,12 +750,14 @@ def test_slave_says_sent_succeeded(task, db_queue, fs_queue, slave_queue,
     bs = build_state_hacked
     fs1 = [f for f in bs.files.values() if not f.transferred][0]
     fs2 = [f for f in bs.files.values() if f.transferred][0]
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
-    builds_queue.send_pyobj(['cp34m', bs.package, bs.version])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', bs.package, bs.version, 1.0, timedelta(minutes=1))]])
     task.poll()
+    builds_queue.recv_pyobj()
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
     assert slave_queue.recv_pyobj() == ['BUILD', bs.package, bs.version]
@@ -497,9 +772,10 @@ def test_slave_says_sent_succeeded(task, db_queue, fs_queue, slave_queue,
     assert slave_queue.recv_pyobj() == ['SEND', fs1.filename]
     slave_queue.send_pyobj(['SENT'])
     fs_queue.expect(['VERIFY', 1, bs.package])
-    fs_queue.send(['OK', None])
+    fs_queue.send(['OK', [fs1.filename]])
     task.poll()
-    assert index_queue.recv_pyobj() == ['PKG', bs.package]
+    fs1.verified()
+    assert index_queue.recv_pyobj() == ['PKG', bs.package, bs.index_files]
     assert slave_queue.recv_pyobj() == ['DONE']
     db_queue.check()
     fs_queue.check()
@@ -512,12 +788,15 @@ def test_slave_says_sent_succeeded_more(task, db_queue, fs_queue, slave_queue,
     fs1 = [f for f in bs.files.values() if not f.transferred][0]
     fs2 = [f for f in bs.files.values() if f.transferred][0]
     fs2._transferred = False
-    slave_queue.send_pyobj(['HELLO', 300, 'cp34', 'cp34m',
-                            'linux_armv7l', 'piwheels1'])
+    task.parallel_transfers = False
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
     task.poll()
     assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
-    builds_queue.send_pyobj(['cp34m', bs.package, bs.version])
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', bs.package, bs.version, 1.0, timedelta(minutes=1))]])
     task.poll()
+    builds_queue.recv_pyobj()
     slave_queue.send_pyobj(['IDLE'])
     task.poll()
     assert slave_queue.recv_pyobj() == ['BUILD', bs.package, bs.version]
@@ -534,11 +813,63 @@ def test_slave_says_sent_succeeded_more(task, db_queue, fs_queue, slave_queue,
     assert slave_queue.recv_pyobj() == ['SEND', fs2.filename]
     slave_queue.send_pyobj(['SENT'])
     fs_queue.expect(['VERIFY', 1, bs.package])
-    fs_queue.send(['OK', None])
+    fs_queue.send(['OK', [fs2.filename]])
     fs_queue.expect(['EXPECT', 1, fs1])
     fs_queue.send(['OK', None])
     task.poll()
-    assert index_queue.recv_pyobj() == ['PKG', bs.package]
+    fs2.verified()
+    assert index_queue.recv_pyobj() == ['PKG', bs.package, bs.index_files]
     assert slave_queue.recv_pyobj() == ['SEND', fs1.filename]
     db_queue.check()
     fs_queue.check()
+
+
+def test_slave_says_sent_parallel(task, db_queue, fs_queue, slave_queue,
+                                  builds_queue, index_queue, master_config,
+                                  build_state_hacked):
+    bs = build_state_hacked
+    fs1 = [f for f in bs.files.values() if not f.transferred][0]
+    fs2 = [f for f in bs.files.values() if f.transferred][0]
+    fs2._transferred = False
+    slave_queue.send_pyobj(['HELLO', const.SLAVE_PROTOCOL, 300, 'cp34',
+                            'cp34m', 'linux_armv7l', 'piwheels1', 0, 1])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['HELLO', 1, master_config.pypi_simple]
+    builds_queue.send_pyobj(['QUEUE', [
+        ('cp34m', bs.package, bs.version, 1.0, timedelta(minutes=1))]])
+    task.poll()
+    builds_queue.recv_pyobj()
+    slave_queue.send_pyobj(['IDLE'])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['BUILD', bs.package, bs.version]
+    slave_queue.send_pyobj([
+        'BUILT', bs.status, bs.duration, bs.output, {
+            f.filename: f[1:8] for f in bs.files.values()
+        }
+    ])
+    db_queue.expect(['LOGBUILD', bs])
+    db_queue.send(['OK', 1])
+    fs_queue.expect(['EXPECT', 1, fs2])
+    fs_queue.send(['OK', None])
+    fs_queue.expect(['EXPECT', 1, fs1])
+    fs_queue.send(['OK', None])
+    task.poll()
+    assert slave_queue.recv_pyobj() == ['SEND', fs2.filename, fs1.filename]
+    slave_queue.send_pyobj(['SENT'])
+    fs_queue.expect(['VERIFY', 1, bs.package])
+    fs_queue.send(['OK', [fs1.filename]])
+    fs_queue.expect(['EXPECT', 1, fs2])
+    fs_queue.send(['OK', None])
+    task.poll()
+    fs1.verified()
+    assert index_queue.recv_pyobj() == ['PKG', bs.package, bs.index_files]
+    assert slave_queue.recv_pyobj() == ['SEND', fs2.filename]
+    slave_queue.send_pyobj(['SENT'])
+    fs_queue.expect(['VERIFY', 1, bs.package])
+    fs_queue.send(['OK', [fs2.filename]])
+    task.poll()
+    fs2.verified()
+    assert index_queue.recv_pyobj() == ['PKG', bs.package, bs.index_files]
+    assert slave_queue.recv_pyobj() == ['DONE']
+    db_queue.check()
+    fs_queue.check()
@@ -27,6 +27,8 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import os
+import zlib
 import warnings
 from unittest import mock
 from datetime import datetime, timedelta
@@ -120,9 +122,12 @@ def test_build_state_override_abi(build_state, file_state):
 def test_build_state_transfers(build_state, file_state):
     assert not build_state.transfers_done
     assert build_state.next_file == file_state.filename
+    assert build_state.index_files == []
     build_state.files[build_state.next_file].verified()
     assert build_state.transfers_done
     assert build_state.next_file is None
+    assert build_state.index_files == [
+        (file_state.filename, file_state.filehash, file_state.filesize)]
 
 
 def test_build_state_logged(build_state, file_state):
@@ -136,10 +141,12 @@ def test_slave_state_init():
     with mock.patch('piwheels.master.states.datetime') as dt:
         dt.utcnow.return_value = now
         slave_state = SlaveState('10.0.0.2', 3 * 60 * 60, '34', 'cp34m',
-                                 'linux_armv7l', 'piwheels2')
+                                 'linux_armv7l', 'piwheels2', 0, 1)
         assert slave_state.slave_id == 1
         assert slave_state.address == '10.0.0.2'
         assert slave_state.label == 'piwheels2'
+        assert slave_state.slot == 0
+        assert slave_state.slots == 1
         assert slave_state.timeout == timedelta(hours=3)
         assert slave_state.native_py_version == '34'
         assert slave_state.native_abi == 'cp34m'
@@ -154,7 +161,7 @@ def test_slave_state_init():
 
 def test_slave_state_kill():
     slave_state = SlaveState('10.0.0.2', 3 * 60 * 60, '34', 'cp34m',
-                             'linux_armv7l', 'piwheels2')
+                             'linux_armv7l', 'piwheels2', 0, 1)
     assert not slave_state.terminated
     slave_state.kill()
     assert slave_state.terminated
@@ -162,7 +169,7 @@ def test_slave_state_kill():
 
 def test_slave_state_expired():
     slave_state = SlaveState('10.0.0.2', 3 * 60 * 60, '34', 'cp34m',
-                             'linux_armv7l', 'piwheels2')
+                             'linux_armv7l', 'piwheels2', 0, 1)
     slave_state._first_seen = datetime.utcnow() - timedelta(hours=5)
     assert not slave_state.expired
     slave_state._last_seen = datetime.utcnow() - timedelta(hours=4)
@@ -174,17 +181,17 @@ def test_slave_state_hello(master_status_queue, slave_queue):
         now = datetime.utcnow()
         dt.utcnow.return_value = now
         slave_state = SlaveState('10.0.0.2', 3 * 60 * 60, '34', 'cp34m',
-                                 'linux_armv7l', 'piwheels2')
+                                 'linux_armv7l', 'piwheels2', 0, 1)
         slave_state.reply = ['HELLO', slave_state.slave_id, const.PYPI_XMLRPC]
         assert master_status_queue.recv_pyobj() == [
             slave_state.slave_id, now, 'HELLO',
-            timedelta(hours=3), '34', 'cp34m', 'linux_armv7l', 'piwheels2'
+            timedelta(hours=3), '34', 'cp34m', 'linux_armv7l', 'piwheels2', 0, 1
         ]
 
 
 def test_slave_recv_request(build_state, file_state):
     slave_state = SlaveState('10.0.0.2', 3 * 60 * 60, '34', 'cp34m',
-                             'linux_armv7l', 'piwheels2')
+                             'linux_armv7l', 'piwheels2', 0, 1)
     with mock.patch('piwheels.master.states.datetime') as dt:
         now = datetime.utcnow()
         dt.utcnow.return_value = now
@@ -214,7 +221,7 @@ def test_slave_recv_request(build_state, file_state):
 
 def test_slave_recv_reply(build_state, file_state, slave_queue):
     slave_state = SlaveState('10.0.0.2', 3 * 60 * 60, '34', 'cp34m',
-                             'linux_armv7l', 'piwheels2')
+                             'linux_armv7l', 'piwheels2', 0, 1)
     with mock.patch('piwheels.master.states.datetime') as dt:
         now = datetime.utcnow()
         dt.utcnow.return_value = now
@@ -241,12 +248,12 @@ def test_slave_state_recv_hello(master_status_queue, slave_queue):
         now = datetime.utcnow()
         dt.utcnow.return_value = now
         slave_state = SlaveState('10.0.0.2', 3 * 60 * 60, '34', 'cp34m',
-                                 'linux_armv7l', 'piwheels2')
+                                 'linux_armv7l', 'piwheels2', 0, 1)
         slave_state._reply = ['IDLE']
         slave_state.hello()
         assert master_status_queue.recv_pyobj() == [
             slave_state.slave_id, now, 'HELLO',
-            timedelta(hours=3), '34', 'cp34m', 'linux_armv7l', 'piwheels2'
+            timedelta(hours=3), '34', 'cp34m', 'linux_armv7l', 'piwheels2', 0, 1
         ]
         assert master_status_queue.recv_pyobj() == [
             slave_state.slave_id, None, 'IDLE'
@@ -306,6 +313,42 @@ def test_transfer_verify(tmpdir, file_state, file_content):
     trans_state.verify()
 
 
+def test_transfer_compressed(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    trans_state = TransferState(1, file_state)
+    assert trans_state.codec is None
+    trans_state.negotiate(['bz2', 'zlib'])
+    assert trans_state.codec == 'zlib'
+    r = trans_state.fetch()
+    data = zlib.compress(file_content[r.start:r.stop])
+    trans_state.chunk(r.start, data, 'zlib')
+    assert trans_state.compression_saved == len(r) - len(data)
+    r = trans_state.fetch()
+    trans_state.chunk(r.start, file_content[r.start:r.stop])
+    assert trans_state.done
+    trans_state.verify()
+
+
+def test_transfer_compressed_invalid(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    trans_state = TransferState(1, file_state)
+    trans_state.negotiate(['bz2'])
+    assert trans_state.codec is None
+    r = trans_state.fetch()
+    data = zlib.compress(file_content[r.start:r.stop])
+    with pytest.raises(ValueError):
+        trans_state.chunk(r.start, data, 'zlib')
+    trans_state.negotiate(['zlib'])
+    with pytest.raises(ValueError):
+        trans_state.chunk(r.start, b'foo', 'zlib')
+    with pytest.raises(ValueError):
+        trans_state.chunk(r.start, zlib.compress(b'\0' * 2 ** 24), 'zlib')
+    assert trans_state.compression_saved == 0
+    assert not trans_state.done
+
+
 def test_transfer_verify_fail_size(tmpdir, file_state, file_content):
     tmpdir.mkdir('simple')
     TransferState.output_path = Path(str(tmpdir))
@@ -325,16 +368,224 @@ def test_transfer_verify_fail_hash(tmpdir, file_state, file_content):
     TransferState.output_path = Path(str(tmpdir))
     trans_state = TransferState(1, file_state)
     r = trans_state.fetch()
-    trans_state.chunk(r.start, file_content[r.start:r.stop])
+    trans_state.chunk(r.start, b'\xff\xff' + file_content[r.start + 2:r.stop])
     r = trans_state.fetch()
     trans_state.chunk(r.start, file_content[r.start:r.stop])
     assert trans_state.done
+    with pytest.raises(IOError):
+        trans_state.verify()
+
+
+def test_transfer_verify_out_of_order(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    trans_state = TransferState(1, file_state)
+    trans_state._credit = 10  # hack the credit
+    r1 = trans_state.fetch()
+    r2 = trans_state.fetch()
+    trans_state.chunk(r2.start, file_content[r2.start:r2.stop])
+    assert trans_state._hashed == 0
+    trans_state.chunk(r1.start, file_content[r1.start:r1.stop])
+    assert trans_state._hashed == len(file_content)
+    assert trans_state.done
+    # Hashing is complete so corruption of the file after the fact isn't
+    # detected; verify shouldn't re-read the file
     trans_state._file.seek(0)
     trans_state._file.write(b'\xff\xff')
+    trans_state.verify()
+
+
+def test_transfer_verify_gaps(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    trans_state = TransferState(1, file_state)
+    trans_state.hash_buffer = 0
+    trans_state._credit = 10  # hack the credit
+    r1 = trans_state.fetch()
+    r2 = trans_state.fetch()
+    trans_state.chunk(r2.start, file_content[r2.start:r2.stop])
+    trans_state.chunk(r1.start, file_content[r1.start:r1.stop])
+    trans_state.chunk(r2.start, b'\xff' * len(r2))  # ignored duplicate
+    assert trans_state._hashed == r1.stop
+    assert trans_state.done
+    trans_state.verify()
+    assert trans_state._hashed == len(file_content)
+
+
+def test_transfer_verify_gaps_fail_hash(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    trans_state = TransferState(1, file_state)
+    trans_state.hash_buffer = 0
+    trans_state._credit = 10  # hack the credit
+    r1 = trans_state.fetch()
+    r2 = trans_state.fetch()
+    trans_state.chunk(r2.start, file_content[r2.start:r2.stop])
+    trans_state.chunk(r1.start, file_content[r1.start:r1.stop])
+    trans_state._file.seek(r2.start)
+    trans_state._file.write(b'\xff\xff')
     with pytest.raises(IOError):
         trans_state.verify()
 
 
+def test_transfer_adapt_grow(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    with mock.patch('piwheels.master.states.monotonic') as monotonic:
+        monotonic.return_value = 1000.0
+        trans_state = TransferState(1, file_state)
+        trans_state._fetch_size = 1024
+        trans_state.min_chunk_size = 256
+        trans_state.max_pipeline_size = 12
+        trans_state.reset_credit()
+        assert trans_state.window == 10
+        sizes = set()
+        while not trans_state.done:
+            ranges = []
+            r = trans_state.fetch()
+            while r:
+                ranges.append(r)
+                r = trans_state.fetch()
+            monotonic.return_value += 0.01
+            for r in ranges:
+                sizes.add(len(r))
+                trans_state.chunk(r.start, file_content[r.start:r.stop])
+        assert trans_state.rtt == pytest.approx(0.01)
+        assert trans_state.fetch_size > 1024
+        assert 2048 in sizes
+        assert trans_state.throughput > 0
+    trans_state.verify()
+
+
+def test_transfer_adapt_backoff(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    with mock.patch('piwheels.master.states.monotonic') as monotonic:
+        monotonic.return_value = 1000.0
+        trans_state = TransferState(1, file_state)
+        trans_state._fetch_size = 1024
+        trans_state.min_chunk_size = 256
+        trans_state.reset_credit()
+        ranges = [trans_state.fetch() for i in range(10)]
+        assert trans_state.fetch() is None
+        monotonic.return_value += 0.01
+        r = ranges.pop(0)
+        trans_state.chunk(r.start, file_content[r.start:r.stop])
+        assert trans_state.window == 10
+        # A ballooning round-trip time halves the window, but only once per
+        # round-trip
+        monotonic.return_value += 0.05
+        for r in ranges[:2]:
+            trans_state.chunk(r.start, file_content[r.start:r.stop])
+        assert trans_state.window == 5
+        # The credit from the remaining requests in flight must be repaid
+        # before fetching further chunks
+        assert trans_state.fetch() is None
+        for r in ranges[2:4]:
+            trans_state.chunk(r.start, file_content[r.start:r.stop])
+        assert trans_state.fetch() is None
+        trans_state.chunk(ranges[4].start,
+                          file_content[ranges[4].start:ranges[4].stop])
+        assert trans_state.fetch()
+
+
+def test_transfer_adapt_jitter(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    with mock.patch('piwheels.master.states.monotonic') as monotonic:
+        monotonic.return_value = 1000.0
+        trans_state = TransferState(1, file_state)
+        trans_state._fetch_size = 1024
+        trans_state.reset_credit()
+        ranges = [trans_state.fetch() for i in range(10)]
+        # Round-trip times varying between 0.1ms and 1ms are well over double
+        # the lowest seen, but that's just jitter on a fast link
+        for delay, r in zip([0.0001, 0.001] * 5, ranges):
+            monotonic.return_value += delay
+            trans_state.chunk(r.start, file_content[r.start:r.stop])
+        assert trans_state.window >= 10
+
+
+def test_transfer_adapt_restart(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    trans_state = TransferState(1, file_state)
+    trans_state._fetch_size = 1024
+    trans_state.min_chunk_size = 256
+    trans_state.min_pipeline_size = 4
+    trans_state.reset_credit()
+    assert trans_state.window == 10
+    assert trans_state.fetch()
+    # Restarting after lost requests halves the window and then, once the
+    # window can't shrink further, the chunk size
+    trans_state.reset_credit()
+    assert trans_state.window == 5
+    assert trans_state.fetch()
+    trans_state.reset_credit()
+    assert trans_state.window == 5
+    assert trans_state.fetch_size == 512
+    # Restarting without anything in flight changes nothing
+    trans_state.reset_credit()
+    assert trans_state.window == 5
+    assert trans_state.fetch_size == 512
+
+
+def test_transfer_checkpoint_resume(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    trans_state = TransferState(1, file_state)
+    trans_state.fetch()
+    trans_state.chunk(0, file_content[:65536])
+    trans_state.checkpoint()
+    checkpoints = TransferState.checkpoints()
+    assert checkpoints == {
+        (file_state.filename, file_state.filehash): (
+            Path(trans_state._file.name), [range(65536, 123456)])
+    }
+    trans_state._file.close()
+    trans_state = TransferState(
+        2, file_state, resume=checkpoints[file_state.filename, file_state.filehash])
+    assert trans_state.remaining == 123456 - 65536
+    assert trans_state.fetch() == range(65536, 65536 + 57920)
+    trans_state.chunk(65536, file_content[65536:])
+    assert trans_state.done
+    trans_state.verify()
+    trans_state.commit('foo')
+    assert not TransferState.checkpoints()
+    assert not list((TransferState.output_path / 'simple').glob('*.state'))
+
+
+def test_transfer_checkpoint_interval(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    with mock.patch('piwheels.master.states.monotonic') as monotonic:
+        monotonic.return_value = 1000.0
+        trans_state = TransferState(1, file_state)
+        trans_state.fetch()
+        trans_state.chunk(0, file_content[:65536])
+        assert not TransferState.checkpoints()
+        monotonic.return_value = 1010.0
+        trans_state.fetch()
+        trans_state.chunk(65536, file_content[65536:100000])
+        assert len(TransferState.checkpoints()) == 1
+    trans_state._file.close()
+    trans_state.rollback()
+    assert not TransferState.checkpoints()
+
+
+def test_transfer_checkpoint_expired(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    trans_state = TransferState(1, file_state)
+    trans_state.checkpoint()
+    trans_state._file.close()
+    state_path = Path(trans_state._file.name + '.state')
+    os.utime(str(state_path), (0, 0))
+    assert not TransferState.checkpoints()
+    assert not state_path.exists()
+    assert not Path(trans_state._file.name).exists()
+
+
 def test_transfer_rollback(tmpdir, file_state, file_content):
     tmpdir.mkdir('simple')
     TransferState.output_path = Path(str(tmpdir))
@@ -360,6 +611,48 @@ def test_transfer_commit(tmpdir, file_state, file_content):
     assert final_path.exists()
 
 
+def test_transfer_dedup(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    source = TransferState.output_path / 'simple' / 'bar' / file_state.filename
+    source.parent.mkdir()
+    source.write_bytes(file_content)
+    trans_state = TransferState(1, file_state, source)
+    assert trans_state.deduplicated
+    assert trans_state.done
+    assert trans_state.fetch() is None
+    trans_state.verify()
+    final_path = trans_state.commit('foo')
+    assert final_path == TransferState.output_path / 'simple' / 'foo' / file_state.filename
+    assert final_path.read_bytes() == file_content
+    assert final_path.samefile(source)
+    assert not Path(trans_state._file.name).exists()
+
+
+def test_transfer_dedup_same_file(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    source = TransferState.output_path / 'simple' / 'foo' / file_state.filename
+    source.parent.mkdir()
+    source.write_bytes(file_content)
+    trans_state = TransferState(1, file_state, source)
+    trans_state.verify()
+    assert trans_state.commit('foo') == source
+    assert source.read_bytes() == file_content
+    assert not Path(trans_state._file.name).exists()
+
+
+def test_transfer_dedup_fail_size(tmpdir, file_state, file_content):
+    tmpdir.mkdir('simple')
+    TransferState.output_path = Path(str(tmpdir))
+    source = TransferState.output_path / 'simple' / 'bar' / file_state.filename
+    source.parent.mkdir()
+    source.write_bytes(file_content[:1000])
+    trans_state = TransferState(1, file_state, source)
+    with pytest.raises(IOError):
+        trans_state.verify()
+
+
 def test_transfer_commit_override_symlink(tmpdir, file_state, file_content):
     tmpdir.mkdir('simple')
     TransferState.output_path = Path(str(tmpdir))
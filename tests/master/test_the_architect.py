@@ -26,6 +26,9 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+from datetime import datetime, timedelta
+from unittest import mock
+
 import zmq
 import pytest
 
@@ -41,17 +44,112 @@ def task(request, master_config):
 
 @pytest.fixture(scope='function')
 def builds_queue(request, zmq_context, master_config):
-    queue = zmq_context.socket(zmq.PULL)
+    queue = zmq_context.socket(zmq.REP)
     queue.connect(master_config.builds_queue)
     yield queue
     queue.close()
 
 
+@pytest.fixture(scope='function')
+def stats_queue(request, zmq_context, master_config):
+    queue = zmq_context.socket(zmq.PULL)
+    queue.bind(master_config.stats_queue)
+    yield queue
+    queue.close()
+
+
 def test_architect_queue(db, with_build, task, builds_queue):
+    task.loop()  # No credit yet; just asks for some
+    assert builds_queue.recv_pyobj() == ['QUEUE', []]
+    builds_queue.send_pyobj(['CREDIT', 10])
+    task.poll()
+    assert task.credit == 10
+    task.next_feed = datetime.utcnow()
     task.loop()
-    assert builds_queue.recv_pyobj() == ('cp35m', 'foo', '0.1')
+    msg, batch = builds_queue.recv_pyobj()
+    assert msg == 'QUEUE'
+    assert [row[:3] for row in batch] == [('cp35m', 'foo', '0.1')]
+    builds_queue.send_pyobj(['CREDIT', 9])
+    task.poll()
     with db.begin():
         db.execute("DELETE FROM builds")
-    task.loop()  # Empty loop on StopIteration
+    task.loop()  # Query was exhausted, so this waits
+    task.next_feed = datetime.utcnow()
+    task.loop()
+    msg, batch = builds_queue.recv_pyobj()
+    assert msg == 'QUEUE'
+    assert [row[:3] for row in batch] == [('cp34m', 'foo', '0.1')]
+
+
+def test_architect_batch_size(db, with_build, task, builds_queue):
+    task.batch_size = 1
+    task.credit = 10
+    task.loop()
+    msg, batch = builds_queue.recv_pyobj()
+    assert msg == 'QUEUE'
+    assert [row[:3] for row in batch] == [('cp35m', 'foo', '0.1')]
+    builds_queue.send_pyobj(['CREDIT', 0])
+    task.poll()
+    task.loop()  # No credit; waits before asking again
+    task.next_feed = datetime.utcnow()
+    task.loop()
+    assert builds_queue.recv_pyobj() == ['QUEUE', []]
+
+
+def test_architect_requery(db, with_build, task, builds_queue):
+    task.credit = 10
+    task.loop()
+    msg, batch = builds_queue.recv_pyobj()
+    assert [row[:3] for row in batch] == [('cp35m', 'foo', '0.1')]
+    builds_queue.send_pyobj(['CREDIT', 10])
+    task.poll()
+    with db.begin():
+        db.execute(
+            "INSERT INTO versions(package, version) VALUES ('foo', '0.2')")
+    task.query_timestamp = datetime.utcnow() - timedelta(minutes=2)
+    task.next_feed = datetime.utcnow()
+    task.loop()
+    msg, batch = builds_queue.recv_pyobj()
+    assert {row[:3] for row in batch} == {
+        ('cp35m', 'foo', '0.1'), ('cp34m', 'foo', '0.2')}
+
+
+def test_architect_reprioritize(db, with_build, task, builds_queue):
+    with db.begin():
+        db.execute("UPDATE build_queue SET priority = 0")
+    task.credit = 10
+    task.loop()
+    msg, batch = builds_queue.recv_pyobj()
+    assert [row[:4] for row in batch] == [('cp35m', 'foo', '0.1', 0)]
+    builds_queue.send_pyobj(['CREDIT', 10])
+    task.poll()
+    task.reprioritize_timestamp = datetime.utcnow() - timedelta(hours=2)
+    task.next_feed = datetime.utcnow()
+    task.loop()
+    msg, batch = builds_queue.recv_pyobj()
+    assert [row[:3] for row in batch] == [('cp35m', 'foo', '0.1')]
+    # foo 0.1 was only just added so it has (nearly) the full recency bonus
+    assert 2.9 < batch[0][3] <= 3
+
+
+def test_architect_bad_credit(db, with_build, task, builds_queue):
+    task.logger = mock.Mock()
+    task.loop()
+    assert builds_queue.recv_pyobj() == ['QUEUE', []]
+    builds_queue.send_pyobj(['FOO'])
+    task.poll()
+    assert task.credit == 0
+    assert task.logger.error.call_args == mock.call(
+        'invalid credit message: %s', 'FOO')
+
+
+def test_architect_feed_stats(db, with_build, task, builds_queue,
+                              stats_queue):
+    task.fed_count = 50
+    task.fed_timestamp = datetime.utcnow() - timedelta(seconds=20)
+    task.next_feed = datetime.utcnow() + timedelta(seconds=10)
     task.loop()
-    assert builds_queue.recv_pyobj() == ('cp34m', 'foo', '0.1')
+    msg, rate = stats_queue.recv_pyobj()
+    assert msg == 'STATFEED'
+    assert 2 < rate <= 2.5
+    assert task.fed_count == 0
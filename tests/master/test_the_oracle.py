@@ -184,14 +184,27 @@ def test_db_delete_build(db, with_build, db_client):
 
 def test_get_package_files(db, with_files, build_state_hacked, db_client):
     assert {
-        (r.filename, r.filehash)
+        (r.filename, r.filehash, r.filesize)
         for r in db_client.get_package_files('foo')
     } == {
-        (r.filename, r.filehash)
+        (r.filename, r.filehash, r.filesize)
         for r in build_state_hacked.files.values()
     }
 
 
+def test_get_packages_files(db, with_files, build_state_hacked, db_client):
+    files = db_client.get_packages_files(['foo', 'bar'])
+    assert files.keys() == {'foo', 'bar'}
+    assert {
+        (r.filename, r.filehash, r.filesize)
+        for r in files['foo']
+    } == {
+        (r.filename, r.filehash, r.filesize)
+        for r in build_state_hacked.files.values()
+    }
+    assert files['bar'] == []
+
+
 def test_get_version_files(db, with_files, build_state_hacked, db_client):
     assert db_client.get_version_files('foo', '0.1') == build_state_hacked.files.keys()
 
@@ -0,0 +1,115 @@
+# The piwheels project
+#   Copyright (c) 2017 Ben Nuttall <https://github.com/bennuttall>
+#   Copyright (c) 2017 Dave Jones <dave@waveform.org.uk>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+from pathlib import Path
+
+import pytest
+
+from piwheels.master.index_scribe import render_package_index
+from piwheels.rebuild import FileRow, rebuild_package
+
+
+@pytest.fixture()
+def output_path(request, tmpdir):
+    path = Path(str(tmpdir))
+    (path / 'simple').mkdir()
+    return path
+
+
+@pytest.fixture()
+def files(request):
+    return [
+        FileRow('foo-0.1-cp34-cp34m-linux_armv7l.whl', '123456123456', 1024),
+        FileRow('foo-0.1-cp34-cp34m-linux_armv6l.whl', '123456123456', 1024),
+    ]
+
+
+def test_rebuild_package(output_path, files):
+    assert rebuild_package(output_path, 'foo', files)
+    index = output_path / 'simple' / 'foo' / 'index.html'
+    assert index.read_text(encoding='utf-8') == ''.join(
+        render_package_index('foo', files))
+    pkg_json = json.loads(
+        (output_path / 'simple' / 'foo' / 'index.json').read_text(
+            encoding='utf-8'))
+    assert [f['filename'] for f in pkg_json['files']] == [
+        f.filename for f in files]
+    assert not (output_path / 'simple' / 'foo' / 'index.html.gz').exists()
+
+
+def test_rebuild_package_unchanged(output_path, files):
+    assert rebuild_package(output_path, 'foo', files)
+    index = output_path / 'simple' / 'foo' / 'index.html'
+    inode = index.stat().st_ino
+    assert not rebuild_package(output_path, 'foo', files)
+    assert index.stat().st_ino == inode
+    assert rebuild_package(output_path, 'foo', files, force=True)
+    assert index.stat().st_ino != inode
+    inode = index.stat().st_ino
+    assert rebuild_package(output_path, 'foo', files[:1])
+    assert index.stat().st_ino != inode
+
+
+def test_rebuild_package_missing_json(output_path, files):
+    assert rebuild_package(output_path, 'foo', files)
+    (output_path / 'simple' / 'foo' / 'index.json').unlink()
+    assert rebuild_package(output_path, 'foo', files)
+    assert (output_path / 'simple' / 'foo' / 'index.json').exists()
+
+
+def test_rebuild_package_stale_json(output_path, files):
+    assert rebuild_package(output_path, 'foo', files)
+    index_json = output_path / 'simple' / 'foo' / 'index.json'
+    index_json.write_text('{"meta": {"api-version": "1.0"}}',
+                          encoding='utf-8')
+    assert rebuild_package(output_path, 'foo', files)
+    assert json.loads(index_json.read_text(encoding='utf-8'))['files']
+
+
+def test_rebuild_package_gzip(output_path, files):
+    assert rebuild_package(output_path, 'foo', files, gzip_output=True)
+    assert (output_path / 'simple' / 'foo' / 'index.html.gz').exists()
+    assert (output_path / 'simple' / 'foo' / 'index.json.gz').exists()
+
+
+def test_rebuild_package_missing_gzip(output_path, files):
+    pkg_dir = output_path / 'simple' / 'foo'
+    # Indexes written before gzip_output was enabled are re-written
+    assert rebuild_package(output_path, 'foo', files)
+    assert rebuild_package(output_path, 'foo', files, gzip_output=True)
+    assert not rebuild_package(output_path, 'foo', files, gzip_output=True)
+    # As are those missing a compressed copy
+    (pkg_dir / 'index.json.gz').unlink()
+    assert rebuild_package(output_path, 'foo', files, gzip_output=True)
+    assert (pkg_dir / 'index.json.gz').exists()
+    # And stale copies are removed when gzip_output is disabled
+    assert rebuild_package(output_path, 'foo', files)
+    assert not (pkg_dir / 'index.html.gz').exists()
+    assert not (pkg_dir / 'index.json.gz').exists()